@@ -4,89 +4,286 @@
 Encoding support for Moana TD sensors.
 """
 
-import numpy as np
 import xarray as xr
 import os
 from eccodes import (
     codes_set,
     codes_set_array,
-    codes_write,
-    codes_release,
-    codes_bufr_new_from_samples,
     codes_set_missing,
-    codes_gts_header
+    codes_get_message,
+    codes_gts_header,
 )
-from eccodes import *
-from GTS_encode.utils import pres, extract_upcast, generate_identifier, break_down_wmo_id, increment_identifier_number
-import pdb
+from GTS_encode.utils import generate_identifier, break_down_wmo_id, set_identifier_number
+from GTS_encode.reader import read_profile, read_casts
+from GTS_encode.sequence import SequenceAllocator
+from GTS_encode.dedup import message_hash
+from GTS_encode.handles import HANDLES, HEADER_CACHE
+from GTS_encode.plans import PLAN_CACHE
+from GTS_encode.metrics import NULL_METRICS
 import datetime
 
 
+def allocate_identifier(outdir, day, hour, minute, sequence_dir=None):
+    """
+    Returns the `IOVEnn NZKL DDHHMM` heading with the next free bulletin number.
+
+    Args:
+        outdir (str): The output directory.
+        day, hour, minute (int): The time of the heading.
+        sequence_dir (str, optional): Directory of the bulletin number counters.
+            Defaults to None, which keeps them in `outdir`/.sequence.
+
+    Returns:
+        str: The identifier of the bulletin.
+    """
+    identifier = generate_identifier(str(day).zfill(2), str(hour).zfill(2), str(minute).zfill(2))
+    heading = identifier.split(" ", 1)[1]
+    allocator = SequenceAllocator(sequence_dir or os.path.join(outdir, ".sequence"))
+    return set_identifier_number(identifier, allocator.next_number(heading))
+
+
+def format_bulletin(identifier, message):
+    """
+    Returns the complete bulletin, the `001` and identifier lines followed by the message.
+
+    Args:
+        identifier (str): The `IOVEnn NZKL DDHHMM` heading.
+        message (bytes): The packed BUFR message.
+
+    Returns:
+        bytes: The bulletin as written to disk or sent to the message switch.
+    """
+    heading = "001" + os.linesep + identifier + os.linesep
+    return heading.encode("ascii") + bytes(message)
+
+
+def bulletin_filename(outdir, identifier):
+    """Path of the bulletin named after its identifier"""
+    return os.path.join(outdir, ".".join([identifier.replace(" ","_"), "bufr"]))
+
+
+def encode_gts_bulletin(
+    message, outdir, day, hour, minute, sequence_dir=None, metrics=NULL_METRICS, dedup=None
+):
+    """
+    Returns the GTS bulletin of a packed message, named with the next free number.
+
+    The bulletin starts with the `001` and `IOVEnn NZKL DDHHMM` lines, the
+    IOVEnn number coming from the sequence allocator of the output directory.
+    A message `dedup` already holds is skipped before a number is allocated,
+    the others are recorded in it under the name of their bulletin.
+
+    Args:
+        message (bytes): The packed BUFR message.
+        outdir (str): The output directory.
+        day, hour, minute (int): The time of the heading.
+        sequence_dir (str, optional): Directory of the bulletin number counters.
+            Defaults to None, which keeps them in `outdir`/.sequence.
+        metrics (CycleMetrics, optional): Counts the duplicates and the
+            names already taken.
+        dedup (DedupStore, optional): The messages already produced. Defaults
+            to None, which encodes every message.
+
+    Returns:
+        tuple: The identifier and the bulletin, (None, None) if the message
+            is a duplicate.
+    """
+    key = None
+    if dedup is not None:
+        key = dedup.claim(message)
+        if key is None:
+            metrics.count("duplicates_skipped")
+            print("Skipped duplicate of BUFR file ", dedup.lookup(message))
+            return None, None
+    try:
+        # The allocator gives the next free number, a name is only taken by
+        # a file left from before the counter existed
+        identifier = allocate_identifier(outdir, day, hour, minute, sequence_dir)
+        while os.path.exists(bulletin_filename(outdir, identifier)):
+            metrics.count("collision_retries")
+            identifier = allocate_identifier(outdir, day, hour, minute, sequence_dir)
+    except Exception:
+        if key is not None:
+            dedup.release(key)
+        raise
+    if key is not None:
+        dedup.record(key, bulletin_filename(outdir, identifier))
+    return identifier, format_bulletin(identifier, message)
+
+
+def write_bulletin(outdir, identifier, bulletin, metrics=NULL_METRICS):
+    """
+    Writes a bulletin in `outdir` named after its identifier, the default sink
+    of the bulletins from `encode_gts_bulletin`.
+
+    Args:
+        outdir (str): The output directory.
+        identifier (str): The `IOVEnn NZKL DDHHMM` heading of the bulletin.
+        bulletin (bytes): The complete bulletin.
+        metrics (CycleMetrics, optional): Counts the bytes written.
+
+    Returns:
+        str: The output filename.
+    """
+    output_filename = bulletin_filename(outdir, identifier)
+    with open(output_filename, "xb") as f:
+        metrics.count("bytes_written", f.write(bulletin))
+        print("Created output BUFR file ", f)
+    return output_filename
+
+
+class MemorySink(object):
+    """
+    Keeps the bulletins in memory instead of writing them, e.g. for an
+    upload pipeline that sends them straight away.
+
+    Called as `write_bulletin`, `bulletins` maps the name each bulletin
+    would have been written as to its bytes.
+    """
+
+    def __init__(self):
+        self.bulletins = {}
+
+    def __call__(self, outdir, identifier, bulletin, metrics=NULL_METRICS):
+        output_filename = bulletin_filename(outdir, identifier)
+        self.bulletins[output_filename] = bulletin
+        return output_filename
+
+
+def save_bulletin(sink, outdir, identifier, bulletin, metrics=NULL_METRICS, dedup=None):
+    """
+    Hands a bulletin from `encode_gts_bulletin` to its sink.
+
+    A bulletin the sink could not take is dropped from `dedup`, so it is
+    produced again by the next cycle.
+
+    Args:
+        sink (callable): Called as `write_bulletin`, None to write the bulletin.
+        outdir (str): The output directory.
+        identifier (str): The `IOVEnn NZKL DDHHMM` heading of the bulletin.
+        bulletin (bytes): The complete bulletin.
+        metrics (CycleMetrics, optional): Given to the sink.
+        dedup (DedupStore, optional): The messages already produced.
+
+    Returns:
+        str: The name the bulletin is kept as.
+    """
+    try:
+        return (sink or write_bulletin)(outdir, identifier, bulletin, metrics)
+    except Exception:
+        if dedup is not None:
+            dedup.release(message_hash(bulletin))
+        raise
+
+
 class GTS_encode_subfloat:
-    def __init__(self, filename, database_dict, upcast=True, QC_flag=1):
+    sample = "BUFR4"
+    spec = "315003"
+    header_cache = HEADER_CACHE
+    plan_cache = PLAN_CACHE
+
+    def __init__(
+        self,
+        filename,
+        database_dict,
+        upcast=True,
+        QC_flag=1,
+        ds=None,
+        metrics=None,
+        thinning=None,
+        bulk=True,
+    ):
         self.filename = filename
         self.dict = database_dict
         self.upcast = upcast
         self.qcflag = QC_flag
+        self.ds = ds
+        self.metrics = metrics or NULL_METRICS
+        self.thinning = thinning
+        self.bulk = bulk
     def create_variables_from_netcdf(self):
-        self.ds = xr.open_dataset(self.filename)
-        self.df = self.ds.to_dataframe()
-        if self.qcflag == 1:
-            QC = np.where(self.df["QC_FLAG"] == self.qcflag)[0]
-        elif len(self.qcflag) == 2:
-            QC = np.where(
-                (self.df["QC_FLAG"] == self.qcflag[0])
-                | (self.df["QC_FLAG"] == self.qcflag[1])
-            )[0]
-        self.df = self.df.iloc[QC]
-        if self.upcast:
-            self.df = extract_upcast(self.df)
-        self.df["PRESSURE"] = pres(self.df["DEPTH"], self.df["LATITUDE"])
-        self.years = self.df.index.year.values
-        self.months = self.df.index.month.values
-        self.days = self.df.index.day.values
-        self.hours = self.df.index.hour.values
-        self.minutes = self.df.index.minute.values
-        self.seconds = self.df.index.second.values
-        self.latitudes = self.df["LATITUDE"].values
-        self.longitudes = self.df["LONGITUDE"].values
-        self.pressures = np.round(self.df["PRESSURE"].values, 2)
-        self.temperatures = self.df["TEMPERATURE"].values + 273.15
+        if self.ds is None:
+            self.ds = xr.open_dataset(self.filename)
+        profile = read_profile(self.ds, self.qcflag, self.upcast, self.thinning)
+        self.years = profile["years"]
+        self.months = profile["months"]
+        self.days = profile["days"]
+        self.hours = profile["hours"]
+        self.minutes = profile["minutes"]
+        self.seconds = profile["seconds"]
+        self.latitudes = profile["latitudes"]
+        self.longitudes = profile["longitudes"]
+        self.pressures = profile["pressures"]
+        self.depths = profile["depths"]
+        self.temperatures = profile["temperatures"]
         self.output_filename = self.filename[0:-3] + ".bufr"
-    def create_bufr_file(self):
+    def plan_values(self):
+        """The values the 315003 spec takes from the profile and the metadata"""
+        return {
+            "years": self.years,
+            "months": self.months,
+            "days": self.days,
+            "hours": self.hours,
+            "minutes": self.minutes,
+            "latitudes": self.latitudes,
+            "longitudes": self.longitudes,
+            "pressures": self.pressures,
+            "temperatures": self.temperatures,
+            "direction": 0 if self.upcast else 3,
+            "internal_ship_id": self.dict.get("internal ship id"),
+            "sensor_model": self.dict.get("sensor model"),
+            "sensor_serial": self.dict.get("sensor serial"),
+        }
+    def create_bufr_message(self):
+        if self.bulk:
+            plan = self.plan_cache.get(
+                self.spec,
+                len(self.depths),
+                self.header_cache,
+                centre_code=int(self.dict.get("centre code")),
+            )
+            return plan.new_message(self.plan_values())
         VERBOSE = 1  # verbose error reporting
-        ibufr = codes_bufr_new_from_samples("BUFR4")
+        ################################################
+        #########Section 3, DataDescription ############
+        ################################################
+        ibufr = self.header_cache.new_message(
+            self.sample,
+            [
+                ("edition", 4),
+                ("masterTableNumber", 0),
+                ("bufrHeaderSubCentre", 0),
+                ("bufrHeaderCentre", int(self.dict.get("centre code"))),
+                ("updateSequenceNumber", 0),
+                ("dataCategory", 31),  # CREX Table A 31 -> Oceanographic Data
+                # ("dataSubCategory", 182) #International data-subcategory
+                ("masterTablesVersionNumber", 28),  # Latest version 28 -> 15 November 2021
+                ##8
+                ("localTablesVersionNumber", 0),
+                ("numberOfSubsets", 1),
+                ("observedData", 1),
+                ("compressedData", 0),
+            ],
+            [len(self.depths)],
+            [315003],
+        )
+        try:
+            return self._set_reference_keys(ibufr)
+        except Exception:
+            HANDLES.release(ibufr)
+            raise
+
+    def _set_reference_keys(self, ibufr):
+        """Sets the keys of the reference implementation after the header"""
         codes_gts_header(True)
         #######################################
         #########Section 1, Header ############
         #######################################
-        codes_set(ibufr, "edition", 4)
-        codes_set(ibufr, "masterTableNumber", 0)
-        codes_set(ibufr, "bufrHeaderSubCentre", 0)
-        codes_set(ibufr, "bufrHeaderCentre", int(self.dict.get("centre code")))
-        codes_set(ibufr, "updateSequenceNumber", 0)
-        codes_set(ibufr, "dataCategory", 31)  # CREX Table A 31 -> Oceanographic Data
-        # codes_set(ibufr, "dataSubCategory", 182) #International data-subcategory
-        codes_set(
-            ibufr, "masterTablesVersionNumber", 28
-        )  # Latest version 28 -> 15 November 2021
-        ##8
-        codes_set(ibufr, "localTablesVersionNumber", 0)
         codes_set(ibufr, "typicalYear", int(self.years[0]))
         codes_set(ibufr, "typicalMonth", int(self.months[0]))
         codes_set(ibufr, "typicalDay", int(self.days[0]))
         codes_set(ibufr, "typicalHour", int(self.hours[0]))
         codes_set(ibufr, "typicalMinute", int(self.minutes[0]))
-        codes_set(ibufr, "numberOfSubsets", 1)
-        codes_set(ibufr, "observedData", 1)
-        codes_set(ibufr, "compressedData", 0)
-        ################################################
-        #########Section 3, DataDescription ############
-        ################################################
-        codes_set(
-            ibufr, "inputExtendedDelayedDescriptorReplicationFactor", len(self.df)
-        )
-        codes_set(ibufr, "unexpandedDescriptors", 315003)
         # Create the structure of the data section
         codes_set(
             ibufr, "marineObservingPlatformIdentifier", self.dict.get("internal ship id")
@@ -124,7 +321,7 @@ class GTS_encode_subfloat:
         codes_set_missing(ibufr, "salinity")  # NO Salinity Data
         ### This bit includes the quality flags for each measurement
         ## There's three because there is a quality flag for depth, for temperature and for salinity
-        for i in range(0, len(self.df) * 3, 3):
+        for i in range(0, len(self.depths) * 3, 3):
             key1 = "#" + str(i + 1) + "#QualifierForGTSPPQualityFlag"
             key2 = "#" + str(i + 2) + "#QualifierForGTSPPQualityFlag"
             key3 = "#" + str(i + 3) + "#QualifierForGTSPPQualityFlag"
@@ -145,32 +342,71 @@ class GTS_encode_subfloat:
                 ibufr, key2G, 9
             )  # CODE-Table 0 33 050 -> 9 Good for operational use Missing value
             codes_set(ibufr, key3G, 15)  # CODE-Table 0 33 050 -> 15 Missing value
-        # Encode the keys back in the data section
-        codes_set(ibufr, "pack", 1)
-        # Create output file
-#        output_filename = open(self.output_filename, "wb")
-        name = generate_identifier()
-        output_filename = ".".join([name, "bufr"])
-        with open(output_filename, "w") as f:
-            f.write(name + os.linesep )
-        output_filename = open(output_filename, "ab")
-        # Write encoded data into a file and close
-        codes_write(ibufr, output_filename)
-        print("Created output BUFR file ", output_filename)
-        codes_release(ibufr)
-        output_filename.close()
+        return ibufr
+
+    def create_bufr_file(self):
+        with self.metrics.stage("message"):
+            ibufr = self.create_bufr_message()
+        try:
+            # Encode the keys back in the data section
+            codes_set(ibufr, "pack", 1)
+            # Create output file
+#            output_filename = open(self.output_filename, "wb")
+            name = generate_identifier()
+            output_filename = ".".join([name, "bufr"])
+            with open(output_filename, "w") as f:
+                f.write(name + os.linesep )
+            with open(output_filename, "ab") as output_filename:
+                # Write encoded data into a file and close
+                codes_write(ibufr, output_filename)
+                print("Created output BUFR file ", output_filename)
+        finally:
+            HANDLES.release(ibufr)
         # a = 'BUFR'
         # with open(output_filename, "w") as f:
         #     for line in f:
         #         if a in line:
         #             line = line.replace(a, '')
     def run(self):
-        self.create_variables_from_netcdf()
+        with self.metrics.stage("read"):
+            self.create_variables_from_netcdf()
+        self.metrics.count("samples", len(self.depths))
         self.create_bufr_file()
 
+    def close(self):
+        """Closes the dataset, also the one given to the constructor"""
+        if self.ds is not None:
+            self.ds.close()
+            self.ds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
 class GTS_encode_ship:
-    def __init__(self, filename, centre_code, outdir, upcast=True, QC_flag=1):
+    sample = "BUFR4_local"
+    spec = "315007"
+    header_cache = HEADER_CACHE
+    plan_cache = PLAN_CACHE
+
+    def __init__(
+        self,
+        filename,
+        centre_code,
+        outdir,
+        upcast=True,
+        QC_flag=1,
+        bulk=True,
+        ds=None,
+        sequence_dir=None,
+        metrics=None,
+        thinning=None,
+        dedup=None,
+        sink=None,
+    ):
         """
         Initialize a GTS_encode object.
 
@@ -179,100 +415,167 @@ class GTS_encode_ship:
             centre_code (int): Code Table value for the centre code.
             upcast (bool, optional): Whether to just choose the upcast. Defaults to True.
             QC_flag (int, optional): The QC flag. Defaults to 1.
+            bulk (bool, optional): Whether to encode with the compiled plan of the
+                315007 spec instead of setting each key and level in turn.
+                Defaults to True.
+            ds (xarray.Dataset, optional): The already open dataset of `filename`.
+                Defaults to None, in which case the file is opened.
+            sequence_dir (str, optional): Directory of the bulletin number counters.
+                Defaults to None, which keeps them in `outdir`/.sequence.
+            metrics (CycleMetrics, optional): Records the time of each stage and
+                the samples and bytes encoded. Defaults to None, which records nothing.
+            thinning (tuple, optional): Method and value of `thin_profile` applied
+                to the profile before encoding, e.g. ("bins", 1.0). Defaults to
+                None, which encodes every level.
+            dedup (DedupStore, optional): The messages already produced, which
+                are not written again. Defaults to None, which writes every message.
+            sink (callable, optional): Takes each bulletin as `write_bulletin`
+                does, e.g. a MemorySink. Defaults to None, which writes them
+                in `outdir`.
         """
         self.filename = filename
         self.centre_code = centre_code
         self.outdir = outdir
         self.upcast = upcast
         self.qcflag = QC_flag
-        
+        self.bulk = bulk
+        self.ds = ds
+        self.sequence_dir = sequence_dir
+        self.metrics = metrics or NULL_METRICS
+        self.thinning = thinning
+        self.dedup = dedup
+        self.sink = sink
+
     def create_variables_from_netcdf(self):
         """
         Creates variables from a NetCDF file.
 
-        This method opens the NetCDF file specified by `filename` and extracts
-        the required variables for further processing. It performs quality control
-        checks based on the `qcflag` parameter and filters the data accordingly.
-        If `upcast` is True, it extracts the upcast data. Finally, it assigns the
-        extracted variables to instance variables for later use.
-
-        """
-        self.ds = xr.open_dataset(self.filename)
-        self.df = self.ds.to_dataframe()
-        if self.qcflag == 1:
-            QC = np.where(self.df["QC_FLAG"] == self.qcflag)[0]
-        elif len(self.qcflag) == 2:
-            QC = np.where(
-                (self.df["QC_FLAG"] == self.qcflag[0])
-                | (self.df["QC_FLAG"] == self.qcflag[1])
-            )[0]
-        self.df = self.df.iloc[QC]
-        if self.upcast:
-            self.df = extract_upcast(self.df)
-        self.df["PRESSURE"] = pres(self.df["DEPTH"], self.df["LATITUDE"])
-        self.years = self.df.index.year.values
-        self.months = self.df.index.month.values
-        self.days = self.df.index.day.values
-        self.hours = self.df.index.hour.values
-        self.minutes = self.df.index.minute.values
-        self.seconds = self.df.index.second.values
-        self.latitudes = self.df["LATITUDE"].values
-        self.longitudes = self.df["LONGITUDE"].values
-        self.pressures = np.round(self.df["PRESSURE"].values, 2)
-        self.depths = self.df["DEPTH"].values
-        self.temperatures = self.df["TEMPERATURE"].values + 273.15
+        This method opens the NetCDF file specified by `filename`, unless an open
+        dataset was given, and reads only the variables required for further
+        processing as arrays. It performs quality control checks based on the
+        `qcflag` parameter and filters the data accordingly before the other
+        variables are loaded. If `upcast` is True, it extracts the upcast data.
+        Finally, it assigns the extracted variables to instance variables for later use.
+
+        """
+        if self.ds is None:
+            self.ds = xr.open_dataset(self.filename)
+        self.set_profile(read_profile(self.ds, self.qcflag, self.upcast, self.thinning))
         self.output_filename = self.filename[0:-3] + ".bufr"
+
+    def set_profile(self, profile):
+        """
+        Sets the arrays of the profile to encode.
+
+        Args:
+            profile (dict): A profile from `read_profile` or `read_casts`.
+        """
+        self.years = profile["years"]
+        self.months = profile["months"]
+        self.days = profile["days"]
+        self.hours = profile["hours"]
+        self.minutes = profile["minutes"]
+        self.seconds = profile["seconds"]
+        self.latitudes = profile["latitudes"]
+        self.longitudes = profile["longitudes"]
+        self.pressures = profile["pressures"]
+        self.depths = profile["depths"]
+        self.temperatures = profile["temperatures"]
+        self.direction = profile["direction"]
         self.profile_name = self.filename.split("_")[-2]
-        
-    def create_bufr_file(self):
+
+    def plan_values(self):
         """
-        Creates a BUFR file with the specified data.
+        Returns:
+            dict: The values the 315007 spec takes from the profile and the
+                file attributes.
+        """
+        id_series, issuer_of_identifier, issue_number, local_id = break_down_wmo_id(self.ds.wigos_id)
+        return {
+            "years": self.years,
+            "months": self.months,
+            "days": self.days,
+            "hours": self.hours,
+            "minutes": self.minutes,
+            "latitudes": self.latitudes,
+            "longitudes": self.longitudes,
+            "pressures": self.pressures,
+            "depths": self.depths,
+            "temperatures": self.temperatures,
+            "direction": self.direction,
+            "wigos_series": int(id_series),
+            "wigos_issuer": int(issuer_of_identifier),
+            "wigos_issue_number": int(issue_number),
+            "wigos_local_id": local_id,
+            "internal_id": self.ds.internal_id,
+            "platform_code": self.ds.platform_code,
+            "profile_id": self.profile_name[5::],
+            "total_depth": self.depths.max(),
+            # data must be provided in cm
+            "surface_depth": self.depths[-1] * 100,
+            "serial_number": self.ds.moana_serial_number,
+        }
+
+    def create_bufr_message(self):
+        """
+        Creates the BUFR message with the specified data, before it is packed.
 
-        This method generates a BUFR file using the provided data and settings. It sets the necessary headers,
-        data descriptions, and data sections for the file. The generated BUFR file can be used
-        for further processing or transmission.
+        With `bulk`, the message is built by the compiled plan of the 315007
+        spec. Otherwise each header, data description and data key is set in
+        turn, which is kept as the reference implementation of the spec.
 
         Returns:
-            BUFR file: A BUFR file containing the specified data.
+            int: The ecCodes handle of the message, to be released by the caller.
         """
+        if self.bulk:
+            plan = self.plan_cache.get(
+                self.spec, len(self.depths), self.header_cache, centre_code=self.centre_code
+            )
+            return plan.new_message(self.plan_values())
         VERBOSE = 1  # verbose error reporting
-        ibufr = codes_bufr_new_from_samples("BUFR4_local")
+        ################################################
+        #########Section 3, DataDescription ############
+        ################################################
+        # Each value of replication factor relates to the observations of the profiles,
+        # as we don't have values for the current and dissolved oxygen profile the replication factor is set to 1.
+        # In case this data was to be added the number of replications should be updated
+        # according to the number of measurements for these profles.
+        ibufr = self.header_cache.new_message(
+            self.sample,
+            [
+                ("edition", 4),
+                ("masterTableNumber", 0),
+                ("bufrHeaderSubCentre", 0),
+                ("bufrHeaderCentre", self.centre_code),
+                ("updateSequenceNumber", 0),
+                ("dataCategory", 31),  # CREX Table A 31 -> Oceanographic Data
+                # ("dataSubCategory", 182) #International data-subcategory
+                ("masterTablesVersionNumber", 28),  # Latest version 28 -> 15 November 2021
+                ("localTablesVersionNumber", 0),
+                ("numberOfSubsets", 1),
+                ("observedData", 1),
+                ("compressedData", 0),
+            ],
+            [len(self.depths), 1, 1],
+            [1125, 1126, 1127, 1128, 315007],
+        )
+        try:
+            return self._set_reference_keys(ibufr)
+        except Exception:
+            HANDLES.release(ibufr)
+            raise
+
+    def _set_reference_keys(self, ibufr):
+        """Sets the keys of the reference implementation after the header"""
         codes_gts_header(True)
         #######################################
         #########Section 1, Header ############
         #######################################
-        codes_set(ibufr, "edition", 4)
-        codes_set(ibufr, "masterTableNumber", 0)
-        codes_set(ibufr, "bufrHeaderSubCentre", 0)
-        codes_set(ibufr, "bufrHeaderCentre", self.centre_code)
-        codes_set(ibufr, "updateSequenceNumber", 0)
-        codes_set(ibufr, "dataCategory", 31)  # CREX Table A 31 -> Oceanographic Data
-        # codes_set(ibufr, "dataSubCategory", 182) #International data-subcategory
-        codes_set(
-            ibufr, "masterTablesVersionNumber", 28
-        )  # Latest version 28 -> 15 November 2021
-        codes_set(ibufr, "localTablesVersionNumber", 0)
         codes_set(ibufr, "typicalYear", int(self.years[0]))
         codes_set(ibufr, "typicalMonth", int(self.months[0]))
         codes_set(ibufr, "typicalDay", int(self.days[0]))
         codes_set(ibufr, "typicalHour", int(self.hours[0]))
         codes_set(ibufr, "typicalMinute", int(self.minutes[0]))
-        codes_set(ibufr, "numberOfSubsets", 1)
-        codes_set(ibufr, "observedData", 1)
-        codes_set(ibufr, "compressedData", 0)
-        ################################################
-        #########Section 3, DataDescription ############
-        ################################################
-        # Each value of replication factor relates to the observations of the profiles,
-        # as we don't have values for the current and dissolved oxygen profile the replication factor is set to 1.
-        # In case this data was to be added the number of replications should be updated
-        # according to the number of measurements for these profles.
-        codes_set_array(
-            ibufr,
-            "inputExtendedDelayedDescriptorReplicationFactor",
-            [len(self.df), 1, 1],
-        )
-        codes_set_array(ibufr, "unexpandedDescriptors", [1125, 1126, 1127, 1128, 315007])
         ############################################
         # Create the structure of the data section #
         ############################################
@@ -358,40 +661,12 @@ class GTS_encode_ship:
         )
         codes_set(ibufr, "#2#methodOfSalinityOrDepthMeasurement", 1)
         codes_set(ibufr, "#1#indicatorForDigitization", 0)
-        if self.upcast:
-            codes_set(ibufr, "#1#directionOfProfile", 0)  # Code-Table 0-> upward
-        else:
-            codes_set(
-                ibufr, "#1#directionOfProfile", 3
-            )  # Code-Table 3 -> missing value
+        # Code-Table 0 -> upward, 1 -> downward, 3 -> missing value
+        codes_set(ibufr, "#1#directionOfProfile", self.direction)
         codes_set(ibufr, "#1#methodOfDepthCalculation", 1)
         ### This bit includes the quality flags and data for each measurement
-        ## Quality flags must be cycled every four, as the four variables need an associated QF
-        for count, i in enumerate(range(0, len(self.df) * 4, 4)):
-            key1 = "#" + str(i + 1) + "#QualifierForGTSPPQualityFlag"
-            key2 = "#" + str(i + 2) + "#QualifierForGTSPPQualityFlag"
-            key3 = "#" + str(i + 3) + "#QualifierForGTSPPQualityFlag"
-            key4 = "#" + str(i + 4) + "#QualifierForGTSPPQualityFlag"
-            key1G = "#" + str(i + 1) + "#GlobalGTSPPQualityFlag"
-            key2G = "#" + str(i + 2) + "#GlobalGTSPPQualityFlag"
-            key3G = "#" + str(i + 3) + "#GlobalGTSPPQualityFlag"
-            key4G = "#" + str(i + 4) + "#GlobalGTSPPQualityFlag"
-            depth_key = "#" + str(count + 3) + "#depthBelowWaterSurface"
-            pressure_key = "#" + str(count + 1) + "#waterPressure"
-            temp_key = "#" + str(count + 2) + "#oceanographicWaterTemperature"
-            salt_key = "#" + str(count + 2) + "#salinity"
-            codes_set(ibufr, depth_key, self.depths[count])
-            codes_set(ibufr, key1, 13)  # Depth Quality Flags
-            codes_set(ibufr, key1G, 9)  # Depth Quality Flags
-            codes_set(ibufr, pressure_key, self.pressures[count])
-            codes_set(ibufr, key2, 10)  # Pressure Quality Flags
-            codes_set(ibufr, key2G, 9)  # Pressure Quality Flags
-            codes_set(ibufr, temp_key, self.temperatures[count])
-            codes_set(ibufr, key3, 11)  # Temperature Quality Flags
-            codes_set(ibufr, key3G, 9)  # Temperature Quality Flags
-            codes_set_missing(ibufr, salt_key)
-            codes_set(ibufr, key4, 63)  # Salinity Quality Flags/Missing data
-            codes_set(ibufr, key4G, 15)  # Salinity Quality Flags/Missing data
+        self._encode_profile_loop(ibufr)
+        count = len(self.depths) - 1
         ### This bit includes the quality flags for each measurement
         ## There's three because there is a quality flag for depth, for temperature and for salinity
         ##Current profile
@@ -406,7 +681,6 @@ class GTS_encode_ship:
         codes_set_missing(ibufr, "#2#methodOfDepthCalculation")
         codes_set_missing(ibufr, "#" + str(count + 4) + "#depthBelowWaterSurface")
         codes_set_missing(ibufr, "#" + str(count + 2) + "#waterPressure")
-        codes_set_missing(ibufr, "#2#waterPressure")
         codes_set_missing(ibufr, "#1#speedOfCurrent")
         codes_set_missing(ibufr, "#1#CurrentDirection")
         ##Dissolved oxygen data
@@ -419,109 +693,262 @@ class GTS_encode_ship:
             ibufr, "#1#instrumentTypeOrSensorForDissolvedOxygenMeasurement"
         )
         codes_set_missing(ibufr, "#1#oceanographicDissolvedOxygen")
-        # Encode the keys back in the data section #
-        ############################################
-        codes_set(ibufr, "pack", 1)
-        # Create output file #
-        ######################
-        self.identifier = generate_identifier(str(self.days[-1]).zfill(2), str(self.hours[-1]).zfill(2), str(self.minutes[-1]).zfill(2))
-        self.output_filename = os.path.join(self.outdir, ".".join([self.identifier.replace(" ","_"), "bufr"]))
-        while os.path.exists(self.output_filename):
-            self.output_filename = increment_identifier_number(self.output_filename)
-        with open(self.output_filename, "w") as f:
-            f.write("001"+os.linesep+self.identifier+os.linesep)
-
-        output_filename = open(self.output_filename, "ab")
-        
-        # Write encoded data into a file and close
-        codes_write(ibufr, output_filename)
-        print("Created output BUFR file ", output_filename)
-        codes_release(ibufr)
-        output_filename.close()
+        return ibufr
+
+    def create_bufr_file(self):
+        """
+        Creates a BUFR file with the specified data.
+
+        The bulletin from `encode_bulletin` is handed to the sink, which
+        writes it in `outdir` unless another sink was given.
+
+        Returns:
+            str: The output filename, None if the message is a duplicate.
+        """
+        with self.metrics.stage("message"):
+            bulletin = self.encode_bulletin()
+        if bulletin is None:
+            return None
+        with self.metrics.stage("write"):
+            self.output_filename = save_bulletin(
+                self.sink, self.outdir, self.identifier, bulletin, self.metrics, self.dedup
+            )
         return self.output_filename
-                  
+
+    def encode_bulletin(self):
+        """
+        Encodes the profile into a complete bulletin without writing it to disk.
+
+        The bulletin number is allocated and the message checked against
+        `dedup`, so the bytes can be uploaded directly or handed to a sink
+        under the name in `output_filename`, as `create_bufr_file` does.
+
+        Returns:
+            bytes: The `001` and identifier lines followed by the BUFR message,
+                None if the message is a duplicate.
+        """
+        ibufr = self.create_bufr_message()
+        try:
+            codes_set(ibufr, "pack", 1)
+            message = codes_get_message(ibufr)
+        finally:
+            HANDLES.release(ibufr)
+        self.identifier, bulletin = encode_gts_bulletin(
+            message,
+            self.outdir,
+            self.days[-1],
+            self.hours[-1],
+            self.minutes[-1],
+            sequence_dir=self.sequence_dir,
+            metrics=self.metrics,
+            dedup=self.dedup,
+        )
+        self.output_filename = (
+            bulletin_filename(self.outdir, self.identifier) if self.identifier else None
+        )
+        return bulletin
+
+    def _encode_profile_loop(self, ibufr):
+        """
+        Encodes the temperature and salinity profile one level at a time.
+
+        Kept as the reference implementation of the 315007 spec levels.
+        """
+        ## Quality flags must be cycled every four, as the four variables need an associated QF
+        for count, i in enumerate(range(0, len(self.depths) * 4, 4)):
+            key1 = "#" + str(i + 1) + "#QualifierForGTSPPQualityFlag"
+            key2 = "#" + str(i + 2) + "#QualifierForGTSPPQualityFlag"
+            key3 = "#" + str(i + 3) + "#QualifierForGTSPPQualityFlag"
+            key4 = "#" + str(i + 4) + "#QualifierForGTSPPQualityFlag"
+            key1G = "#" + str(i + 1) + "#GlobalGTSPPQualityFlag"
+            key2G = "#" + str(i + 2) + "#GlobalGTSPPQualityFlag"
+            key3G = "#" + str(i + 3) + "#GlobalGTSPPQualityFlag"
+            key4G = "#" + str(i + 4) + "#GlobalGTSPPQualityFlag"
+            depth_key = "#" + str(count + 3) + "#depthBelowWaterSurface"
+            pressure_key = "#" + str(count + 1) + "#waterPressure"
+            temp_key = "#" + str(count + 2) + "#oceanographicWaterTemperature"
+            salt_key = "#" + str(count + 2) + "#salinity"
+            codes_set(ibufr, depth_key, self.depths[count])
+            codes_set(ibufr, key1, 13)  # Depth Quality Flags
+            codes_set(ibufr, key1G, 9)  # Depth Quality Flags
+            codes_set(ibufr, pressure_key, self.pressures[count])
+            codes_set(ibufr, key2, 10)  # Pressure Quality Flags
+            codes_set(ibufr, key2G, 9)  # Pressure Quality Flags
+            codes_set(ibufr, temp_key, self.temperatures[count])
+            codes_set(ibufr, key3, 11)  # Temperature Quality Flags
+            codes_set(ibufr, key3G, 9)  # Temperature Quality Flags
+            codes_set_missing(ibufr, salt_key)
+            codes_set(ibufr, key4, 63)  # Salinity Quality Flags/Missing data
+            codes_set(ibufr, key4G, 15)  # Salinity Quality Flags/Missing data
+
     def run(self):
         """
         Runs the GTS_encode process.
 
         This method creates variables from a NetCDF file and creates a BUFR file.
         """
-        self.create_variables_from_netcdf()
+        with self.metrics.stage("read"):
+            self.create_variables_from_netcdf()
+        self.metrics.count("samples", len(self.depths))
         filename = self.create_bufr_file()
         return filename
 
+    def run_casts(self, threshold=1.0):
+        """
+        Encodes every cast of the deployment as its own bulletin.
+
+        Args:
+            threshold (float, optional): Minimum depth change, in metres, for a
+                movement to count as a cast. Defaults to 1.0.
+
+        Returns:
+            list: The output filenames, one per cast that is not a duplicate.
+        """
+        with self.metrics.stage("read"):
+            if self.ds is None:
+                self.ds = xr.open_dataset(self.filename)
+            casts = read_casts(self.ds, self.qcflag, threshold, self.thinning)
+        filenames = []
+        for profile in casts:
+            self.set_profile(profile)
+            self.metrics.count("samples", len(self.depths))
+            filename = self.create_bufr_file()
+            if filename is not None:
+                filenames.append(filename)
+        return filenames
+
+    def close(self):
+        """Closes the dataset, also the one given to the constructor"""
+        if self.ds is not None:
+            self.ds.close()
+            self.ds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
 class GTS_encode_glider:
-    def __init__(self, filename, database_dict, upcast=True, QC_flag=1):
+    sample = "BUFR3_local"
+    spec = "315012"
+    header_cache = HEADER_CACHE
+    plan_cache = PLAN_CACHE
+
+    def __init__(
+        self,
+        filename,
+        centre_code,
+        outdir,
+        upcast=True,
+        QC_flag=1,
+        bulk=True,
+        ds=None,
+        sequence_dir=None,
+        metrics=None,
+        thinning=None,
+        dedup=None,
+        sink=None,
+    ):
+        """
+        Initialize a GTS_encode_glider object.
+
+        Takes the arguments of GTS_encode_ship, the bulletins are written in
+        `outdir` and named after their heading in the same way.
+        """
         self.filename = filename
-        self.dict = database_dict
+        self.centre_code = centre_code
+        self.outdir = outdir
         self.upcast = upcast
         self.qcflag = QC_flag
+        self.bulk = bulk
+        self.ds = ds
+        self.sequence_dir = sequence_dir
+        self.metrics = metrics or NULL_METRICS
+        self.thinning = thinning
+        self.dedup = dedup
+        self.sink = sink
 
     def create_variables_from_netcdf(self):
-        self.ds = xr.open_dataset(self.filename)
-        self.df = self.ds.to_dataframe()
-        if self.qcflag == 1:
-            QC = np.where(self.df["QC_FLAG"] == self.qcflag)[0]
-        elif len(self.qcflag) == 2:
-            QC = np.where(
-                (self.df["QC_FLAG"] == self.qcflag[0])
-                | (self.df["QC_FLAG"] == self.qcflag[1])
-            )[0]
-        self.df = self.df.iloc[QC]
-        if self.upcast:
-            self.df = extract_upcast(self.df)
-        self.df["PRESSURE"] = pres(self.df["DEPTH"], self.df["LATITUDE"])
-        self.years = self.df.index.year.values
-        self.months = self.df.index.month.values
-        self.days = self.df.index.day.values
-        self.hours = self.df.index.hour.values
-        self.minutes = self.df.index.minute.values
-        self.seconds = self.df.index.second.values
-        self.latitudes = self.df["LATITUDE"].values
-        self.longitudes = self.df["LONGITUDE"].values
-        self.pressures = np.round(self.df["PRESSURE"].values, 2)
-        self.depths = self.df["DEPTH"].values
-        self.temperatures = self.df["TEMPERATURE"].values + 273.15
-        self.output_filename = self.filename[0:-3] + ".bufr"
+        if self.ds is None:
+            self.ds = xr.open_dataset(self.filename)
+        self.set_profile(read_profile(self.ds, self.qcflag, self.upcast, self.thinning))
+
+    def set_profile(self, profile):
+        """
+        Sets the arrays of the profile to encode.
+
+        Args:
+            profile (dict): A profile from `read_profile` or `read_casts`.
+        """
+        self.years = profile["years"]
+        self.months = profile["months"]
+        self.days = profile["days"]
+        self.hours = profile["hours"]
+        self.minutes = profile["minutes"]
+        self.seconds = profile["seconds"]
+        self.latitudes = profile["latitudes"]
+        self.longitudes = profile["longitudes"]
+        self.pressures = profile["pressures"]
+        self.depths = profile["depths"]
+        self.temperatures = profile["temperatures"]
+        self.direction = profile["direction"]
         self.profile_name = self.filename.split("_")[-2]
 
-    def create_bufr_file(self):
+    def plan_values(self):
+        """
+        Returns:
+            dict: The values the 315012 spec takes from the trajectory and the
+                file attributes.
+        """
+        return {
+            "years": self.years,
+            "months": self.months,
+            "days": self.days,
+            "hours": self.hours,
+            "minutes": self.minutes,
+            "latitudes": self.latitudes,
+            "longitudes": self.longitudes,
+            "pressures": self.pressures,
+            "depths": self.depths,
+            "temperatures": self.temperatures,
+            "direction": self.direction,
+            "year_of_century": int(str(self.years[0])[2::]),
+            "deck_unit_serial_number": self.ds.deck_unit_serial_number,
+            "profile_id": self.profile_name[5::],
+        }
+
+    def create_bufr_message(self):
+        if self.bulk:
+            plan = self.plan_cache.get(
+                self.spec, len(self.depths), self.header_cache, centre_code=self.centre_code
+            )
+            return plan.new_message(self.plan_values())
         VERBOSE = 1  # verbose error reporting
-        ibufr = codes_bufr_new_from_samples("BUFR3_local")
-        #######################################
-        #########Section 1, Header ############
-        #######################################
-        codes_set(ibufr, "edition", 3)
-        codes_set(ibufr, "masterTableNumber", 0)
-        codes_set(ibufr, "bufrHeaderSubCentre", 0)
-        codes_set(ibufr, "bufrHeaderCentre", self.centre_code)
-        codes_set(ibufr, "updateSequenceNumber", 0)
-        codes_set(ibufr, "dataCategory", 31)  # CREX Table A 31 -> Oceanographic Data
-        # codes_set(ibufr, "dataSubCategory", 182) #International data-subcategory
-        codes_set(
-            ibufr, "masterTablesVersionNumber", 28
-        )  # Latest version 28 -> 15 November 2021
-        codes_set(ibufr, "localTablesVersionNumber", 0)
-        codes_set(ibufr, "typicalYearOfCentury", int(str(self.years[0])[2::]))
-        codes_set(ibufr, "typicalMonth", int(self.months[0]))
-        codes_set(ibufr, "typicalDay", int(self.days[0]))
-        codes_set(ibufr, "typicalHour", int(self.hours[0]))
-        codes_set(ibufr, "typicalMinute", int(self.minutes[0]))
-        codes_set(ibufr, "numberOfSubsets", 1)
-        codes_set(ibufr, "observedData", 1)
-        codes_set(ibufr, "compressedData", 0)
         ################################################
         #########Section 3, DataDescription ############
         ################################################
         # First number is the number of directions, second number is the number of measurements
-        codes_set_array(
-            ibufr, "inputExtendedDelayedDescriptorReplicationFactor", [len(self.df)]
-        )
+        replication_factor = [len(self.depths)]
         # As this template is not officially released we included each of the descriptors manually
-        codes_set_array(
-            ibufr,
-            "unexpandedDescriptors",
+        ibufr = self.header_cache.new_message(
+            self.sample,
+            [
+                ("edition", 3),
+                ("masterTableNumber", 0),
+                ("bufrHeaderSubCentre", 0),
+                ("bufrHeaderCentre", self.centre_code),
+                ("updateSequenceNumber", 0),
+                ("dataCategory", 31),  # CREX Table A 31 -> Oceanographic Data
+                # ("dataSubCategory", 182) #International data-subcategory
+                ("masterTablesVersionNumber", 28),  # Latest version 28 -> 15 November 2021
+                ("localTablesVersionNumber", 0),
+                ("numberOfSubsets", 1),
+                ("observedData", 1),
+                ("compressedData", 0),
+            ],
+            replication_factor,
             [
                 201129,
                 1087,
@@ -579,6 +1006,22 @@ class GTS_encode_glider:
                 33050,
             ],
         )
+        try:
+            return self._set_reference_keys(ibufr)
+        except Exception:
+            HANDLES.release(ibufr)
+            raise
+
+    def _set_reference_keys(self, ibufr):
+        """Sets the keys of the reference implementation after the header"""
+        #######################################
+        #########Section 1, Header ############
+        #######################################
+        codes_set(ibufr, "typicalYearOfCentury", int(str(self.years[0])[2::]))
+        codes_set(ibufr, "typicalMonth", int(self.months[0]))
+        codes_set(ibufr, "typicalDay", int(self.days[0]))
+        codes_set(ibufr, "typicalHour", int(self.hours[0]))
+        codes_set(ibufr, "typicalMinute", int(self.minutes[0]))
         # Create the structure of the data section
         codes_set(ibufr, "observingPlatformManufacturerModel", "Moana TD")
         codes_set(
@@ -604,14 +1047,71 @@ class GTS_encode_glider:
         codes_set(ibufr, "#2#latitude", self.latitudes[-1])
         codes_set(ibufr, "#2#longitude", self.longitudes[-1])
         codes_set(ibufr, "#1#uniqueIdentifierForProfile", self.profile_name[5::])
-        if self.upcast:
-            codes_set(ibufr, "#1#directionOfProfile", 0)
-        else:
-            codes_set(ibufr, "#1#directionOfProfile", 3)  # CODE-Table 3-> Missing value
+        # CODE-Table 0 -> upward, 1 -> downward, 3 -> Missing value
+        codes_set(ibufr, "#1#directionOfProfile", self.direction)
         #####################################
         #########Section 4, Data ############
         #####################################
-        for count, i in enumerate(range(0, len(self.df) * 6, 6)):
+        self._encode_trajectory_loop(ibufr)
+        return ibufr
+
+    def create_bufr_file(self):
+        """
+        Hands the bulletin from `encode_bulletin` to the sink, which writes
+        it in `outdir` unless another sink was given.
+
+        Returns:
+            str: The output filename, None if the message is a duplicate.
+        """
+        with self.metrics.stage("message"):
+            bulletin = self.encode_bulletin()
+        if bulletin is None:
+            return None
+        with self.metrics.stage("write"):
+            self.output_filename = save_bulletin(
+                self.sink, self.outdir, self.identifier, bulletin, self.metrics, self.dedup
+            )
+        return self.output_filename
+
+    def encode_bulletin(self):
+        """
+        Encodes the trajectory into a complete bulletin without writing it to disk.
+
+        As for GTS_encode_ship, the bulletin number is allocated and the
+        message checked against `dedup`.
+
+        Returns:
+            bytes: The `001` and identifier lines followed by the BUFR message,
+                None if the message is a duplicate.
+        """
+        ibufr = self.create_bufr_message()
+        try:
+            codes_set(ibufr, "pack", 1)
+            message = codes_get_message(ibufr)
+        finally:
+            HANDLES.release(ibufr)
+        self.identifier, bulletin = encode_gts_bulletin(
+            message,
+            self.outdir,
+            self.days[-1],
+            self.hours[-1],
+            self.minutes[-1],
+            sequence_dir=self.sequence_dir,
+            metrics=self.metrics,
+            dedup=self.dedup,
+        )
+        self.output_filename = (
+            bulletin_filename(self.outdir, self.identifier) if self.identifier else None
+        )
+        return bulletin
+
+    def _encode_trajectory_loop(self, ibufr):
+        """
+        Encodes the trajectory points one at a time.
+
+        Kept as the reference implementation of the 315012 spec points.
+        """
+        for count, i in enumerate(range(0, len(self.depths) * 6, 6)):
             key1 = "#" + str(i + 1) + "#QualifierForGTSPPQualityFlag"
             key2 = "#" + str(i + 2) + "#QualifierForGTSPPQualityFlag"
             key3 = "#" + str(i + 3) + "#QualifierForGTSPPQualityFlag"
@@ -660,16 +1160,46 @@ class GTS_encode_glider:
             codes_set_missing(ibufr, salt_key)
             codes_set(ibufr, key6, 63)  # Salinity Quality Flags/Missing data
             codes_set(ibufr, key6G, 15)  # Salinity Quality Flags/Missing data
-        # Encode the keys back in the data section
-        codes_set(ibufr, "pack", 1)
-        # Create output file
-        output_filename = open(self.output_filename, "wb")
-        # Write encoded data into a file and close
-        codes_write(ibufr, output_filename)
-        print("Created output BUFR file ", output_filename)
-        codes_release(ibufr)
-        output_filename.close
 
     def run(self):
-        self.create_variables_from_netcdf()
-        self.create_bufr_file()
+        with self.metrics.stage("read"):
+            self.create_variables_from_netcdf()
+        self.metrics.count("samples", len(self.depths))
+        filename = self.create_bufr_file()
+        return filename
+
+    def run_casts(self, threshold=1.0):
+        """
+        Encodes every cast of the deployment as its own bulletin.
+
+        Args:
+            threshold (float, optional): Minimum depth change, in metres, for a
+                movement to count as a cast. Defaults to 1.0.
+
+        Returns:
+            list: The output filenames, one per cast that is not a duplicate.
+        """
+        with self.metrics.stage("read"):
+            if self.ds is None:
+                self.ds = xr.open_dataset(self.filename)
+            casts = read_casts(self.ds, self.qcflag, threshold, self.thinning)
+        filenames = []
+        for profile in casts:
+            self.set_profile(profile)
+            self.metrics.count("samples", len(self.depths))
+            filename = self.create_bufr_file()
+            if filename is not None:
+                filenames.append(filename)
+        return filenames
+
+    def close(self):
+        """Closes the dataset, also the one given to the constructor"""
+        if self.ds is not None:
+            self.ds.close()
+            self.ds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,14 +1,14 @@
 import os
 import logging
 import json
-import numpy as np
-import pandas as pd
-import xarray as xr
-import seawater as sw
 import datetime as dt
-from glob import glob
 import importlib
-xr.set_options(keep_attrs=True)
+from GTS_encode.metadata import DatasetMetadata
+from GTS_encode.index import EligibilityIndex
+from GTS_encode.dedup import DedupStore
+from GTS_encode.sequence import SequenceAllocator
+from GTS_encode.spool import TransferSpool
+from GTS_encode.metrics import CycleMetrics, NULL_METRICS, resident_memory
 
 cycle_dt = dt.datetime.utcnow()
 
@@ -16,6 +16,21 @@ def keep_numbers_only(s):
     return ''.join(c for c in s if c.isdigit())
 
 
+def load_template(GTS_template):
+    """
+    Returns a template class of `GTS_encode.GTS_encode`.
+
+    The encoding module pulls in ecCodes, numpy and xarray, so it is only
+    imported once a file has to be encoded, and cycles with nothing to
+    publish never load it.
+
+    Args:
+        GTS_template (str): The name of the template class.
+    """
+    GTS_encode_module = importlib.import_module("GTS_encode.GTS_encode")
+    return getattr(GTS_encode_module, GTS_template)
+
+
 class Wrapper(object):
     """
     A class that wraps the GTS encoding functionality.
@@ -26,10 +41,67 @@ class Wrapper(object):
         GTS_template (str): The GTS template to be used for encoding.
         centre_code (int): The center code for the GTS encoding.
         logger (logging.Logger): The logger object for logging messages.
+        index_path (str): JSON file keeping the publication decision of each file
+            between cycles, unchanged files are then skipped. Defaults to None.
+        workers (int): Number of processes encoding files in parallel. Defaults to 1,
+            which encodes the files one after another in this process.
+        aggregate (bool): Whether to collect the profiles of a cycle into multi-subset
+            bulletins instead of one bulletin per file. Defaults to False.
+        max_subsets (int): Maximum number of profiles in an aggregated bulletin.
+            Defaults to 100.
+        metrics (bool): Whether to record the wall time of each stage, the samples
+            encoded, the bytes written and the name collisions, logged as JSON for
+            each file and for the cycle. Defaults to False.
+        metrics_path (str): JSON file where the cycle metrics are written, formatted
+            with the cycle time like `filelist_json`. Defaults to None.
+        casts (bool): Whether to split each file into its down and up casts, each
+            encoded as its own profile, instead of encoding the last upcast only.
+            Defaults to False.
+        cast_threshold (float): Minimum depth change in metres for a movement of
+            the instrument to count as a cast. Defaults to 1.0.
+        thinning (list): Method and value of the thinning applied to each profile
+            before encoding, e.g. ["bins", 1.0] for one level per metre,
+            ["significant", 0.05] for the levels needed to keep the temperature
+            within 0.05 K, or ["max", 500] for at most 500 levels. Defaults to
+            None, which encodes every level.
+        upload_server (str): URL of the message switch queue. When set, each
+            bulletin is uploaded from memory as soon as it is encoded while the
+            next files are, and only written once uploaded or spooled. Defaults
+            to None, leaving the upload to the transfer task.
+        upload_queue (int): Maximum number of bulletins waiting to be uploaded
+            before the encoding waits. Defaults to 8.
+        spool_path (str): The directory of the transfer task, where bulletins
+            that could not be uploaded are moved. Defaults to '/data/obs/GTS/'.
+        transfer_path (str): The directory where the uploaded bulletins are moved.
+            Defaults to '/data/obs/GTS/transfer/'.
+        dedup_path (str): Directory remembering the hash of each BUFR message
+            produced. When set, a message identical to one already produced is
+            neither written nor uploaded again. Defaults to None.
+        dedup_retention (float): Days a message is remembered. Defaults to 30.
+        resend_duplicates (bool): Whether to write and upload duplicates anyway,
+            e.g. to send bulletins lost downstream again. Defaults to False.
+        spool_db (str): SQLite file of the transfer spool. When set, each bulletin
+            written is enqueued in it for the transfer task, which claims them
+            from it instead of listing its directory. Defaults to None.
+        spool_retention (float): Days the sent and failed bulletins are kept
+            in the spool, pruned after each cycle. Defaults to 30.
+        max_rss (float): Megabytes of resident memory after which an encoding
+            worker process is replaced by a new one. When set, the files are
+            encoded in `workers` processes recycled past this ceiling, so a
+            long backlog runs in flat memory. Defaults to None.
         **kwargs: Additional keyword arguments.
 
     Methods:
         _available_for_GTS_publication: Checks if the data is available for GTS publication.
+        _read_metadata: Opens a file once and caches its attributes and time bounds.
+        _record_decision: Records the publication decision of a file in the index.
+        invalidate_index: Drops index entries so their files are evaluated again.
+        encode_batch: Checks and encodes a list of files as a cycle of its own.
+        watch: Encodes the files written in a directory as they land.
+        _run_parallel: Encodes the available files in a pool of worker processes.
+        _run_serial: Encodes the available files one after another.
+        _run_aggregate: Encodes the available files into multi-subset bulletins.
+        _emit_metrics: Logs and writes the metrics of the cycle.
         _initialize_outdir: Initializes the output directory.
         _set_filelist: Sets the filelist attribute.
         run: Runs the GTS encoding process.
@@ -45,6 +117,25 @@ class Wrapper(object):
         GTS_template="GTS_encode_ship",
         centre_code=69,
         logger=logging,
+        index_path=None,
+        workers=1,
+        aggregate=False,
+        max_subsets=100,
+        metrics=False,
+        metrics_path=None,
+        casts=False,
+        cast_threshold=1.0,
+        thinning=None,
+        upload_server=None,
+        upload_queue=8,
+        spool_path='/data/obs/GTS/',
+        transfer_path='/data/obs/GTS/transfer/',
+        dedup_path=None,
+        dedup_retention=30,
+        resend_duplicates=False,
+        spool_db=None,
+        spool_retention=30,
+        max_rss=None,
         **kwargs,
     ):
         self.filelist = filelist
@@ -54,6 +145,31 @@ class Wrapper(object):
         self.GTS_template=GTS_template
         self.centre_code = centre_code
         self._saved_files = {"filelist": []}
+        self._metadata = None
+        self._index = EligibilityIndex(index_path, self.logger) if index_path else None
+        self.workers = workers
+        self.aggregate = aggregate
+        self.max_subsets = max_subsets
+        self.collect_metrics = metrics
+        self.metrics_path = metrics_path
+        self.metrics = NULL_METRICS
+        self.casts = casts
+        self.cast_threshold = cast_threshold
+        self.thinning = thinning
+        self.upload_server = upload_server
+        self.upload_queue = upload_queue
+        self.spool_path = spool_path
+        self.transfer_path = transfer_path
+        self._pipeline = None
+        self._sink = None
+        self._dedup = (
+            DedupStore(dedup_path, dedup_retention * 86400, resend_duplicates)
+            if dedup_path
+            else None
+        )
+        self._spool = TransferSpool(spool_db) if spool_db else None
+        self.spool_retention = spool_retention
+        self.max_rss = max_rss
 
     def _available_for_GTS_publication(self, filename):
         """        Checks if the data in the given file is available for GTS (Global Telecommunication System) publication.
@@ -65,27 +181,14 @@ class Wrapper(object):
             bool: True if the data is available for GTS publication, False otherwise.
         """
         try:
-            public = xr.open_dataset(filename, cache=False, engine="netcdf4").attrs[
-                "public"
-            ]
-            self.wigos_id = xr.open_dataset(filename, cache=False, engine="netcdf4").attrs[
-                "wigos_id"
-            ]
-            
+            metadata = self._read_metadata(filename)
+            public = metadata.public
+            self.wigos_id = metadata.wigos_id
+
             # Check if the current data is after the agreement signature date
-            self.first_measurement = xr.open_dataset(
-                filename, cache=False, engine="netcdf4"
-            )['DATETIME'][0].values
-            self.last_measurement = xr.open_dataset(
-                filename, cache=False, engine="netcdf4"
-            )['DATETIME'][-1].values
-            publication_date = dt.datetime.strptime(
-                xr.open_dataset(filename, cache=False, engine="netcdf4").attrs[
-                    "publication_date"
-                ],
-                "%d/%m/%Y",
-            )
-            publication_date = np.datetime64(publication_date)
+            self.first_measurement = metadata.first_measurement
+            self.last_measurement = metadata.last_measurement
+            publication_date = metadata.publication_date
             if (self.first_measurement - publication_date > 0) & (self.wigos_id != "nan"):
                 return eval(public)
             else:
@@ -93,6 +196,50 @@ class Wrapper(object):
         except:
             return False
 
+    def _read_metadata(self, filename):
+        """
+        Opens the file once and keeps its metadata until another file is read.
+
+        Args:
+            filename (str): The path to the file containing the data.
+
+        Returns:
+            DatasetMetadata: The cached metadata with the open dataset.
+        """
+        if self._metadata is None or self._metadata.filename != filename:
+            self._close_metadata()
+            with self.metrics.stage("open"):
+                self._metadata = DatasetMetadata(filename)
+        return self._metadata
+
+    def _close_metadata(self):
+        if self._metadata is not None:
+            self._metadata.close()
+            self._metadata = None
+
+    def _record_decision(self, filename, available, GTS_filename=None):
+        # Files that could not be read are evaluated again next cycle
+        if self._index is None or self._metadata is None:
+            return
+        self._index.record(filename, available, self._metadata.attrs, GTS_filename)
+
+    def invalidate_index(self, **attrs):
+        """
+        Drops the index entries matching the given attributes, e.g. after the
+        publication date or the wigos_id of a platform changed upstream.
+
+        Args:
+            **attrs: Values of `public`, `wigos_id` or `publication_date`.
+
+        Returns:
+            int: The number of entries dropped.
+        """
+        if self._index is None:
+            return 0
+        dropped = self._index.invalidate(**attrs)
+        self._index.save()
+        return dropped
+
     def set_cycle(self, cycle_dt):
         self.cycle_dt = cycle_dt
 
@@ -154,23 +301,445 @@ class Wrapper(object):
             dict: A dictionary containing the saved files.
         """
         self.set_cycle(cycle_dt)
+        return self._run_cycle()
+
+    def encode_batch(self, filelist):
+        """
+        Checks and encodes `filelist` as a cycle of its own, timed now.
+
+        Args:
+            filelist (list): The file paths to be processed.
+
+        Returns:
+            dict: A dictionary containing the files saved for this batch.
+        """
+        self.set_cycle(dt.datetime.utcnow())
+        self.filelist = filelist
+        self._saved_files = {"filelist": []}
+        return self._run_cycle()
+
+    def watch(self, directory, pattern="*_qc.nc", settle=5.0, interval=10.0, inotify=True):
+        """
+        Encodes the files written in `directory` as they land, until interrupted.
+
+        Args:
+            directory (str): The directory where the QC files are written.
+            pattern (str, optional): Shell pattern of the files to encode.
+            settle (float, optional): Seconds a file must stay unchanged
+                before it is encoded.
+            interval (float, optional): Maximum seconds between two scans.
+            inotify (bool, optional): Whether to wake up on inotify events
+                instead of only polling.
+        """
+        from GTS_encode.watch import Watcher
+
+        watcher = Watcher(
+            self, directory, pattern, settle, interval, inotify, logger=self.logger
+        )
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.stop.set()
+
+    def _run_cycle(self):
+        self.metrics = CycleMetrics(self.logger) if self.collect_metrics else NULL_METRICS
         self._set_filelist()
-        GTS_encode_module = importlib.import_module('GTS_encode.GTS_encode')
-        GTS_encoding = getattr(GTS_encode_module, self.GTS_template)
+        self._start_pipeline()
+        try:
+            if self.aggregate:
+                saved_files = self._run_aggregate()
+            elif self.workers > 1 or self.max_rss:
+                saved_files = self._run_parallel()
+            else:
+                saved_files = self._run_serial()
+        finally:
+            self._close_pipeline()
+        if self._dedup is not None:
+            self._dedup.prune()
+        if self._spool is not None:
+            self._spool.prune(self.spool_retention * 86400)
+        self._prune_sequence()
+        self._emit_metrics()
+        return saved_files
+
+    def _prune_sequence(self):
+        """Removes the bulletin number counters of the headings no longer in use"""
+        # The counters are kept where allocate_identifier puts them by default
+        sequence_dir = os.path.join(self.out_dir, ".sequence")
+        if os.path.isdir(sequence_dir):
+            SequenceAllocator(sequence_dir).prune()
+
+    def _start_pipeline(self):
+        if not self.upload_server:
+            return
+        from GTS_encode.GTS_encode import MemorySink
+        from GTS_encode.transfer import UploadPipeline
+
+        # The bulletins are handed to the pipeline instead of written
+        self._sink = MemorySink()
+        self._pipeline = UploadPipeline(
+            self.upload_server,
+            spool_path=self.spool_path,
+            transfer_path=self.transfer_path,
+            maxsize=self.upload_queue,
+            logger=self.logger,
+            spool=self._spool,
+        ).start()
+
+    def _close_pipeline(self):
+        if self._pipeline is None:
+            return
+        with self.metrics.stage("upload_drain"):
+            sent, spooled = self._pipeline.close()
+        self._pipeline = None
+        self._sink = None
+        self._saved_files["transferred"] = sent
+        self._saved_files["spooled"] = spooled
+        self.metrics.count("bulletins_uploaded", len(sent))
+        self.metrics.count("bulletins_spooled", len(spooled))
+        self.logger.info(
+            "Uploaded {} bulletins, spooled {} for the transfer task".format(
+                len(sent), len(spooled)
+            )
+        )
+
+    def _save(self, GTS_filenames):
+        """Keeps the written bulletins and queues them for upload when pipelined"""
+        for GTS_filename in GTS_filenames:
+            self._saved_files["filelist"].append(GTS_filename)
+            if self._spool is not None:
+                # Claimed by the pipeline so the transfer task leaves it alone
+                self._spool.enqueue(GTS_filename, claimed=self._pipeline is not None)
+            if self._pipeline is not None:
+                data = self._sink.bulletins.pop(GTS_filename, None)
+                self._pipeline.submit(GTS_filename, data)
+
+    def _run_serial(self):
+        """
+        Encodes the available files one after another in this process.
+
+        Returns:
+            dict: A dictionary containing the saved files.
+        """
         for file in self.filelist:
-            if self._available_for_GTS_publication(file):
+            self.metrics.start_file(file)
+            if self._index is not None and self._index.lookup(file) is not None:
+                self.metrics.end_file("indexed")
+                continue
+            GTS_filename = None
+            duplicate = False
+            with self.metrics.stage("check"):
+                available = self._available_for_GTS_publication(file)
+            if available:
                 self.filename = file
                 # create (mkdir) out_dir if it doesn't exist
                 self._initialize_outdir(self.out_dir)
                 try: 
-                    GTS = GTS_encoding(self.filename, self.centre_code, outdir=self.out_dir)
-                    GTS_filename = GTS.run()
-                    self._saved_files["filelist"].append(GTS_filename)
+                    GTS_encoding = load_template(self.GTS_template)
+                    with GTS_encoding(
+                        self.filename,
+                        self.centre_code,
+                        outdir=self.out_dir,
+                        ds=self._read_metadata(file).ds,
+                        metrics=self.metrics,
+                        thinning=self.thinning,
+                        dedup=self._dedup,
+                        sink=self._sink,
+                    ) as GTS:
+                        if self.casts:
+                            GTS_filename = GTS.run_casts(self.cast_threshold)
+                        else:
+                            GTS_filename = GTS.run()
+                    if self.casts:
+                        self._save(GTS_filename)
+                    else:
+                        self._save([GTS_filename] if GTS_filename else [])
+                    self._record_decision(file, True, GTS_filename)
+                    # Without an error, nothing written means every message was a duplicate
+                    duplicate = self._dedup is not None and not GTS_filename
                 except Exception as exc:
                     self.logger.error(
                         "Could not encode file {}".format(
                             exc
                         )
                     )
-                    
+                status = _encoded_status(GTS_filename, duplicate)
+            else:
+                self._record_decision(file, False)
+                status = "unavailable"
+            self._close_metadata()
+            if available:
+                _record_memory(self.metrics)
+            self.metrics.end_file(status, GTS_filename)
+        if self._index is not None:
+            self._index.save()
+
         return self._saved_files
+
+    def _emit_metrics(self):
+        if not self.metrics.enabled:
+            return
+        path = self.cycle_dt.strftime(self.metrics_path) if self.metrics_path else None
+        try:
+            self.metrics.emit(path)
+        except Exception as exc:
+            self.logger.error("Could not write metrics {}: {}".format(path, exc))
+
+    def _run_parallel(self):
+        """
+        Encodes the available files across `workers` processes.
+
+        The publication checks run here, only the encoding is sent to the
+        workers. A file that fails to encode is logged and skipped as in the
+        serial loop, and the saved files keep the order of the filelist.
+
+        Returns:
+            dict: A dictionary containing the saved files.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        if self.max_rss:
+            from GTS_encode.pool import RecyclingPool
+
+            executor = RecyclingPool(self.workers, max_rss=self.max_rss * 2**20)
+        else:
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+        available = []
+        for file in self.filelist:
+            self.metrics.start_file(file)
+            if self._index is not None and self._index.lookup(file) is not None:
+                self.metrics.end_file("indexed")
+                continue
+            with self.metrics.stage("check"):
+                is_available = self._available_for_GTS_publication(file)
+            if is_available:
+                # The record is completed with what the worker measured
+                available.append((file, self._metadata.attrs, self.metrics.suspend_file()))
+            else:
+                self._record_decision(file, False)
+            self._close_metadata()
+            if not is_available:
+                self.metrics.end_file("unavailable")
+        if available:
+            self._initialize_outdir(self.out_dir)
+        with executor:
+            futures = [
+                executor.submit(
+                    _encode_file,
+                    self.GTS_template,
+                    file,
+                    self.centre_code,
+                    self.out_dir,
+                    self.metrics.enabled,
+                    self.cast_threshold if self.casts else None,
+                    self.thinning,
+                    self._dedup,
+                    self._sink is not None,
+                )
+                for file, _, _ in available
+            ]
+            for (file, attrs, record), future in zip(available, futures):
+                self.metrics.resume_file(record)
+                GTS_filename = None
+                duplicate = False
+                try:
+                    GTS_filename, worker_metrics, bulletins = future.result()
+                    if bulletins:
+                        self._sink.bulletins.update(bulletins)
+                    if self.casts:
+                        self._save(GTS_filename)
+                    else:
+                        self._save([GTS_filename] if GTS_filename else [])
+                    if self._index is not None:
+                        self._index.record(file, True, attrs, GTS_filename)
+                    if worker_metrics is not None:
+                        self.metrics.merge(*worker_metrics)
+                    duplicate = self._dedup is not None and not GTS_filename
+                except Exception as exc:
+                    self.logger.error(
+                        "Could not encode file {}".format(
+                            exc
+                        )
+                    )
+                self.metrics.end_file(_encoded_status(GTS_filename, duplicate), GTS_filename)
+        if self.max_rss:
+            self.metrics.count("workers_recycled", executor.recycled)
+            self.metrics.count("workers_crashed", executor.crashed)
+        if self._index is not None:
+            self._index.save()
+
+        return self._saved_files
+
+    def _run_aggregate(self):
+        """
+        Encodes the available files into bulletins of up to `max_subsets` profiles.
+
+        Each profile is read and checked as in the serial loop, then added to
+        the current bulletin, which is written once full and at the end of the
+        cycle. The files of a bulletin are only recorded in the index once it
+        is written.
+
+        Returns:
+            dict: A dictionary containing the saved files.
+        """
+        bulletin = None
+        pending = []
+        for file in self.filelist:
+            self.metrics.start_file(file)
+            if self._index is not None and self._index.lookup(file) is not None:
+                self.metrics.end_file("indexed")
+                continue
+            with self.metrics.stage("check"):
+                available = self._available_for_GTS_publication(file)
+            if available:
+                self._initialize_outdir(self.out_dir)
+                status = "failed"
+                try:
+                    if bulletin is None:
+                        from GTS_encode.bulletin import Bulletin
+
+                        bulletin = Bulletin(
+                            self.out_dir,
+                            metrics=self.metrics,
+                            dedup=self._dedup,
+                            sink=self._sink,
+                        )
+                    GTS_encoding = load_template(self.GTS_template)
+                    GTS = GTS_encoding(
+                        file,
+                        self.centre_code,
+                        outdir=self.out_dir,
+                        ds=self._read_metadata(file).ds,
+                        metrics=self.metrics,
+                        thinning=self.thinning,
+                    )
+                    with self.metrics.stage("read"):
+                        if self.casts:
+                            from GTS_encode.reader import read_casts
+
+                            profiles = read_casts(
+                                GTS.ds, GTS.qcflag, self.cast_threshold, self.thinning
+                            )
+                        else:
+                            GTS.create_variables_from_netcdf()
+                            profiles = [None]
+                    subsets = []
+                    for profile in profiles:
+                        if profile is not None:
+                            GTS.set_profile(profile)
+                        self.metrics.count("samples", len(GTS.depths))
+                        with self.metrics.stage("message"):
+                            subsets.append(bulletin.read(GTS))
+                    # A file is added once all its casts are read, or not at all
+                    bulletin.extend(GTS, subsets)
+                    pending.append((file, self._metadata.attrs))
+                    GTS.close()
+                    status = "aggregated"
+                except Exception as exc:
+                    self.logger.error(
+                        "Could not encode file {}".format(
+                            exc
+                        )
+                    )
+            else:
+                self._record_decision(file, False)
+                status = "unavailable"
+            self._close_metadata()
+            if available:
+                _record_memory(self.metrics)
+            self.metrics.end_file(status)
+            if bulletin is not None and len(bulletin) >= self.max_subsets:
+                self._write_bulletin(bulletin, pending)
+                pending = []
+        self._write_bulletin(bulletin, pending)
+        if self._index is not None:
+            self._index.save()
+
+        return self._saved_files
+
+    def _write_bulletin(self, bulletin, pending):
+        if not pending:
+            return
+        try:
+            with self.metrics.stage("write"):
+                GTS_filename = bulletin.write()
+            if GTS_filename is not None:
+                self.metrics.count("bulletins_written")
+        except Exception as exc:
+            self.logger.error(
+                "Could not write bulletin {}".format(
+                    exc
+                )
+            )
+            return
+        # A duplicate was already sent, its files are done all the same
+        if GTS_filename is not None:
+            self._save([GTS_filename])
+        if self._index is not None:
+            for file, attrs in pending:
+                self._index.record(file, True, attrs, GTS_filename)
+
+
+def _record_memory(metrics):
+    """Records the resident memory and the live ecCodes handles after a file"""
+    if not metrics.enabled:
+        return
+    # Only imported once a template is, so eccodes stays out of empty cycles
+    from GTS_encode.handles import HANDLES
+
+    metrics.gauge("rss_mb", resident_memory() / 2**20)
+    metrics.gauge("live_handles", HANDLES.live)
+
+
+def _encoded_status(GTS_filename, duplicate):
+    if GTS_filename:
+        return "encoded"
+    return "duplicate" if duplicate else "failed"
+
+
+def _encode_file(
+    GTS_template,
+    filename,
+    centre_code,
+    out_dir,
+    collect_metrics=False,
+    cast_threshold=None,
+    thinning=None,
+    dedup=None,
+    keep_bulletins=False,
+):
+    """
+    Encodes a single file in a worker process.
+
+    Returns:
+        tuple: The GTS filename, None for a duplicate, or the list of filenames
+            of each cast if `cast_threshold` is set, the stages, counters and
+            gauges measured if `collect_metrics` is set, otherwise None, and
+            the bulletins by filename if `keep_bulletins` is set instead of
+            writing them, otherwise None.
+    """
+    GTS_encoding = load_template(GTS_template)
+    metrics = CycleMetrics() if collect_metrics else NULL_METRICS
+    sink = None
+    if keep_bulletins:
+        from GTS_encode.GTS_encode import MemorySink
+
+        sink = MemorySink()
+    with GTS_encoding(
+        filename,
+        centre_code,
+        outdir=out_dir,
+        metrics=metrics,
+        thinning=thinning,
+        dedup=dedup,
+        sink=sink,
+    ) as GTS:
+        if cast_threshold is None:
+            GTS_filename = GTS.run()
+        else:
+            GTS_filename = GTS.run_casts(cast_threshold)
+    bulletins = sink.bulletins if sink is not None else None
+    if not collect_metrics:
+        return GTS_filename, None, bulletins
+    _record_memory(metrics)
+    return GTS_filename, (metrics.stages, metrics.counters, metrics.gauges), bulletins
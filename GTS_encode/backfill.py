@@ -0,0 +1,298 @@
+"""Resumable re-encoding of the archive, e.g. once a platform is approved for GTS
+- find_archive_files - QC files of the archive within a date range and platforms
+- Backfill - encodes them on every core, journaling each file as it finishes
+
+Usage:
+    python -m GTS_encode.backfill ARCHIVE OUTDIR --start 2023-01-01 --end 2023-07-01
+        [--platform MOANA_0058 ...] [--journal PATH] [-w WORKERS] [--max-rss MB]
+"""
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import logging
+import argparse
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from GTS_encode.pool import RecyclingPool
+
+# Statuses of a file that is not encoded again when the backfill resumes
+FINISHED = ("encoded", "duplicate", "unavailable", "aggregated", "indexed")
+
+
+def parse_archive_name(filename):
+    """
+    Reads the platform and the start time from a Mangopare file name.
+
+    Args:
+        filename (str): e.g. "MOANA_0058_434_230228081912_qc.nc".
+
+    Returns:
+        tuple: The platform, e.g. "MOANA_0058", and the start time, or None if
+            the name does not follow the convention.
+    """
+    parts = os.path.basename(filename).split("_")
+    try:
+        return "_".join(parts[:2]), dt.datetime.strptime(parts[-2], "%y%m%d%H%M%S")
+    except (IndexError, ValueError):
+        return None
+
+
+def find_archive_files(root, start=None, end=None, platforms=None, pattern="*_qc.nc"):
+    """
+    Lists the QC files under `root` started in [`start`, `end`) by `platforms`.
+
+    Args:
+        root (str): The archive directory, searched recursively.
+        start (datetime.datetime, optional): First start time included.
+        end (datetime.datetime, optional): First start time excluded.
+        platforms (list, optional): Platforms as "MOANA_0058" or serial numbers
+            as "0058". Defaults to None, which includes every platform.
+        pattern (str, optional): Shell pattern of the QC files.
+
+    Returns:
+        list: The paths sorted by start time, then by name.
+    """
+    platforms = set(platforms or [])
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in fnmatch.filter(filenames, pattern):
+            parsed = parse_archive_name(filename)
+            if parsed is None:
+                continue
+            platform, started = parsed
+            if platforms and not (
+                platform in platforms or platform.split("_")[-1] in platforms
+            ):
+                continue
+            if (start and started < start) or (end and started >= end):
+                continue
+            found.append((started, filename, os.path.join(dirpath, filename)))
+    return [path for _, _, path in sorted(found)]
+
+
+class Backfill(object):
+    """
+    Encodes a list of files across processes, resumable from a journal.
+
+    Each worker process checks and encodes one file at a time with its own
+    `Wrapper`, and the outcome of each file is appended to the journal as
+    soon as it is known. A backfill started again with the same journal
+    skips the files already finished, so an interrupted run only repeats
+    the files that were in flight. Files that failed are tried again only
+    with `retry_failed`.
+
+    Args:
+        filelist (list): The files to encode, e.g. from `find_archive_files`.
+        out_dir (str): The output directory where the encoded files will be saved.
+        journal_path (str): JSON lines file with the outcome of each file.
+        workers (int, optional): Number of worker processes. Defaults to the
+            number of CPUs.
+        retry_failed (bool, optional): Whether to encode again the files that
+            failed in a previous run. Defaults to False.
+        report_every (float, optional): Seconds between two throughput reports.
+            Defaults to 30.
+        max_rss (float, optional): Megabytes of resident memory after which a
+            worker process is replaced by a new one, keeping the memory of a
+            long backfill flat. Defaults to None, which keeps the workers.
+        logger (logging.Logger, optional): The logger object for logging messages.
+        **wrapper_kwargs: Passed to each `Wrapper`, e.g. GTS_template,
+            centre_code, casts or thinning.
+    """
+
+    def __init__(
+        self,
+        filelist,
+        out_dir,
+        journal_path,
+        workers=None,
+        retry_failed=False,
+        report_every=30.0,
+        max_rss=None,
+        logger=logging,
+        **wrapper_kwargs,
+    ):
+        self.filelist = filelist
+        self.out_dir = out_dir
+        self.journal_path = journal_path
+        self.workers = workers or os.cpu_count()
+        self.retry_failed = retry_failed
+        self.report_every = report_every
+        self.max_rss = max_rss
+        self.logger = logger
+        self.wrapper_kwargs = wrapper_kwargs
+
+    def load_journal(self):
+        """
+        Returns:
+            dict: The last outcome recorded for each file.
+        """
+        outcomes = {}
+        if not os.path.exists(self.journal_path):
+            return outcomes
+        with open(self.journal_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line of a killed run may be cut short
+                    continue
+                outcomes[record["filename"]] = record
+        return outcomes
+
+    def pending(self):
+        """The files of the filelist still to encode, in filelist order"""
+        finished = FINISHED + (() if self.retry_failed else ("failed",))
+        outcomes = self.load_journal()
+        return [
+            file
+            for file in self.filelist
+            if outcomes.get(file, {}).get("status") not in finished
+        ]
+
+    def run(self):
+        """
+        Encodes the pending files, journaling and reporting as they finish.
+
+        Returns:
+            dict: The number of files of each status in this run, the
+                samples encoded, the highest resident memory of a worker
+                after a file, the wall time and the throughput.
+        """
+        pending = self.pending()
+        skipped = len(self.filelist) - len(pending)
+        if skipped:
+            self.logger.info(
+                "Resuming backfill, {} of {} files already done".format(
+                    skipped, len(self.filelist)
+                )
+            )
+        summary = {"files": 0, "samples": 0, "peak_rss_mb": 0.0, "statuses": {}}
+        started = last_report = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        if self.max_rss:
+            executor = RecyclingPool(
+                self.workers,
+                max_rss=self.max_rss * 2**20,
+                initializer=_init_worker,
+                initargs=(self.out_dir, self.wrapper_kwargs),
+            )
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.out_dir, self.wrapper_kwargs),
+            )
+        with open(self.journal_path, "a") as journal, executor:
+            if journal.tell() and not self._ends_with_newline():
+                # Keep the first record of this run off a line cut short by a kill
+                journal.write("\n")
+            futures = {executor.submit(_encode_one, file): file for file in pending}
+            for future in as_completed(futures):
+                try:
+                    record = future.result()
+                except Exception as exc:
+                    record = {"filename": futures[future], "status": "failed", "error": str(exc)}
+                record["finished"] = dt.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+                journal.write(json.dumps(record) + "\n")
+                journal.flush()
+                os.fsync(journal.fileno())
+                summary["files"] += 1
+                summary["samples"] += record.get("counters", {}).get("samples", 0)
+                summary["peak_rss_mb"] = max(
+                    summary["peak_rss_mb"], record.get("gauges", {}).get("rss_mb", 0.0)
+                )
+                statuses = summary["statuses"]
+                statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+                now = time.perf_counter()
+                if now - last_report >= self.report_every:
+                    self._report(summary, len(pending), now - started)
+                    last_report = now
+        if self.max_rss:
+            summary["workers_recycled"] = executor.recycled
+            summary["workers_crashed"] = executor.crashed
+        summary["wall"] = time.perf_counter() - started
+        summary["files_per_second"] = summary["files"] / summary["wall"] if summary["wall"] else 0.0
+        self._report(summary, len(pending), summary["wall"])
+        return summary
+
+    def _ends_with_newline(self):
+        with open(self.journal_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _report(self, summary, total, elapsed):
+        rate = summary["files"] / elapsed if elapsed else 0.0
+        remaining = (total - summary["files"]) / rate if rate else 0.0
+        self.logger.info(
+            "Backfill {}/{} files, {:.2f} files/s, {:.0f} samples/s, {} remaining, {}".format(
+                summary["files"],
+                total,
+                rate,
+                summary["samples"] / elapsed if elapsed else 0.0,
+                dt.timedelta(seconds=round(remaining)),
+                json.dumps(summary["statuses"]),
+            )
+        )
+
+
+# The Wrapper of each worker process, built once by the pool initializer
+_wrapper = None
+
+
+def _init_worker(out_dir, wrapper_kwargs):
+    global _wrapper
+    _wrapper = Wrapper(out_dir=out_dir, metrics=True, **wrapper_kwargs)
+    # The per file records are journaled by the parent, not logged by each worker
+    quiet = logging.getLogger("GTS_encode.backfill.worker")
+    quiet.setLevel(logging.WARNING)
+    _wrapper.logger = quiet
+
+
+def _encode_one(filename):
+    """Checks and encodes a file, returning its metrics record"""
+    _wrapper.encode_batch([filename])
+    (record,) = _wrapper.metrics.files
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("archive")
+    parser.add_argument("outdir")
+    parser.add_argument("--start", type=dt.datetime.fromisoformat)
+    parser.add_argument("--end", type=dt.datetime.fromisoformat)
+    parser.add_argument("--platform", nargs="+", dest="platforms")
+    parser.add_argument("--journal", help="Defaults to OUTDIR/backfill.journal")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--template", default="GTS_encode_ship")
+    parser.add_argument("--centre-code", type=int, default=69)
+    parser.add_argument("--retry-failed", action="store_true")
+    parser.add_argument(
+        "--max-rss", type=float, help="MB of memory after which a worker is replaced"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    filelist = find_archive_files(args.archive, args.start, args.end, args.platforms)
+    backfill = Backfill(
+        filelist,
+        args.outdir,
+        args.journal or os.path.join(args.outdir, "backfill.journal"),
+        workers=args.workers,
+        retry_failed=args.retry_failed,
+        max_rss=args.max_rss,
+        GTS_template=args.template,
+        centre_code=args.centre_code,
+    )
+    summary = backfill.run()
+    return 1 if summary["statuses"].get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Multi-subset BUFR bulletins
+- read_subset - header and data values of a single-subset message
+- create_multisubset_message - message with one subset per profile
+- Bulletin - collects the profiles of one template into a single bulletin
+"""
+
+import numpy as np
+from eccodes import (
+    codes_bufr_keys_iterator_delete,
+    codes_bufr_keys_iterator_get_name,
+    codes_bufr_keys_iterator_new,
+    codes_bufr_keys_iterator_next,
+    codes_get,
+    codes_get_array,
+    codes_get_message,
+    codes_set,
+    codes_set_array,
+    codes_set_string_array,
+)
+from GTS_encode.GTS_encode import encode_gts_bulletin, save_bulletin
+from GTS_encode.handles import HANDLES
+from GTS_encode.metrics import NULL_METRICS
+
+# Section 1 keys copied from the first profile, in the order they must be set
+HEADER_KEYS = (
+    "edition",
+    "masterTableNumber",
+    "bufrHeaderSubCentre",
+    "bufrHeaderCentre",
+    "updateSequenceNumber",
+    "dataCategory",
+    "masterTablesVersionNumber",
+    "localTablesVersionNumber",
+    "typicalMonth",
+    "typicalDay",
+    "typicalHour",
+    "typicalMinute",
+    "observedData",
+)
+
+
+def data_keys(ibufr):
+    """Names without rank of the data section keys, in message order"""
+    iterator = codes_bufr_keys_iterator_new(ibufr)
+    names = []
+    while codes_bufr_keys_iterator_next(iterator):
+        name = codes_bufr_keys_iterator_get_name(iterator)
+        if not name.startswith("#") or "->" in name:
+            continue
+        name = name.split("#", 2)[2]
+        # Replication factors follow from inputExtendedDelayedDescriptorReplicationFactor
+        if name not in names and not name.endswith("ReplicationFactor"):
+            names.append(name)
+    codes_bufr_keys_iterator_delete(iterator)
+    return names
+
+
+def read_subset(ibufr):
+    """
+    Reads the header and every data value of a single-subset message.
+
+    Args:
+        ibufr (int): The BUFR handle of the profile, before it is packed.
+
+    Returns:
+        dict: The header, descriptors, replication factors and the values of
+            every occurrence of each data key.
+    """
+    edition = codes_get(ibufr, "edition")
+    year_key = "typicalYear" if edition >= 4 else "typicalYearOfCentury"
+    header = {key: codes_get(ibufr, key) for key in HEADER_KEYS + (year_key,)}
+    return {
+        "header": header,
+        "descriptors": list(codes_get_array(ibufr, "unexpandedDescriptors")),
+        "replication": [
+            int(factor)
+            # Read back from the data section, the input key is not kept by
+            # messages cloned from the header cache
+            for factor in codes_get_array(
+                ibufr, "extendedDelayedDescriptorReplicationFactor"
+            )
+        ],
+        "values": {key: codes_get_array(ibufr, key) for key in data_keys(ibufr)},
+    }
+
+
+def create_multisubset_message(subsets, sample, compressed=None):
+    """
+    Creates a message with one subset per profile.
+
+    Compression is only possible when every profile expands to the same
+    descriptors, i.e. has the same replication factors.
+
+    Args:
+        subsets (list): The profiles returned by `read_subset`.
+        sample (str): The ecCodes sample of the template.
+        compressed (bool, optional): Whether to compress the data section.
+            Defaults to None, which compresses whenever it is possible.
+
+    Returns:
+        int: The ecCodes handle of the message, before it is packed.
+    """
+    descriptors = subsets[0]["descriptors"]
+    if any(subset["descriptors"] != descriptors for subset in subsets):
+        raise ValueError("Profiles of different templates cannot share a bulletin")
+    same_replication = all(
+        subset["replication"] == subsets[0]["replication"] for subset in subsets
+    )
+    if compressed is None:
+        compressed = same_replication
+    elif compressed and not same_replication:
+        raise ValueError("Profiles with different replication factors cannot be compressed")
+    ibufr = HANDLES.new_from_samples(sample)
+    try:
+        for key, value in subsets[0]["header"].items():
+            codes_set(ibufr, key, value)
+        codes_set(ibufr, "numberOfSubsets", len(subsets))
+        codes_set(ibufr, "compressedData", int(compressed))
+        if compressed:
+            replication = subsets[0]["replication"]
+        else:
+            replication = [factor for subset in subsets for factor in subset["replication"]]
+        codes_set_array(ibufr, "inputExtendedDelayedDescriptorReplicationFactor", replication)
+        codes_set_array(ibufr, "unexpandedDescriptors", descriptors)
+        for key, values in subsets[0]["values"].items():
+            if compressed:
+                _set_compressed(ibufr, key, [subset["values"][key] for subset in subsets])
+            else:
+                _set_uncompressed(ibufr, key, [subset["values"][key] for subset in subsets])
+    except Exception:
+        HANDLES.release(ibufr)
+        raise
+    return ibufr
+
+
+def _set_uncompressed(ibufr, key, subset_values):
+    if isinstance(subset_values[0][0], str):
+        # String arrays can only hold one value per subset, so go by rank,
+        # empty strings are left missing
+        values = [value for values in subset_values for value in values]
+        for rank, value in enumerate(values, start=1):
+            if value:
+                codes_set(ibufr, f"#{rank}#{key}", value)
+    else:
+        codes_set_array(ibufr, key, np.concatenate(subset_values))
+
+
+def _set_compressed(ibufr, key, subset_values):
+    # Each rank holds one value per subset in a compressed message
+    for rank, values in enumerate(zip(*subset_values), start=1):
+        if isinstance(values[0], str):
+            if any(values):
+                codes_set_string_array(ibufr, f"#{rank}#{key}", list(values))
+        else:
+            codes_set_array(ibufr, f"#{rank}#{key}", np.array(values))
+
+
+class Bulletin(object):
+    """
+    Collects the profiles of one template into a multi-subset bulletin.
+
+    Each profile is encoded with its template as usual and only its values
+    are kept, so the template objects and their datasets can be released
+    once added.
+
+    Args:
+        outdir (str): The output directory of the bulletin.
+        compressed (bool, optional): Whether to compress the data section.
+            Defaults to None, which compresses whenever it is possible.
+        sequence_dir (str, optional): Directory of the bulletin number counters.
+        metrics (CycleMetrics, optional): Counts the bytes written and the
+            names already taken. Defaults to None, which records nothing.
+        dedup (DedupStore, optional): The messages already produced, which
+            are not written again. Defaults to None, which writes every bulletin.
+        sink (callable, optional): Takes each bulletin as `write_bulletin`
+            does, e.g. a MemorySink. Defaults to None, which writes them in
+            `outdir`.
+    """
+
+    def __init__(
+        self, outdir, compressed=None, sequence_dir=None, metrics=None, dedup=None, sink=None
+    ):
+        self.outdir = outdir
+        self.compressed = compressed
+        self.sequence_dir = sequence_dir
+        self.metrics = metrics or NULL_METRICS
+        self.dedup = dedup
+        self.sink = sink
+        self.subsets = []
+        self.filenames = []
+        self.sample = None
+        self.last_time = None
+        self.identifier = None
+
+    def __len__(self):
+        return len(self.subsets)
+
+    def add(self, GTS):
+        """
+        Adds the profile of a template object whose variables are already read.
+
+        Args:
+            GTS: A GTS_encode_ship or GTS_encode_glider object.
+        """
+        self.extend(GTS, [self.read(GTS)])
+
+    def read(self, GTS):
+        """
+        Reads the profile of a template object without adding it, so the
+        profiles of a file can all be read before any is added.
+
+        Args:
+            GTS: A GTS_encode_ship or GTS_encode_glider object.
+
+        Returns:
+            tuple: The subset and the time of its latest observation.
+        """
+        if self.sample is not None and GTS.sample != self.sample:
+            raise ValueError("Profiles of different templates cannot share a bulletin")
+        ibufr = GTS.create_bufr_message()
+        try:
+            subset = read_subset(ibufr)
+        finally:
+            HANDLES.release(ibufr)
+        last_time = tuple(
+            int(values[-1])
+            for values in (GTS.years, GTS.months, GTS.days, GTS.hours, GTS.minutes)
+        )
+        return subset, last_time
+
+    def extend(self, GTS, profiles):
+        """
+        Adds the profiles read with `read` from a template object.
+
+        Args:
+            GTS: The GTS_encode_ship or GTS_encode_glider object they were read from.
+            profiles (list): The subsets and times returned by `read`.
+        """
+        for subset, last_time in profiles:
+            self.subsets.append(subset)
+            self.filenames.append(GTS.filename)
+            self.sample = GTS.sample
+            # The heading takes the time of the latest observation
+            if self.last_time is None or last_time > self.last_time:
+                self.last_time = last_time
+
+    def _reset(self):
+        self.subsets = []
+        self.filenames = []
+        self.last_time = None
+
+    def encode(self):
+        """
+        Encodes the collected profiles as one bulletin without writing it
+        to disk, and starts a new one.
+
+        Returns:
+            bytes: The bulletin, None if there was nothing to encode or the
+                bulletin is a duplicate.
+        """
+        if not self.subsets:
+            return None
+        ibufr = create_multisubset_message(self.subsets, self.sample, self.compressed)
+        try:
+            codes_set(ibufr, "pack", 1)
+            message = codes_get_message(ibufr)
+        finally:
+            HANDLES.release(ibufr)
+        self.identifier, bulletin = encode_gts_bulletin(
+            message,
+            self.outdir,
+            *self.last_time[2:],
+            sequence_dir=self.sequence_dir,
+            metrics=self.metrics,
+            dedup=self.dedup,
+        )
+        self._reset()
+        return bulletin
+
+    def write(self):
+        """
+        Writes the collected profiles as one bulletin and starts a new one.
+
+        The bulletin from `encode` is handed to the sink, which writes it in
+        `outdir` unless another sink was given.
+
+        Returns:
+            str: The output filename, None if there was nothing to write or
+                the bulletin is a duplicate.
+        """
+        bulletin = self.encode()
+        if bulletin is None:
+            return None
+        return save_bulletin(
+            self.sink, self.outdir, self.identifier, bulletin, self.metrics, self.dedup
+        )
@@ -0,0 +1,145 @@
+"""Skipping of bulletins identical to one already produced
+- message_hash - the hash of a BUFR message, the bulletin without its heading
+- DedupStore - the hashes produced, shared between processes and cycles
+"""
+
+import os
+import time
+import fcntl
+import hashlib
+
+# Start of an entry claimed by a process that has not written its bulletin yet
+CLAIMED = b"claimed "
+
+
+def message_hash(message):
+    """
+    Returns the SHA-256 of a BUFR message.
+
+    The `001` and `IOVEnn NZKL DDHHMM` lines of a bulletin are skipped, as
+    the same message gets a new bulletin number each time it is written.
+
+    Args:
+        message (bytes): The BUFR message, or a bulletin starting with its heading.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    start = message.find(b"BUFR")
+    return hashlib.sha256(message[max(start, 0):]).hexdigest()
+
+
+class DedupStore(object):
+    """
+    Remembers the BUFR messages produced so identical ones are not sent again.
+
+    Reprocessing a file, or running the QC again without changing the
+    encoded values, gives the same BUFR message. Each message produced
+    keeps a small entry named after its hash, with the name of its
+    bulletin, so a later identical message is skipped before it takes a
+    bulletin number, is written or is uploaded. Entries are claimed under
+    a lock, so the store is safe across processes and persists between
+    cycles. An entry older than `retention` seconds no longer counts. A
+    claim not followed by the bulletin within `claim_lease` seconds, e.g.
+    from a process killed while writing it, is free to claim again.
+
+    Args:
+        state_dir (str): The directory where the entries are kept.
+        retention (float, optional): Seconds a message is remembered. Defaults
+            to 30 days.
+        resend (bool, optional): Whether to produce duplicates anyway, e.g. to
+            send a bulletin lost downstream again. Their entries are renewed.
+            Defaults to False.
+        claim_lease (float, optional): Seconds a claim holds before the
+            bulletin is recorded. Defaults to 600.
+    """
+
+    def __init__(self, state_dir, retention=30 * 86400, resend=False, claim_lease=600):
+        self.state_dir = state_dir
+        self.retention = retention
+        self.resend = resend
+        self.claim_lease = claim_lease
+        os.makedirs(state_dir, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.state_dir, key + ".sha256")
+
+    def claim(self, message):
+        """
+        Claims a message about to be written.
+
+        Args:
+            message (bytes): The BUFR message.
+
+        Returns:
+            str: The key to give to `record` once the bulletin is written, or
+                to `release` if it could not be, None if the message was
+                already produced.
+        """
+        key = message_hash(message)
+        fd = os.open(self._entry_path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            content = os.read(fd, 256)
+            if content.startswith(CLAIMED):
+                # Left by a process that died before writing its bulletin
+                expired = now - float(content.split()[2]) > self.claim_lease
+            else:
+                # An empty entry was just created
+                expired = now - os.fstat(fd).st_mtime > self.retention
+            if content and not expired and not self.resend:
+                return None
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, CLAIMED + "{} {}".format(os.getpid(), now).encode())
+            return key
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def record(self, key, gts_filename):
+        """Keeps the name of the bulletin written for a claimed message"""
+        with open(self._entry_path(key), "w") as f:
+            f.write(os.path.basename(gts_filename))
+
+    def release(self, key):
+        """Drops the claim of a message that could not be written"""
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, message):
+        """
+        Returns:
+            str: The name of the bulletin the message was written as, None if
+                it was not produced within the retention or is only claimed.
+        """
+        path = self._entry_path(message_hash(message))
+        try:
+            if time.time() - os.stat(path).st_mtime > self.retention:
+                return None
+            with open(path, "r") as f:
+                name = f.read()
+            if name.encode().startswith(CLAIMED):
+                return None
+            return name or None
+        except FileNotFoundError:
+            return None
+
+    def prune(self):
+        """
+        Removes the entries older than the retention.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.state_dir):
+            path = os.path.join(self.state_dir, name)
+            if name.endswith(".sha256") and now - os.stat(path).st_mtime > self.retention:
+                os.remove(path)
+                removed += 1
+        return removed
@@ -0,0 +1,136 @@
+"""Messages started from a header built once per template
+- HandleCounter - creates and releases ecCodes handles, counting those alive
+- HANDLES - the counter of the handles of a process
+- HeaderCache - clones messages with the header and descriptors already set
+- HEADER_CACHE - the cache shared by the templates of a process
+"""
+
+import threading
+from collections import OrderedDict
+from eccodes import (
+    codes_bufr_new_from_samples,
+    codes_clone,
+    codes_release,
+    codes_set,
+    codes_set_array,
+)
+
+
+class HandleCounter(object):
+    """
+    Creates and releases the ecCodes handles of the package, counting those alive.
+
+    ecCodes does not tell how many handles a process holds, and a handle
+    that is never released keeps its message in memory for good. Every
+    handle created through the counter is counted until it is released
+    through it, so a leak shows up as a count growing from file to file.
+    The handles kept by the caches are included.
+    """
+
+    def __init__(self):
+        self.live = 0
+        self._lock = threading.Lock()
+
+    def _add(self, value):
+        with self._lock:
+            self.live += value
+
+    def new_from_samples(self, sample):
+        ibufr = codes_bufr_new_from_samples(sample)
+        self._add(1)
+        return ibufr
+
+    def clone(self, ibufr):
+        clone = codes_clone(ibufr)
+        self._add(1)
+        return clone
+
+    def release(self, ibufr):
+        codes_release(ibufr)
+        self._add(-1)
+
+
+HANDLES = HandleCounter()
+
+
+class HeaderCache(object):
+    """
+    Keeps a packed message for each header and descriptor layout.
+
+    Setting `unexpandedDescriptors` expands the template into its data keys,
+    which is the most expensive step before any value is set. The message
+    is built once for each sample, Section 1 header, replication factors and
+    descriptors, and every later message with the same layout is cloned
+    from it. Values that change from profile to profile, such as the typical
+    date, are left to the caller.
+
+    Args:
+        maxsize (int, optional): Number of layouts kept, the least recently
+            used is released first. Defaults to 32.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def new_message(self, sample, header, replication, descriptors):
+        """
+        Returns a new message with the header and descriptors set.
+
+        Args:
+            sample (str): The ecCodes sample to start from, e.g. "BUFR4_local".
+            header (list): The Section 1 (key, value) pairs, in the order they
+                must be set.
+            replication (list): The extended delayed replication factors.
+            descriptors (list): The unexpanded descriptors.
+
+        Returns:
+            int: The ecCodes handle, unpacked and to be released by the caller.
+        """
+        key = (sample, tuple(header), tuple(replication), tuple(descriptors))
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                template = self._build(sample, header, replication, descriptors)
+                self._templates[key] = template
+                if len(self._templates) > self.maxsize:
+                    _, oldest = self._templates.popitem(last=False)
+                    HANDLES.release(oldest)
+            else:
+                self._templates.move_to_end(key)
+            ibufr = HANDLES.clone(template)
+        try:
+            codes_set(ibufr, "unpack", 1)
+        except Exception:
+            HANDLES.release(ibufr)
+            raise
+        return ibufr
+
+    def clear(self):
+        """Releases every cached message."""
+        with self._lock:
+            while self._templates:
+                _, template = self._templates.popitem()
+                HANDLES.release(template)
+
+    @staticmethod
+    def _build(sample, header, replication, descriptors):
+        ibufr = HANDLES.new_from_samples(sample)
+        try:
+            for key, value in header:
+                codes_set(ibufr, key, value)
+            codes_set_array(
+                ibufr, "inputExtendedDelayedDescriptorReplicationFactor", list(replication)
+            )
+            codes_set_array(ibufr, "unexpandedDescriptors", list(descriptors))
+        except Exception:
+            HANDLES.release(ibufr)
+            raise
+        return ibufr
+
+
+HEADER_CACHE = HeaderCache()
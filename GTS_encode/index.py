@@ -0,0 +1,153 @@
+"""Persistent record of the publication decisions taken by the Wrapper
+- EligibilityIndex - on-disk index keyed by path, mtime and size
+"""
+
+import os
+import json
+import datetime as dt
+
+# Attributes that drive the publication decision, kept to allow invalidation
+DECISION_ATTRS = ("public", "wigos_id", "publication_date")
+
+
+class EligibilityIndex(object):
+    """
+    Keeps the publication decision of each file between cycles.
+
+    An entry is only valid while the file keeps the modification time and
+    size it had when the decision was taken, so a file rewritten upstream
+    is evaluated again. Decisions that depend on changes made elsewhere,
+    e.g. a new publication date for a platform, are dropped with `invalidate`.
+    The entries of files that no longer exist are dropped when it is saved.
+
+    Args:
+        path (str): The JSON file where the index is stored.
+        logger (logging.Logger): The logger object for logging messages.
+    """
+
+    version = 1
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger
+        self.entries = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self.entries = data.get("files", {})
+        except Exception as exc:
+            if self.logger:
+                self.logger.error(
+                    "Could not read eligibility index {}: {}".format(self.path, exc)
+                )
+
+    def lookup(self, filename):
+        """
+        Returns the recorded decision if the file is unchanged since it was taken.
+
+        Args:
+            filename (str): The path to the file.
+
+        Returns:
+            dict: The entry with the decision, or None if there is no valid entry.
+        """
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        if entry["mtime_ns"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            return None
+        return entry
+
+    def record(self, filename, available, attrs=None, gts_filename=None):
+        """
+        Records the publication decision taken for a file.
+
+        Args:
+            filename (str): The path to the file.
+            available (bool): Whether the file is available for GTS publication.
+            attrs (dict, optional): The global attributes of the file.
+            gts_filename (str, optional): The GTS file produced from the file.
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return
+        attrs = attrs or {}
+        entry = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "available": bool(available),
+            "gts_filename": gts_filename,
+            "decided": dt.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        for attr in DECISION_ATTRS:
+            entry[attr] = str(attrs[attr]) if attr in attrs else None
+        self.entries[filename] = entry
+
+    def invalidate(self, **attrs):
+        """
+        Drops the entries whose recorded attributes match all the given values.
+
+        Called without arguments it drops every entry.
+
+        Args:
+            **attrs: Values of `public`, `wigos_id` or `publication_date`.
+
+        Returns:
+            int: The number of entries dropped.
+        """
+        unknown = set(attrs) - set(DECISION_ATTRS)
+        if unknown:
+            raise ValueError(
+                "Cannot invalidate on {}, use any of {}".format(
+                    sorted(unknown), DECISION_ATTRS
+                )
+            )
+        dropped = [
+            filename
+            for filename, entry in self.entries.items()
+            if all(entry.get(key) == str(value) for key, value in attrs.items())
+        ]
+        for filename in dropped:
+            del self.entries[filename]
+        return len(dropped)
+
+    def prune(self):
+        """
+        Drops the entries of the files that no longer exist.
+
+        Returns:
+            int: The number of entries dropped.
+        """
+        dropped = []
+        for filename in self.entries:
+            try:
+                os.stat(filename)
+            except FileNotFoundError:
+                dropped.append(filename)
+        for filename in dropped:
+            del self.entries[filename]
+        return len(dropped)
+
+    def save(self):
+        """
+        Writes the index atomically so an interrupted cycle leaves the last good
+        copy, without the entries of the files that no longer exist.
+        """
+        self.prune()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.version, "files": self.entries}, f)
+        os.replace(tmp_path, self.path)
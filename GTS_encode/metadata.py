@@ -0,0 +1,71 @@
+"""Metadata of the Mangopare files needed before encoding
+- DatasetMetadata - single open of a file with cached attributes and time bounds
+- open_dataset - opens a file, importing xarray on first use
+"""
+
+import datetime as dt
+
+
+def open_dataset(filename):
+    """
+    Opens a NetCDF file with xarray.
+
+    xarray is only imported here, so a cycle with no file to check does
+    not pay for it.
+
+    Args:
+        filename (str): The path to the NetCDF file.
+
+    Returns:
+        xarray.Dataset: The open dataset.
+    """
+    import xarray as xr
+
+    xr.set_options(keep_attrs=True)
+    return xr.open_dataset(filename, cache=False, engine="netcdf4")
+
+
+class DatasetMetadata(object):
+    """
+    Opens a NetCDF file once and caches what the publication checks need.
+
+    The open dataset is kept in `ds` so it can be handed to the template
+    classes instead of opening the file again.
+
+    Args:
+        filename (str): The path to the NetCDF file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.ds = open_dataset(filename)
+        self.attrs = dict(self.ds.attrs)
+        times = self.ds["DATETIME"].values
+        self.first_measurement = times[0]
+        self.last_measurement = times[-1]
+
+    @property
+    def public(self):
+        return self.attrs["public"]
+
+    @property
+    def wigos_id(self):
+        return self.attrs["wigos_id"]
+
+    @property
+    def publication_date(self):
+        import numpy as np
+
+        publication_date = dt.datetime.strptime(
+            self.attrs["publication_date"], "%d/%m/%Y"
+        )
+        return np.datetime64(publication_date)
+
+    def close(self):
+        self.ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,201 @@
+"""Timings and counters of an encoding cycle
+- resident_memory - the resident set size of this process
+- CycleMetrics - wall time per stage, counters and gauges, per file and per cycle
+- NULL_METRICS - does nothing, used while instrumentation is disabled
+"""
+
+import os
+import json
+import time
+import contextlib
+
+
+def resident_memory():
+    """
+    Returns the memory of this process held in RAM.
+
+    Returns:
+        int: The resident set size in bytes, the peak one where /proc is
+            not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class NullMetrics(object):
+    """Stands in for CycleMetrics so disabled instrumentation costs a method call"""
+
+    enabled = False
+    _context = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def count(self, name, value=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+    def start_file(self, filename):
+        pass
+
+    def end_file(self, status, GTS_filename=None):
+        pass
+
+    def suspend_file(self):
+        return None
+
+    def resume_file(self, record):
+        pass
+
+    def merge(self, stages, counters, gauges=None):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class CycleMetrics(object):
+    """
+    Records the wall time of each stage and counters for a cycle and for each file.
+
+    Stages may nest, e.g. "write" runs inside the template encoding, and
+    each is timed on its own. While a file is open with `start_file`, its
+    stages and counters are also kept in the record of that file. Gauges,
+    such as the resident memory after a file, are kept as measured in the
+    file record and as their highest value for the cycle.
+
+    Args:
+        logger (logging.Logger, optional): Where each file record and the
+            cycle summary are logged as JSON. Defaults to None.
+    """
+
+    enabled = True
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.files = []
+        self._file = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times the enclosed block as `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._add(self.stages, self._file and self._file["stages"], name, elapsed)
+
+    def count(self, name, value=1):
+        """Adds `value` to the counter `name`"""
+        self._add(self.counters, self._file and self._file["counters"], name, value)
+
+    def gauge(self, name, value):
+        """Sets the gauge `name` of the current file to `value`"""
+        self.gauges[name] = max(self.gauges.get(name, value), value)
+        if self._file is not None:
+            self._file["gauges"][name] = value
+
+    @staticmethod
+    def _add(totals, file_totals, name, value):
+        totals[name] = totals.get(name, 0) + value
+        if file_totals is not None:
+            file_totals[name] = file_totals.get(name, 0) + value
+
+    def start_file(self, filename):
+        self._file = {
+            "filename": filename,
+            "status": None,
+            "gts_filename": None,
+            "stages": {},
+            "counters": {},
+            "gauges": {},
+            "_started": time.perf_counter(),
+        }
+
+    def end_file(self, status, GTS_filename=None):
+        """
+        Closes the record of the current file.
+
+        Args:
+            status (str): What happened to the file, e.g. "encoded", "duplicate",
+                "unavailable", "indexed" or "failed". Counted as `files_<status>`.
+            GTS_filename (str, optional): The GTS file produced from the file.
+        """
+        record = self._file
+        self._file = None
+        if record is None:
+            return
+        record["wall"] = time.perf_counter() - record.pop("_started")
+        record["status"] = status
+        record["gts_filename"] = GTS_filename
+        self.files.append(record)
+        self.count("files_" + status)
+        if self.logger is not None:
+            self.logger.info("GTS encode file metrics {}".format(json.dumps(record)))
+
+    def suspend_file(self):
+        """
+        Detaches the record of the current file, e.g. while a worker process encodes it.
+
+        Returns:
+            dict: The open record, to be given back to `resume_file`.
+        """
+        record, self._file = self._file, None
+        return record
+
+    def resume_file(self, record):
+        self._file = record
+
+    def merge(self, stages, counters, gauges=None):
+        """Adds the stages, counters and gauges recorded by a worker process"""
+        for name, value in stages.items():
+            self._add(self.stages, self._file and self._file["stages"], name, value)
+        for name, value in counters.items():
+            self.count(name, value)
+        for name, value in (gauges or {}).items():
+            self.gauge(name, value)
+
+    def summary(self):
+        """
+        Returns:
+            dict: The wall time of the cycle, the number of files, the total
+                time of each stage, the value of each counter and the highest
+                value of each gauge.
+        """
+        return {
+            "wall": time.perf_counter() - self.started,
+            "files": len(self.files),
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+        }
+
+    def emit(self, path=None):
+        """
+        Logs the cycle summary and optionally writes it with the file records.
+
+        Args:
+            path (str, optional): JSON file for the summary and file records.
+
+        Returns:
+            dict: The cycle summary.
+        """
+        summary = self.summary()
+        if self.logger is not None:
+            self.logger.info("GTS encode cycle metrics {}".format(json.dumps(summary)))
+        if path:
+            with open(path, "w") as f:
+                json.dump({"summary": summary, "files": self.files}, f, indent=2)
+        return summary
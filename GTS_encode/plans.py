@@ -0,0 +1,426 @@
+"""Declarative template specs compiled into encode plans
+- SPECS - the keys of the 315003, 315007 and 315012 templates and where their values come from
+- EncodePlan - a spec compiled for a number of levels, run once per profile
+- PlanCache - keeps the plans compiled for each template, levels and header
+- PLAN_CACHE - the cache shared by the templates of a process
+
+Each key of a spec is one of
+- ("constant", key, rank, value) - the same value in every message
+- ("missing", key, rank) - always missing
+- ("value", key, rank, source) - a per-profile scalar
+- ("levels", key, start, source) - a per-profile array over the occurrences
+  from `start`, one per level
+- ("levels_constant", key, start, pattern) - `pattern` repeated for each level
+  from occurrence `start`, MISSING for missing values
+
+A rank is None for a key without rank, the 1-based rank of the occurrence,
+or "n+k" for the occurrence k after the number of levels n. A source is the
+name of a value given by the template, or (name, index) for one element of
+an array, e.g. ("years", -1) for the year of the last sample.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from eccodes import (
+    CODES_MISSING_DOUBLE,
+    codes_get_array,
+    codes_gts_header,
+    codes_set,
+    codes_set_array,
+    codes_set_missing,
+)
+from GTS_encode.handles import HANDLES
+
+MISSING = None
+
+# Section 1 header shared by the templates, in the order it must be set.
+# Strings are the parameters the plan is compiled with.
+HEADER = [
+    ("masterTableNumber", 0),
+    ("bufrHeaderSubCentre", 0),
+    ("bufrHeaderCentre", "centre_code"),
+    ("updateSequenceNumber", 0),
+    ("dataCategory", 31),  # CREX Table A 31 -> Oceanographic Data
+    ("masterTablesVersionNumber", 28),  # Latest version 28 -> 15 November 2021
+    ("localTablesVersionNumber", 0),
+    ("numberOfSubsets", 1),
+    ("observedData", 1),
+    ("compressedData", 0),
+]
+
+TYPICAL_DATE = [
+    ("value", "typicalMonth", None, ("months", 0)),
+    ("value", "typicalDay", None, ("days", 0)),
+    ("value", "typicalHour", None, ("hours", 0)),
+    ("value", "typicalMinute", None, ("minutes", 0)),
+]
+
+SPECS = {
+    # Subsurface float profile
+    "315003": {
+        "sample": "BUFR4",
+        "gts_header": True,
+        "header": [("edition", 4)] + HEADER,
+        "replication": ["n"],
+        "descriptors": [315003],
+        "keys": [("value", "typicalYear", None, ("years", 0))]
+        + TYPICAL_DATE
+        + [
+            ("value", "marineObservingPlatformIdentifier", None, "internal_ship_id"),
+            ("value", "observingPlatformManufacturerModel", None, "sensor_model"),
+            ("value", "observingPlatformManufacturerSerialNumber", None, "sensor_serial"),
+            ("constant", "buoyType", None, 2),  # subsurface float, moving
+            ("constant", "dataCollectionLocationSystem", None, 2),  # GPS
+            ("constant", "dataBuoyType", None, 8),  # Unspecified subsurface float
+            ("value", "directionOfProfile", None, "direction"),
+            # Marine mammal
+            ("constant", "instrumentTypeForWaterTemperatureOrSalinityProfileMeasurement", None, 995),
+            ("value", "year", 1, ("years", 0)),
+            ("value", "month", 1, ("months", 0)),
+            ("value", "day", 1, ("days", 0)),
+            ("value", "hour", 1, ("hours", 0)),
+            ("value", "minute", 1, ("minutes", 0)),
+            ("value", "latitude", 1, ("latitudes", 0)),
+            ("value", "longitude", 1, ("longitudes", 0)),
+            ("levels", "waterPressure", 0, "pressures"),
+            ("levels", "oceanographicWaterTemperature", 0, "temperatures"),
+            ("levels_constant", "salinity", 0, [MISSING]),
+            # Pressure, temperature and salinity flags
+            ("levels_constant", "qualifierForGtsppQualityFlag", 0, [10, 11, 63]),
+            ("levels_constant", "globalGtsppQualityFlag", 0, [9, 9, 15]),
+        ],
+    },
+    # Ship profile, with the current and dissolved oxygen profiles missing
+    "315007": {
+        "sample": "BUFR4_local",
+        "gts_header": True,
+        "header": [("edition", 4)] + HEADER,
+        # The current and dissolved oxygen profiles have a single level
+        "replication": ["n", 1, 1],
+        "descriptors": [1125, 1126, 1127, 1128, 315007],
+        "keys": [("value", "typicalYear", None, ("years", 0))]
+        + TYPICAL_DATE
+        + [
+            ("value", "wigosIdentifierSeries", None, "wigos_series"),
+            ("value", "wigosIssuerOfIdentifier", None, "wigos_issuer"),
+            ("value", "wigosIssueNumber", None, "wigos_issue_number"),
+            ("value", "wigosLocalIdentifierCharacter", None, "wigos_local_id"),
+            ("value", "shipOrMobileLandStationIdentifier", None, "internal_id"),
+            ("value", "marineObservingPlatformIdentifier", None, "wigos_issuer"),
+            ("value", "identifierOfTheCruiseOrMission", None, "platform_code"),
+            ("value", "uniqueIdentifierForProfile", None, "profile_id"),
+            ("value", "year", None, ("years", -1)),
+            ("value", "month", None, ("months", -1)),
+            ("value", "day", None, ("days", -1)),
+            ("value", "hour", None, ("hours", -1)),
+            ("value", "minute", None, ("minutes", -1)),
+            ("value", "latitude", None, ("latitudes", -1)),
+            ("value", "longitude", None, ("longitudes", -1)),
+            ("value", "totalWaterDepth", None, "total_depth"),
+            ("constant", "instrumentTypeForWaterTemperatureOrSalinityProfileMeasurement", 1, 902),
+            ("value", "instrumentSerialNumberForWaterTemperatureProfile", 1, "serial_number"),
+            # Surface temperature, the last value of the profile
+            ("constant", "methodOfWaterTemperatureAndOrOrSalinityMeasurement", 1, 15),
+            ("value", "oceanographicWaterTemperature", 1, ("temperatures", -1)),
+            ("value", "depthBelowWaterSurface", 1, "surface_depth"),
+            ("constant", "timeSignificance", 1, 25),
+            # Surface salinity and current
+            ("constant", "methodOfSalinityOrDepthMeasurement", 1, 0),
+            ("missing", "depthBelowWaterSurface", 2),
+            ("missing", "salinity", 1),
+            ("missing", "methodOfSeaOrWaterCurrentMeasurement", 1),
+            ("missing", "methodOfRemovingVelocityAndMotionOfPlatformFromCurrent", 1),
+            ("missing", "durationAndTimeOfCurrentMeasurement", 1),
+            ("missing", "seaSurfaceCurrentDirection", 1),
+            ("missing", "speedOfSeaSurfaceCurrent", 1),
+            # Temperature and salinity profile
+            ("missing", "instrumentTypeForWaterTemperatureOrSalinityProfileMeasurement", 2),
+            ("missing", "instrumentSerialNumberForWaterTemperatureProfile", 2),
+            ("constant", "methodOfWaterTemperatureAndOrOrSalinityMeasurement", 2, 14),
+            ("constant", "instrumentTypeForWaterTemperatureOrSalinityProfileMeasurement", 3, 902),
+            ("constant", "waterTemperatureProfileRecorderTypes", 1, 99),
+            ("value", "instrumentSerialNumberForWaterTemperatureProfile", 3, "serial_number"),
+            ("constant", "methodOfSalinityOrDepthMeasurement", 2, 1),
+            ("constant", "indicatorForDigitization", 1, 0),
+            ("value", "directionOfProfile", 1, "direction"),
+            ("constant", "methodOfDepthCalculation", 1, 1),
+            ("levels", "depthBelowWaterSurface", 2, "depths"),
+            ("levels", "waterPressure", 0, "pressures"),
+            ("levels", "oceanographicWaterTemperature", 1, "temperatures"),
+            ("levels_constant", "salinity", 1, [MISSING]),
+            # Depth, pressure, temperature and salinity flags
+            ("levels_constant", "qualifierForGtsppQualityFlag", 0, [13, 10, 11, 63]),
+            ("levels_constant", "globalGtsppQualityFlag", 0, [9, 9, 9, 15]),
+            # Current profile
+            ("missing", "indicatorForDigitization", 2),
+            ("missing", "methodOfSeaOrWaterCurrentMeasurement", 2),
+            ("missing", "methodOfRemovingVelocityAndMotionOfPlatformFromCurrent", 2),
+            ("missing", "durationAndTimeOfCurrentMeasurement", 2),
+            ("missing", "directionOfProfile", 2),
+            ("missing", "methodOfDepthCalculation", 2),
+            ("missing", "depthBelowWaterSurface", "n+3"),
+            ("missing", "waterPressure", "n+1"),
+            ("missing", "speedOfCurrent", 1),
+            ("missing", "CurrentDirection", 1),
+            # Dissolved oxygen profile
+            ("missing", "indicatorForDigitization", 3),
+            ("missing", "methodOfDepthCalculation", 3),
+            ("missing", "depthBelowWaterSurface", "n+4"),
+            ("missing", "waterPressure", "n+2"),
+            ("missing", "instrumentTypeOrSensorForDissolvedOxygenMeasurement", 1),
+            ("missing", "oceanographicDissolvedOxygen", 1),
+        ],
+    },
+    # Glider trajectory, not officially released so the descriptors are listed
+    "315012": {
+        "sample": "BUFR3_local",
+        "gts_header": False,
+        "header": [("edition", 3)] + HEADER,
+        "replication": ["n"],
+        "descriptors": [
+            201129, 1087, 201000, 1019, 1036, 2148, 1085, 1086, 8021, 301011,
+            301013, 301021, 11104, 2169, 11002, 11001, 2169, 22032, 22005, 301011,
+            301013, 8021, 4025, 301021, 22031, 22004, 8021, 5068, 1079, 123000,
+            31001, 22056, 120000, 31002, 301011, 301013, 301021, 8080, 33050, 7062,
+            8080, 33050, 22065, 8080, 33050, 22045, 8080, 33050, 22066, 8080,
+            33050, 22064, 8080, 33050,
+        ],
+        "keys": [("value", "typicalYearOfCentury", None, "year_of_century")]
+        + TYPICAL_DATE
+        + [
+            ("constant", "observingPlatformManufacturerModel", None, "Moana TD"),
+            ("value", "observingPlatformManufacturerSerialNumber", None, "deck_unit_serial_number"),
+            # Surface and ocean current sections, at the last sample
+            ("constant", "timeSignificance", 1, 25),
+            ("constant", "timeSignificance", 2, 2),
+            ("constant", "timePeriod", 1, 50),
+        ]
+        + [
+            ("value", key, rank, (source, -1))
+            for rank in (1, 2)
+            for key, source in (
+                ("year", "years"),
+                ("month", "months"),
+                ("day", "days"),
+                ("hour", "hours"),
+                ("minute", "minutes"),
+                ("latitude", "latitudes"),
+                ("longitude", "longitudes"),
+            )
+        ]
+        + [
+            ("value", "uniqueIdentifierForProfile", 1, "profile_id"),
+            ("value", "directionOfProfile", 1, "direction"),
+            # The points follow the two surface and current occurrences
+            ("levels", "year", 2, "years"),
+            ("levels", "month", 2, "months"),
+            ("levels", "day", 2, "days"),
+            ("levels", "hour", 2, "hours"),
+            ("levels", "minute", 2, "minutes"),
+            ("levels", "latitude", 2, "latitudes"),
+            ("levels", "longitude", 2, "longitudes"),
+            ("levels", "depthBelowWaterSurface", 0, "depths"),
+            ("levels", "oceanographicWaterPressure", 0, "pressures"),
+            ("levels", "oceanographicWaterTemperature", 0, "temperatures"),
+            ("levels_constant", "oceanographicWaterConductivity", 0, [MISSING]),
+            ("levels_constant", "salinity", 0, [MISSING]),
+            # Position, depth, pressure, temperature, conductivity and salinity flags
+            ("levels_constant", "qualifierForGtsppQualityFlag", 0, [20, 13, 10, 11, 63, 63]),
+            ("levels_constant", "globalGtsppQualityFlag", 0, [9, 9, 9, 9, 15, 15]),
+        ],
+    },
+}
+
+
+def resolve_rank(rank, n_levels):
+    """The 1-based rank of an occurrence, resolving "n+k" for `n_levels` levels"""
+    if isinstance(rank, str):
+        return n_levels + int(rank.split("+")[1])
+    return rank
+
+
+def ranked_key(key, rank):
+    return key if rank is None else "#{}#{}".format(rank, key)
+
+
+def _lookup(values, source):
+    if isinstance(source, tuple):
+        name, index = source
+        return values[name][index]
+    return values[source]
+
+
+def _scalar(value):
+    # ecCodes picks the key type from the Python type of the value
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class EncodePlan(object):
+    """
+    A template spec compiled for one number of levels and one header.
+
+    The constant and missing keys are set once on a packed prototype, and
+    the key names and the occurrences of each array are resolved for the
+    number of levels. A message then takes a clone of the prototype, one
+    `codes_set` per per-profile scalar and one `codes_set_array` per array,
+    whatever the number of constant keys.
+
+    Args:
+        spec (dict): One of `SPECS`.
+        n_levels (int): The number of levels of the profiles.
+        header_cache (HeaderCache): Where the expanded message is cloned from.
+        **params: The header parameters of the spec, e.g. centre_code.
+    """
+
+    def __init__(self, spec, n_levels, header_cache, **params):
+        self.spec = spec
+        self.n_levels = n_levels
+        self._lock = threading.Lock()
+        header = [
+            (key, params[value] if isinstance(value, str) else value)
+            for key, value in spec["header"]
+        ]
+        replication = [n_levels if factor == "n" else factor for factor in spec["replication"]]
+        # Keys with per-profile values over the levels are set as whole arrays
+        arrays = {entry[1] for entry in spec["keys"] if entry[0] == "levels"}
+        self.scalars = []
+        fills = OrderedDict((key, []) for key in sorted(arrays))
+        ibufr = header_cache.new_message(spec["sample"], header, replication, spec["descriptors"])
+        try:
+            for entry in spec["keys"]:
+                kind, key, rank = entry[:3]
+                if kind == "levels":
+                    fills[key].append((rank, rank + n_levels, entry[3]))
+                elif kind == "levels_constant":
+                    self._set_levels_constant(ibufr, key, rank, entry[3])
+                elif kind == "value" and key in arrays:
+                    if rank is None:
+                        raise ValueError("{} needs a rank to be set with its levels".format(key))
+                    index = resolve_rank(rank, n_levels) - 1
+                    fills[key].append((index, index + 1, entry[3]))
+                elif kind == "value":
+                    self.scalars.append((ranked_key(key, resolve_rank(rank, n_levels)), entry[3]))
+                elif kind == "constant":
+                    codes_set(ibufr, ranked_key(key, resolve_rank(rank, n_levels)), entry[3])
+                elif kind == "missing":
+                    codes_set_missing(ibufr, ranked_key(key, resolve_rank(rank, n_levels)))
+                else:
+                    raise ValueError("Unknown kind {} of {}".format(kind, key))
+            codes_set(ibufr, "pack", 1)
+            # The constants of each array are the base its values are filled in
+            self.arrays = [
+                (key, codes_get_array(ibufr, key), key_fills) for key, key_fills in fills.items()
+            ]
+            self._prototype = HANDLES.clone(ibufr)
+        except Exception:
+            HANDLES.release(ibufr)
+            raise
+        # Unpacking the expanded template costs as much as building it, so the
+        # message the plan was compiled on is handed out first
+        self._first = ibufr
+
+    def _set_levels_constant(self, ibufr, key, start, pattern):
+        pattern = [CODES_MISSING_DOUBLE if value is MISSING else value for value in pattern]
+        current = codes_get_array(ibufr, key)
+        stop = start + self.n_levels * len(pattern)
+        current[start:stop] = np.tile(pattern, self.n_levels)
+        codes_set_array(ibufr, key, current)
+
+    def new_message(self, values):
+        """
+        Returns a message with every key of the spec set.
+
+        Args:
+            values (dict): The sources of the spec, e.g. the arrays of the
+                profile, by name.
+
+        Returns:
+            int: The ecCodes handle, unpacked and to be released by the caller.
+        """
+        if self.spec["gts_header"]:
+            codes_gts_header(True)
+        with self._lock:
+            ibufr, self._first = self._first, None
+            unpack = ibufr is None
+            if unpack:
+                ibufr = HANDLES.clone(self._prototype)
+        try:
+            if unpack:
+                codes_set(ibufr, "unpack", 1)
+            for key, source in self.scalars:
+                codes_set(ibufr, key, _scalar(_lookup(values, source)))
+            for key, base, fills in self.arrays:
+                array = base.copy()
+                for start, stop, source in fills:
+                    array[start:stop] = _lookup(values, source)
+                codes_set_array(ibufr, key, array)
+        except Exception:
+            HANDLES.release(ibufr)
+            raise
+        return ibufr
+
+    def release(self):
+        with self._lock:
+            for ibufr in (self._first, self._prototype):
+                if ibufr is not None:
+                    HANDLES.release(ibufr)
+            self._first = self._prototype = None
+
+
+class PlanCache(object):
+    """
+    Keeps the plan compiled for each template, number of levels and header.
+
+    Args:
+        maxsize (int, optional): Number of plans kept, the least recently
+            used is released first. Defaults to 32.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def get(self, name, n_levels, header_cache, **params):
+        """
+        Returns the plan of the spec `name` for `n_levels`, compiling it if needed.
+
+        Args:
+            name (str): The template sequence, a key of `SPECS`.
+            n_levels (int): The number of levels of the profile.
+            header_cache (HeaderCache): Where the expanded message is cloned from.
+            **params: The header parameters of the spec, e.g. centre_code.
+
+        Returns:
+            EncodePlan: The compiled plan.
+        """
+        key = (name, n_levels, tuple(sorted(params.items())))
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is None:
+                plan = self.compile(name, n_levels, header_cache, **params)
+                self._plans[key] = plan
+                if len(self._plans) > self.maxsize:
+                    _, oldest = self._plans.popitem(last=False)
+                    oldest.release()
+            else:
+                self._plans.move_to_end(key)
+        return plan
+
+    def compile(self, name, n_levels, header_cache, **params):
+        return EncodePlan(SPECS[name], n_levels, header_cache, **params)
+
+    def clear(self):
+        """Releases every cached plan."""
+        with self._lock:
+            while self._plans:
+                _, plan = self._plans.popitem()
+                plan.release()
+
+
+PLAN_CACHE = PlanCache()
@@ -0,0 +1,234 @@
+"""Worker processes kept within a memory ceiling
+- RecyclingPool - runs tasks in processes replaced once they grow past the ceiling
+"""
+
+import queue
+import pickle
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from GTS_encode.metrics import resident_memory
+
+IDLE = -1
+# Workers dying in a row before taking a task, after which the pool is broken
+MAX_FAILED_STARTS = 3
+
+
+def _picklable(exc):
+    try:
+        pickle.dumps(exc)
+    except Exception:
+        return RuntimeError(repr(exc))
+    return exc
+
+
+def _work(slot, running, tasks, results, max_rss, initializer, initargs):
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except BaseException as exc:
+            results.put(("init_error", slot, IDLE, _picklable(exc), False))
+            return
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, fn, args = task
+        # Shared memory is written at once, unlike the queue, so the task of
+        # a worker that crashes is still known
+        running[slot] = task_id
+        try:
+            kind, payload = "done", fn(*args)
+        except BaseException as exc:
+            kind, payload = "error", _picklable(exc)
+        retire = max_rss is not None and resident_memory() > max_rss
+        results.put((kind, slot, task_id, payload, retire))
+        running[slot] = IDLE
+        if retire:
+            return
+
+
+class RecyclingPool(object):
+    """
+    Runs tasks in worker processes replaced once they grow past a memory ceiling.
+
+    Memory held by ecCodes, netCDF and the allocator is not always given
+    back once a file is encoded, so a long backlog grows a worker until it
+    hits the memory limit of the job. Each worker checks its resident
+    memory after every task and exits once it is above `max_rss`, a new
+    worker taking its place, which keeps the memory of the run flat. A
+    worker that dies, e.g. from a segmentation fault in ecCodes, fails the
+    task it was running and is replaced too. As with a ProcessPoolExecutor,
+    the pool is broken when the initializer fails, or when workers keep
+    dying before they take a task, and every pending task then fails with
+    BrokenProcessPool.
+
+    Tasks are given with `submit` as to a ProcessPoolExecutor.
+
+    Args:
+        max_workers (int, optional): Number of worker processes. Defaults to 1.
+        max_rss (int, optional): Bytes of resident memory after which a
+            worker is replaced. Defaults to None, which keeps the workers.
+        initializer (callable, optional): Called in each new worker with `initargs`.
+        initargs (tuple, optional): The arguments of `initializer`.
+    """
+
+    def __init__(self, max_workers=1, max_rss=None, initializer=None, initargs=()):
+        self.max_workers = max_workers
+        self.max_rss = max_rss
+        self.initializer = initializer
+        self.initargs = initargs
+        self.recycled = 0
+        self.crashed = 0
+        self._failed_starts = 0
+        self._broken = None
+        self._context = multiprocessing.get_context()
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._running = self._context.Array("q", [IDLE] * max_workers, lock=False)
+        self._ids = itertools.count()
+        self._futures = {}
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._closing = False
+        for slot in range(max_workers):
+            self._spawn(slot)
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _spawn(self, slot):
+        self._running[slot] = IDLE
+        process = self._context.Process(
+            target=_work,
+            args=(
+                slot,
+                self._running,
+                self._tasks,
+                self._results,
+                self.max_rss,
+                self.initializer,
+                self.initargs,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self._workers[slot] = process
+
+    def submit(self, fn, *args):
+        """
+        Queues `fn(*args)` for the next free worker.
+
+        Returns:
+            Future: Holds the result, or the error of the task.
+        """
+        future = Future()
+        with self._lock:
+            if self._broken:
+                raise BrokenProcessPool(self._broken)
+            if self._closing:
+                raise RuntimeError("Cannot submit to a pool that is shut down")
+            task_id = next(self._ids)
+            self._futures[task_id] = future
+        self._tasks.put((task_id, fn, args))
+        return future
+
+    def _collect(self):
+        while True:
+            with self._lock:
+                if self._broken or (self._closing and not self._futures):
+                    return
+            try:
+                message = self._results.get(timeout=0.2)
+            except queue.Empty:
+                self._reap()
+                continue
+            self._handle(message)
+
+    def _handle(self, message):
+        kind, slot, task_id, payload, retire = message
+        if kind == "init_error":
+            self._break("A worker initializer failed: {!r}".format(payload))
+            return
+        self._failed_starts = 0
+        with self._lock:
+            future = self._futures.pop(task_id, None)
+        if retire and not self._broken:
+            self._workers[slot].join()
+            self.recycled += 1
+            self._spawn(slot)
+        if future is None:
+            return
+        if kind == "done":
+            future.set_result(payload)
+        else:
+            future.set_exception(payload)
+
+    def _reap(self):
+        dead = [slot for slot, process in self._workers.items() if process.exitcode is not None]
+        if not dead:
+            return
+        # A retiring worker sends its result before exiting
+        while True:
+            try:
+                self._handle(self._results.get_nowait())
+            except queue.Empty:
+                break
+        for slot in dead:
+            if self._broken:
+                return
+            process = self._workers[slot]
+            if process.exitcode is None:
+                # Already replaced by a retired worker
+                continue
+            self.crashed += 1
+            task_id = self._running[slot]
+            if task_id == IDLE:
+                self._failed_starts += 1
+                if self._failed_starts >= MAX_FAILED_STARTS:
+                    self._break(
+                        "Workers keep exiting before taking a task, the last with code {}".format(
+                            process.exitcode
+                        )
+                    )
+                    return
+            self._spawn(slot)
+            with self._lock:
+                future = self._futures.pop(task_id, None)
+            if future is not None:
+                future.set_exception(
+                    RuntimeError(
+                        "Worker {} exited with code {}".format(process.pid, process.exitcode)
+                    )
+                )
+
+    def _break(self, reason):
+        """Fails every pending task and stops taking new ones"""
+        with self._lock:
+            self._broken = reason
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.set_exception(BrokenProcessPool(reason))
+
+    def shutdown(self, wait=True):
+        """Waits for the submitted tasks, then stops the workers"""
+        with self._lock:
+            self._closing = True
+        self._collector.join()
+        for process in self._workers.values():
+            if self._broken:
+                # The tasks left in the queue are already failed
+                process.terminate()
+            else:
+                self._tasks.put(None)
+        for process in self._workers.values():
+            process.join()
+        self._workers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,147 @@
+"""Reading of the Mangopare variables needed for encoding
+- read_profile - QC filtered (and upcast) arrays without building a dataframe
+- read_casts - QC filtered arrays of every cast of a deployment
+- thin_profile - reduction of a profile to fewer levels
+"""
+
+import numpy as np
+from GTS_encode.utils import (
+    pres,
+    upcast_start,
+    segment_casts,
+    bin_levels,
+    significant_levels,
+    max_levels,
+)
+
+# Code table 0 22 056 values of directionOfProfile
+DIRECTION_UP = 0
+DIRECTION_DOWN = 1
+DIRECTION_MISSING = 3
+
+
+def qc_mask(qc, QC_flag):
+    """Boolean mask of the samples whose QC flag is one of `QC_flag`"""
+    return np.isin(qc, np.atleast_1d(QC_flag))
+
+
+def time_components(times):
+    """Splits datetime64 values into year, month, day, hour, minute and second"""
+    days = times.astype("datetime64[D]")
+    seconds_of_day = (times - days).astype("timedelta64[s]").astype(np.int32)
+    months = days.astype("datetime64[M]")
+    years = months.astype("datetime64[Y]")
+    return {
+        "years": years.astype(np.int32) + 1970,
+        "months": (months - years).astype(np.int32) + 1,
+        "days": (days - months).astype(np.int32) + 1,
+        "hours": seconds_of_day // 3600,
+        "minutes": seconds_of_day // 60 % 60,
+        "seconds": seconds_of_day % 60,
+    }
+
+
+def read_profile(ds, QC_flag=1, upcast=True, thinning=None):
+    """
+    Reads the variables used by the templates as NumPy arrays.
+
+    The QC flag and depth are read first so the QC mask and the upcast
+    slice are known before the other variables are loaded, and only
+    DATETIME, DEPTH, LATITUDE, LONGITUDE, TEMPERATURE and QC_FLAG are read.
+
+    Args:
+        ds (xarray.Dataset): The Mangopare dataset.
+        QC_flag (int or list, optional): The accepted QC flags. Defaults to 1.
+        upcast (bool, optional): Whether to keep only the last upcast. Defaults to True.
+        thinning (tuple, optional): The method and value given to `thin_profile`.
+            Defaults to None, keeping every level.
+
+    Returns:
+        dict: The time components, latitudes, longitudes, depths, pressures
+            (Pa, rounded to 2 decimals) and temperatures (K) of the profile,
+            and its directionOfProfile code.
+    """
+    index = np.flatnonzero(qc_mask(ds["QC_FLAG"].values, QC_flag))
+    depths = ds["DEPTH"].values[index]
+    if upcast:
+        start = upcast_start(depths)
+        index = index[start:]
+        depths = depths[start:]
+    profile = _read_samples(ds, index, depths)
+    profile["direction"] = DIRECTION_UP if upcast else DIRECTION_MISSING
+    if thinning:
+        profile = thin_profile(profile, *thinning)
+    return profile
+
+
+def read_casts(ds, QC_flag=1, threshold=1.0, thinning=None):
+    """
+    Reads every cast of a deployment as its own profile.
+
+    The variables are read once for all the QC filtered samples, which
+    `segment_casts` then splits into casts.
+
+    Args:
+        ds (xarray.Dataset): The Mangopare dataset.
+        QC_flag (int or list, optional): The accepted QC flags. Defaults to 1.
+        threshold (float, optional): Minimum depth change, in metres, for a
+            movement to count as a cast. Defaults to 1.0.
+        thinning (tuple, optional): The method and value given to `thin_profile`
+            for each cast. Defaults to None, keeping every level.
+
+    Returns:
+        list: The profiles as returned by `read_profile`, one per cast in
+            time order.
+    """
+    index = np.flatnonzero(qc_mask(ds["QC_FLAG"].values, QC_flag))
+    depths = ds["DEPTH"].values[index]
+    samples = _read_samples(ds, index, depths)
+    casts = []
+    for start, stop, direction in segment_casts(depths, threshold):
+        profile = {key: values[start:stop] for key, values in samples.items()}
+        profile["direction"] = DIRECTION_DOWN if direction > 0 else DIRECTION_UP
+        if thinning:
+            profile = thin_profile(profile, *thinning)
+        casts.append(profile)
+    return casts
+
+
+def thin_profile(profile, method, value):
+    """
+    Keeps fewer levels of a profile, always including the first and last.
+
+    Args:
+        profile (dict): A profile from `read_profile` or `read_casts`.
+        method (str): "bins" keeps one level per `value` metres of depth,
+            "significant" the levels needed to interpolate the temperature
+            within `value` K, and "max" at most `value` evenly spread levels.
+        value (float): The parameter of the method.
+
+    Returns:
+        dict: The profile with every array reduced to the kept levels.
+    """
+    if method == "bins":
+        index = bin_levels(profile["depths"], value)
+    elif method == "significant":
+        index = significant_levels(profile["depths"], profile["temperatures"], value)
+    elif method == "max":
+        index = max_levels(len(profile["depths"]), int(value))
+    else:
+        raise ValueError("Unknown thinning method {}".format(method))
+    return {
+        key: values[index] if isinstance(values, np.ndarray) else values
+        for key, values in profile.items()
+    }
+
+
+def _read_samples(ds, index, depths):
+    latitudes = ds["LATITUDE"].values[index]
+    profile = time_components(ds["DATETIME"].values[index])
+    profile.update(
+        latitudes=latitudes,
+        longitudes=ds["LONGITUDE"].values[index],
+        depths=depths,
+        pressures=np.round(pres(depths, latitudes), 2),
+        temperatures=ds["TEMPERATURE"].values[index] + 273.15,
+    )
+    return profile
@@ -0,0 +1,72 @@
+"""Allocation of the bulletin numbers of the GTS identifiers
+- SequenceAllocator - per heading counters shared between processes and cycles
+"""
+
+import os
+import time
+import fcntl
+
+
+class SequenceAllocator(object):
+    """
+    Hands out the next free IOVEnn number of a `NZKL DDHHMM` heading.
+
+    Each heading keeps its last number in a small counter file that is
+    locked while it is read and incremented, so allocation takes constant
+    time, is safe across processes and persists between cycles. As DDHHMM
+    repeats every month, a counter not used for `reset_after` seconds
+    starts again from 1.
+
+    Args:
+        state_dir (str): The directory where the counter files are kept.
+        reset_after (float): Seconds after which an unused counter restarts.
+            Defaults to one day.
+    """
+
+    def __init__(self, state_dir, reset_after=86400):
+        self.state_dir = state_dir
+        self.reset_after = reset_after
+        os.makedirs(state_dir, exist_ok=True)
+
+    def _counter_path(self, heading):
+        return os.path.join(self.state_dir, heading.replace(" ", "_") + ".seq")
+
+    def next_number(self, heading):
+        """
+        Allocates the next number of a heading.
+
+        Args:
+            heading (str): The heading without the IOVEnn part, e.g. "NZKL 280818".
+
+        Returns:
+            int: The allocated number, starting from 1.
+        """
+        fd = os.open(self._counter_path(heading), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            content = os.read(fd, 32).strip()
+            expired = time.time() - os.fstat(fd).st_mtime > self.reset_after
+            number = 1 if not content or expired else int(content) + 1
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, str(number).encode())
+            return number
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def prune(self):
+        """
+        Removes the counter files that would restart on their next use.
+
+        Returns:
+            int: The number of counter files removed.
+        """
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.state_dir):
+            path = os.path.join(self.state_dir, name)
+            if name.endswith(".seq") and now - os.stat(path).st_mtime > self.reset_after:
+                os.remove(path)
+                removed += 1
+        return removed
@@ -0,0 +1,209 @@
+"""Durable queue of the bulletins waiting for the message switch
+- TransferSpool - one SQLite row per bulletin with its state, attempts and times
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+QUEUED = "queued"
+CLAIMED = "claimed"
+SENT = "sent"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulletins (
+    filename TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    enqueued REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    claimed REAL,
+    acked REAL
+);
+CREATE INDEX IF NOT EXISTS bulletins_due ON bulletins (state, next_attempt);
+"""
+
+
+class TransferSpool(object):
+    """
+    Keeps the bulletins to upload and the outcome of each attempt in SQLite.
+
+    The encoder enqueues each bulletin it writes and the uploaders claim
+    batches of the due ones, so nothing scans the output directory and the
+    queue survives crashes. A failed upload is scheduled again after a
+    backoff doubled on each attempt, without holding back the other
+    bulletins, until `max_attempts` is reached. A claim not acknowledged
+    within `lease` seconds, e.g. from an uploader that died, is handed out
+    again. A bulletin that used up its attempts is left failed, counted by
+    `stats` and only sent again if it is enqueued again, until `prune`
+    removes it with the sent ones.
+
+    Args:
+        path (str): The SQLite database file.
+        max_attempts (int, optional): Attempts before a bulletin is left
+            failed. Defaults to 10.
+        backoff (float, optional): Seconds before the first new attempt.
+            Defaults to 60.
+        lease (float, optional): Seconds a claim holds. Defaults to 600.
+    """
+
+    def __init__(self, path, max_attempts=10, backoff=60.0, lease=600.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # One connection shared by the threads of a process, the database
+        # arbitrates between processes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _write(self, statement, parameters=()):
+        with self._lock:
+            return self._db.execute(statement, parameters).rowcount
+
+    def enqueue(self, filename, claimed=False, now=None):
+        """
+        Adds a written bulletin, or queues it again if it was already known.
+
+        Args:
+            filename (str): The bulletin.
+            claimed (bool, optional): Whether the caller uploads it right away,
+                e.g. the upload pipeline. Defaults to False.
+        """
+        now = time.time() if now is None else now
+        filename = os.path.abspath(filename)
+        self._write(
+            "INSERT INTO bulletins (filename, state, enqueued, next_attempt, claimed)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (filename) DO UPDATE SET state = excluded.state,"
+            " attempts = 0, last_error = NULL, enqueued = excluded.enqueued,"
+            " next_attempt = excluded.next_attempt, claimed = excluded.claimed, acked = NULL",
+            (filename, CLAIMED if claimed else QUEUED, now, now, now if claimed else None),
+        )
+
+    def claim(self, limit=100, now=None):
+        """
+        Claims the due bulletins, oldest first.
+
+        Args:
+            limit (int, optional): Maximum number of bulletins claimed.
+
+        Returns:
+            list: The claimed filenames.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                filenames = [
+                    row[0]
+                    for row in self._db.execute(
+                        "SELECT filename FROM bulletins"
+                        " WHERE (state = ? AND next_attempt <= ?) OR (state = ? AND claimed < ?)"
+                        " ORDER BY next_attempt, enqueued LIMIT ?",
+                        (QUEUED, now, CLAIMED, now - self.lease, limit),
+                    )
+                ]
+                self._db.executemany(
+                    "UPDATE bulletins SET state = ?, claimed = ? WHERE filename = ?",
+                    [(CLAIMED, now, filename) for filename in filenames],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return filenames
+
+    def ack(self, filename, now=None):
+        """Records the successful upload of a claimed bulletin"""
+        now = time.time() if now is None else now
+        self._write(
+            "UPDATE bulletins SET state = ?, attempts = attempts + 1, last_error = NULL,"
+            " acked = ? WHERE filename = ?",
+            (SENT, now, os.path.abspath(filename)),
+        )
+
+    def fail(self, filename, error, now=None):
+        """
+        Records a failed upload and schedules the next attempt.
+
+        Returns:
+            bool: Whether the bulletin will be attempted again.
+        """
+        now = time.time() if now is None else now
+        filename = os.path.abspath(filename)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT attempts FROM bulletins WHERE filename = ?", (filename,)
+            ).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            retry = attempts < self.max_attempts
+            self._db.execute(
+                "UPDATE bulletins SET state = ?, attempts = ?, last_error = ?,"
+                " next_attempt = ?, claimed = NULL WHERE filename = ?",
+                (
+                    QUEUED if retry else FAILED,
+                    attempts,
+                    str(error),
+                    now + self.backoff * 2 ** (attempts - 1),
+                    filename,
+                ),
+            )
+        return retry
+
+    def get(self, filename):
+        """
+        Returns:
+            dict: The row of a bulletin, None if it was never enqueued.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT * FROM bulletins WHERE filename = ?", (os.path.abspath(filename),)
+            )
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def stats(self):
+        """
+        Returns:
+            dict: The number of bulletins in each state, and the mean and
+                maximum seconds from enqueue to acknowledgement of those sent.
+        """
+        with self._lock:
+            counts = dict(
+                self._db.execute("SELECT state, COUNT(*) FROM bulletins GROUP BY state")
+            )
+            mean, maximum = self._db.execute(
+                "SELECT AVG(acked - enqueued), MAX(acked - enqueued) FROM bulletins"
+                " WHERE state = ?",
+                (SENT,),
+            ).fetchone()
+        return {"states": counts, "mean_latency": mean, "max_latency": maximum}
+
+    def prune(self, older_than=30 * 86400, now=None):
+        """
+        Removes the bulletins sent more than `older_than` seconds ago, and the
+        failed ones enqueued that long ago, which are too old to send.
+
+        Returns:
+            int: The number of rows removed.
+        """
+        now = time.time() if now is None else now
+        return self._write(
+            "DELETE FROM bulletins WHERE (state = ? AND acked < ?) OR (state = ? AND enqueued < ?)",
+            (SENT, now - older_than, FAILED, now - older_than),
+        )
@@ -0,0 +1,89 @@
+import os
+import json
+import tempfile
+import datetime as dt
+import unittest
+
+from GTS_encode.backfill import Backfill, find_archive_files
+from sample import write_sample
+
+
+class Test_backfill(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.tmpdir.name, "archive")
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+        self.journal = os.path.join(self.out_dir, "backfill.journal")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _touch(self, subdir, filename):
+        os.makedirs(os.path.join(self.archive, subdir), exist_ok=True)
+        path = os.path.join(self.archive, subdir, filename)
+        open(path, "w").close()
+        return path
+
+    def test_find_archive_files(self):
+        late = self._touch("2023", "MOANA_0058_434_230301000000_qc.nc")
+        early = self._touch("2022", "MOANA_0058_12_221231235959_qc.nc")
+        other = self._touch("2023", "MOANA_0121_3_230215120000_qc.nc")
+        self._touch("2023", "MOANA_0058_435_230401000000_qc.nc")
+        self._touch("2023", "MOANA_0058_434_230301000000.nc")
+        self._touch("2023", "notes_qc.nc")
+        start, end = dt.datetime(2022, 12, 1), dt.datetime(2023, 4, 1)
+        self.assertEqual(find_archive_files(self.archive, start, end), [early, other, late])
+        self.assertEqual(
+            find_archive_files(self.archive, start, end, platforms=["0058"]), [early, late]
+        )
+        self.assertEqual(
+            find_archive_files(self.archive, start, end, platforms=["MOANA_0121"]), [other]
+        )
+
+    def test_resume_skips_journaled_files(self):
+        os.makedirs(self.archive)
+        done = write_sample(self.archive, "MOANA_0058_433_230227081912_qc.nc")
+        failed = write_sample(self.archive, "MOANA_0058_435_230301081912_qc.nc")
+        pending = write_sample(self.archive, "MOANA_0058_434_230228081912_qc.nc")
+        os.makedirs(self.out_dir)
+        with open(self.journal, "w") as f:
+            f.write(json.dumps({"filename": done, "status": "encoded"}) + "\n")
+            f.write(json.dumps({"filename": failed, "status": "failed"}) + "\n")
+            # Cut short by a kill
+            f.write('{"filename": "')
+        filelist = find_archive_files(self.archive)
+        self.assertEqual(filelist, [done, pending, failed])
+
+        summary = Backfill(filelist, self.out_dir, self.journal, workers=2).run()
+        self.assertEqual(summary["statuses"], {"encoded": 1})
+        self.assertGreater(summary["samples"], 0)
+        bulletins = [name for name in os.listdir(self.out_dir) if name.endswith(".bufr")]
+        self.assertEqual(len(bulletins), 1)
+        outcomes = Backfill(filelist, self.out_dir, self.journal).load_journal()
+        self.assertEqual(outcomes[pending]["status"], "encoded")
+        self.assertTrue(outcomes[pending]["gts_filename"].endswith(".bufr"))
+
+        # Finished files are not encoded again, failed ones only when asked
+        self.assertEqual(Backfill(filelist, self.out_dir, self.journal).pending(), [])
+        retry = Backfill(filelist, self.out_dir, self.journal, retry_failed=True)
+        self.assertEqual(retry.pending(), [failed])
+
+    def test_workers_recycled_past_memory_ceiling(self):
+        os.makedirs(self.archive)
+        filelist = [
+            write_sample(self.archive, "MOANA_0058_43{}_23022{}081912_qc.nc".format(i, i))
+            for i in range(3)
+        ]
+        # Any worker is past a ceiling of a millionth of a megabyte
+        summary = Backfill(
+            filelist, self.out_dir, self.journal, workers=1, max_rss=1e-6
+        ).run()
+        self.assertEqual(summary["statuses"], {"encoded": 3})
+        self.assertEqual(summary["workers_recycled"], 3)
+        self.assertGreater(summary["peak_rss_mb"], 0)
+        outcomes = Backfill(filelist, self.out_dir, self.journal).load_journal()
+        self.assertIn("live_handles", outcomes[filelist[0]]["gauges"])
+
+
+if __name__ == "__main__":
+    unittest.main()
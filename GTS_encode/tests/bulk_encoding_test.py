@@ -0,0 +1,64 @@
+import os
+import filecmp
+import tempfile
+import unittest
+
+from eccodes import codes_bufr_new_from_file, codes_get, codes_release, codes_set
+
+from GTS_encode.GTS_encode import GTS_encode_ship
+from sample import write_sample
+
+
+class Test_bulk_encoding(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _encode(self, subdir, **kwargs):
+        outdir = os.path.join(self.tmpdir.name, subdir)
+        os.mkdir(outdir)
+        return GTS_encode_ship(self.file, 69, outdir, **kwargs).run()
+
+    def test_ship_bulk_matches_loop_upcast(self):
+        loop = self._encode("loop", upcast=True, bulk=False)
+        bulk = self._encode("bulk", upcast=True, bulk=True)
+        self.assertTrue(filecmp.cmp(loop, bulk, shallow=False))
+
+    def test_ship_bulk_matches_loop_full_deployment(self):
+        loop = self._encode("loop", upcast=False, bulk=False)
+        bulk = self._encode("bulk", upcast=False, bulk=True)
+        self.assertTrue(filecmp.cmp(loop, bulk, shallow=False))
+
+    def test_ship_bulletin_bytes_match_file(self):
+        filename = self._encode("file")
+        outdir = os.path.join(self.tmpdir.name, "memory")
+        os.mkdir(outdir)
+        GTS = GTS_encode_ship(self.file, 69, outdir)
+        GTS.create_variables_from_netcdf()
+        data = GTS.encode_bulletin()
+        with open(filename, "rb") as f:
+            self.assertEqual(data, f.read())
+        self.assertEqual(os.path.basename(GTS.output_filename), os.path.basename(filename))
+        self.assertFalse(os.path.exists(GTS.output_filename))
+
+    def test_ship_casts(self):
+        outdir = os.path.join(self.tmpdir.name, "casts")
+        os.mkdir(outdir)
+        filenames = GTS_encode_ship(self.file, 69, outdir).run_casts()
+        self.assertEqual(len(filenames), 2)
+        directions = []
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                ibufr = codes_bufr_new_from_file(f)
+                codes_set(ibufr, "unpack", 1)
+                directions.append(codes_get(ibufr, "#1#directionOfProfile"))
+                codes_release(ibufr)
+        self.assertEqual(directions, [1, 0])
+        # The upcast is the profile encoded by default
+        with open(filenames[1], "rb") as f:
+            cast = f.read()
+        with open(self._encode("upcast"), "rb") as f:
+            self.assertEqual(cast[cast.index(b"BUFR"):], f.read()[cast.index(b"BUFR"):])
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from eccodes import (
+    codes_bufr_new_from_file,
+    codes_get,
+    codes_get_array,
+    codes_get_size,
+    codes_release,
+    codes_set,
+)
+
+from GTS_encode.GTS_encode import GTS_encode_ship
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from GTS_encode.bulletin import Bulletin
+from GTS_encode.reader import read_profile
+from sample import write_sample
+
+KEYS = ("depthBelowWaterSurface", "oceanographicWaterTemperature", "latitude")
+
+
+def decode(filename, key, subset=None):
+    with open(filename, "rb") as f:
+        ibufr = codes_bufr_new_from_file(f)
+    try:
+        codes_set(ibufr, "unpack", 1)
+        if subset is None:
+            return codes_get(ibufr, key)
+        if not codes_get(ibufr, "compressedData"):
+            return codes_get_array(ibufr, "/subsetNumber={}/{}".format(subset, key))
+        # Compressed ranks hold one value per subset, or one if all are equal
+        values = []
+        for rank in range(1, codes_get_size(ibufr, key) + 1):
+            rank_values = codes_get_array(ibufr, "#{}#{}".format(rank, key))
+            values.append(rank_values[subset - 1 if len(rank_values) > 1 else 0])
+        return np.array(values)
+    finally:
+        codes_release(ibufr)
+
+
+class Test_bulletin(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+        os.mkdir(self.out_dir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _profile(self, upcast):
+        GTS = GTS_encode_ship(self.file, 69, self.out_dir, upcast=upcast)
+        GTS.create_variables_from_netcdf()
+        return GTS
+
+    def _check_subsets(self, filename, upcasts):
+        self.assertEqual(decode(filename, "numberOfSubsets"), len(upcasts))
+        for subset, upcast in enumerate(upcasts, start=1):
+            single = self._profile(upcast).run()
+            for key in KEYS:
+                np.testing.assert_array_equal(
+                    decode(filename, key, subset), decode(single, key, 1)
+                )
+
+    def test_same_profiles_are_compressed(self):
+        bulletin = Bulletin(self.out_dir)
+        for _ in range(3):
+            bulletin.add(self._profile(True))
+        filename = bulletin.write()
+        self.assertEqual(decode(filename, "compressedData"), 1)
+        self._check_subsets(filename, [True, True, True])
+
+    def test_different_profiles_are_not_compressed(self):
+        bulletin = Bulletin(self.out_dir)
+        bulletin.add(self._profile(True))
+        bulletin.add(self._profile(False))
+        filename = bulletin.write()
+        self.assertEqual(decode(filename, "compressedData"), 0)
+        self._check_subsets(filename, [True, False])
+
+    def test_compression_needs_same_replication(self):
+        bulletin = Bulletin(self.out_dir, compressed=True)
+        bulletin.add(self._profile(True))
+        bulletin.add(self._profile(False))
+        with self.assertRaises(ValueError):
+            bulletin.write()
+
+    def test_wrapper_aggregate(self):
+        files = [
+            write_sample(self.tmpdir.name, "MOANA_{}_qc.nc".format(i)) for i in range(3)
+        ]
+        wrapper = Wrapper(
+            filelist=files, out_dir=self.out_dir, aggregate=True, max_subsets=2
+        )
+        saved = wrapper.run()
+        self.assertEqual(len(saved["filelist"]), 2)
+        subsets = [decode(filename, "numberOfSubsets") for filename in saved["filelist"]]
+        self.assertEqual(subsets, [2, 1])
+
+    def test_wrapper_aggregate_drops_partly_failed_file(self):
+        files = [
+            write_sample(self.tmpdir.name, "MOANA_{}_qc.nc".format(i)) for i in range(2)
+        ]
+        calls = []
+
+        def read_casts(ds, QC_flag, *args):
+            calls.append(ds)
+            profile = read_profile(ds, QC_flag)
+            # The second cast of the first file cannot be encoded
+            return [profile, {}] if len(calls) == 1 else [profile]
+
+        wrapper = Wrapper(filelist=files, out_dir=self.out_dir, aggregate=True, casts=True)
+        with mock.patch("GTS_encode.reader.read_casts", read_casts):
+            saved = wrapper.run()
+        (filename,) = saved["filelist"]
+        self.assertEqual(decode(filename, "numberOfSubsets"), 1)
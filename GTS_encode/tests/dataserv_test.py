@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import subprocess
+from unittest.mock import patch
+
+from GTS_encode.transfer import dataserv
+
+
+class Test_dataserv(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filelist = []
+        for i in range(3):
+            file = os.path.join(self.tmpdir.name, f"IOVE0{i + 1}_NZKL_280818.bufr")
+            open(file, "wb").close()
+            self.filelist.append(file)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _rsync(self, returncode, stderr="", sent=()):
+        calls = []
+        # Output of -ii, unchanged files are listed too
+        stdout = "".join(
+            "<f+++++++++ {}\n".format(os.path.basename(self.filelist[i])) for i in sent
+        )
+
+        def run(args, **kwargs):
+            with open(args[3].split("=", 1)[1]) as f:
+                calls.append(f.read().split())
+            return subprocess.CompletedProcess(args, returncode, stdout, stderr)
+
+        return calls, patch("GTS_encode.transfer.subprocess.run", side_effect=run)
+
+    def test_single_rsync_for_filelist(self):
+        calls, rsync = self._rsync(0)
+        with rsync:
+            sent = dataserv(filelist=self.filelist, batch=True).run()
+        self.assertEqual(calls, [self.filelist])
+        self.assertEqual(sent, self.filelist)
+
+    def test_partial_failure_reports_files(self):
+        missing = os.path.join(self.tmpdir.name, "missing.bufr")
+        stderr = f'rsync: [sender] send_files failed to open "{self.filelist[1]}": Permission denied (13)\n'
+        calls, rsync = self._rsync(23, stderr, sent=(0, 2))
+        transfer = dataserv(filelist=self.filelist + [missing], batch=True)
+        with rsync, self.assertRaises(Exception):
+            transfer.run()
+        self.assertEqual(transfer.transferred, [self.filelist[0], self.filelist[2]])
+        self.assertEqual(sorted(transfer.failed), sorted([self.filelist[1], missing]))
+
+    def test_receiver_failure_reports_files(self):
+        stderr = (
+            'rsync: [receiver] mkstemp "/hub/data/obs/GTS/.IOVE02_NZKL_280818.bufr.AbC123"'
+            " failed: Permission denied (13)\n"
+        )
+        # The third file is neither itemized nor named in an error
+        calls, rsync = self._rsync(23, stderr, sent=(0, 1))
+        transfer = dataserv(filelist=self.filelist, batch=True)
+        with rsync, self.assertRaises(Exception):
+            transfer.run()
+        self.assertEqual(transfer.transferred, [self.filelist[0]])
+        self.assertIn("mkstemp", transfer.failed[self.filelist[1]])
+        self.assertEqual(transfer.failed[self.filelist[2]], "Not confirmed by rsync")
+
+    def test_connection_failure_fails_all(self):
+        calls, rsync = self._rsync(255, "ssh: connect to host dataserv2.hm port 22")
+        transfer = dataserv(filelist=self.filelist, batch=True)
+        with rsync, self.assertRaises(Exception):
+            transfer.run()
+        self.assertEqual(transfer.transferred, [])
+        self.assertEqual(sorted(transfer.failed), self.filelist)
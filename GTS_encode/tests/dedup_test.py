@@ -0,0 +1,130 @@
+import os
+import time
+import tempfile
+import unittest
+
+from GTS_encode.GTS_encode import GTS_encode_ship
+from GTS_encode.bulletin import Bulletin
+from GTS_encode.dedup import DedupStore, message_hash
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from sample import write_sample
+
+MESSAGE = b"BUFR\x00\x00\x10\x047777"
+
+
+class Test_dedup_store(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = DedupStore(self.tmpdir.name, retention=60)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_hash_skips_heading(self):
+        bulletin = b"001\nIOVE01 NZKL 280818\n" + MESSAGE
+        self.assertEqual(message_hash(bulletin), message_hash(MESSAGE))
+
+    def test_duplicate_skipped_until_expired(self):
+        key = self.store.claim(MESSAGE)
+        self.assertIsNotNone(key)
+        self.store.record(key, "/out/IOVE01_NZKL_280818.bufr")
+        self.assertIsNone(self.store.claim(MESSAGE))
+        self.assertEqual(self.store.lookup(MESSAGE), "IOVE01_NZKL_280818.bufr")
+        self.assertIsNotNone(DedupStore(self.tmpdir.name, resend=True).claim(MESSAGE))
+
+        path = os.path.join(self.tmpdir.name, key + ".sha256")
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        self.assertIsNone(self.store.lookup(MESSAGE))
+        self.assertEqual(self.store.prune(), 1)
+        self.assertIsNotNone(self.store.claim(MESSAGE))
+
+    def test_released_claim_is_not_a_duplicate(self):
+        self.store.release(self.store.claim(MESSAGE))
+        self.assertIsNotNone(self.store.claim(MESSAGE))
+
+    def test_stale_claim_is_not_a_duplicate(self):
+        key = self.store.claim(MESSAGE)
+        self.assertIsNone(self.store.claim(MESSAGE))
+        self.assertIsNone(self.store.lookup(MESSAGE))
+        # The process holding the claim died before writing the bulletin
+        path = os.path.join(self.tmpdir.name, key + ".sha256")
+        with open(path, "w") as f:
+            f.write("claimed 1 {}".format(time.time() - self.store.claim_lease - 1))
+        self.assertEqual(self.store.claim(MESSAGE), key)
+
+
+class Test_encode_dedup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+        os.mkdir(self.out_dir)
+        self.store = DedupStore(os.path.join(self.tmpdir.name, "dedup"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _profile(self):
+        GTS = GTS_encode_ship(self.file, 69, self.out_dir, dedup=self.store)
+        GTS.create_variables_from_netcdf()
+        return GTS
+
+    def test_encode_bulletin_skips_duplicate(self):
+        first = self._profile()
+        data = first.encode_bulletin()
+        self.assertIsNotNone(data)
+        self.assertEqual(self.store.lookup(data), os.path.basename(first.output_filename))
+        second = self._profile()
+        self.assertIsNone(second.encode_bulletin())
+        self.assertIsNone(second.output_filename)
+        # The duplicate took no number, the next message gets the second one
+        self.assertTrue(first.identifier.startswith("IOVE01"))
+        first.depths = first.depths + 1
+        first.encode_bulletin()
+        self.assertTrue(first.identifier.startswith("IOVE02"))
+
+    def test_bulletin_encode_skips_duplicate(self):
+        encoded = []
+        for _ in range(2):
+            bulletin = Bulletin(self.out_dir, dedup=self.store)
+            bulletin.add(self._profile())
+            encoded.append(bulletin.encode())
+        self.assertIsNotNone(encoded[0])
+        self.assertIsNone(encoded[1])
+
+
+class Test_wrapper_dedup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+        self.dedup_path = os.path.join(self.tmpdir.name, "dedup")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _run(self, **kwargs):
+        wrapper = Wrapper(
+            out_dir=self.out_dir, dedup_path=self.dedup_path, metrics=True, **kwargs
+        )
+        saved = wrapper.encode_batch([self.file])
+        return saved["filelist"], wrapper.metrics.files[0]["status"]
+
+    def test_rerun_writes_no_duplicate(self):
+        first, status = self._run()
+        self.assertEqual(status, "encoded")
+        self.assertEqual(len(first), 1)
+        # The QC rerun rewrites the file with the same values
+        write_sample(self.tmpdir.name)
+        self.assertEqual(self._run(), ([], "duplicate"))
+        self.assertEqual(self._run(workers=2), ([], "duplicate"))
+        resent, status = self._run(resend_duplicates=True)
+        self.assertEqual(status, "encoded")
+        self.assertNotEqual(resent, first)
+        bulletins = [name for name in os.listdir(self.out_dir) if name.endswith(".bufr")]
+        self.assertEqual(len(bulletins), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
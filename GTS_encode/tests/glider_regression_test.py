@@ -0,0 +1,91 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from eccodes import (
+    codes_bufr_new_from_file,
+    codes_get_array,
+    codes_release,
+    codes_set,
+)
+
+from GTS_encode.GTS_encode import GTS_encode_glider
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+DATA = os.path.join(DATA_DIR, "MOANA_0058_434_230228081912_qc.nc")
+REFERENCE = os.path.join(DATA_DIR, "315012_MOANA_0058_434_230228081912_qc.csv")
+
+# Descriptor of each per-point element in the reference decode
+POINT_DESCRIPTORS = {
+    "004001": "year",
+    "004002": "month",
+    "004003": "day",
+    "004004": "hour",
+    "004005": "minute",
+    "005001": "latitude",
+    "006001": "longitude",
+    "007062": "depthBelowWaterSurface",
+    "022065": "oceanographicWaterPressure",
+    "022045": "oceanographicWaterTemperature",
+}
+
+SURFACE_KEYS = ("year", "month", "day", "hour", "minute", "latitude", "longitude")
+
+
+def read_reference_points(filename):
+    """Reads the per-point values after the extended replication factor"""
+    points = {key: [] for key in POINT_DESCRIPTORS.values()}
+    in_profile = False
+    with open(filename) as f:
+        for line in f:
+            match = re.match(r"\d+ (\d{6}) .*?\s{2,}(\S+)$", line.rstrip())
+            if not match:
+                continue
+            descriptor, value = match.groups()
+            if descriptor == "031002":
+                in_profile = True
+            elif in_profile and descriptor in POINT_DESCRIPTORS:
+                points[POINT_DESCRIPTORS[descriptor]].append(float(value))
+    return {key: np.array(values) for key, values in points.items()}
+
+
+def decode_points(filename):
+    with open(filename, "rb") as f:
+        ibufr = codes_bufr_new_from_file(f)
+    codes_set(ibufr, "unpack", 1)
+    points = {}
+    for key in POINT_DESCRIPTORS.values():
+        values = codes_get_array(ibufr, key)
+        # Surface and ocean current sections come first for date and position
+        points[key] = values[2:] if key in SURFACE_KEYS else values
+    codes_release(ibufr)
+    return points
+
+
+class Test_glider_regression(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmpdir.name, os.path.basename(DATA))
+        shutil.copy(DATA, self.file)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_glider_bulk_matches_reference_decode(self):
+        output = GTS_encode_glider(self.file, 69, self.tmpdir.name, upcast=True, bulk=True).run()
+        decoded = decode_points(output)
+        reference = read_reference_points(REFERENCE)
+        for key, expected in reference.items():
+            self.assertEqual(len(decoded[key]), len(expected), key)
+            np.testing.assert_allclose(decoded[key], expected, atol=1e-3, err_msg=key)
+
+    def test_glider_bulk_matches_loop(self):
+        loop = os.path.join(self.tmpdir.name, "loop.bufr")
+        shutil.move(GTS_encode_glider(self.file, 69, self.tmpdir.name, bulk=False).run(), loop)
+        bulk = GTS_encode_glider(self.file, 69, self.tmpdir.name, bulk=True).run()
+        # Only the bulletin number of the heading differs
+        with open(loop, "rb") as f, open(bulk, "rb") as g:
+            self.assertEqual(f.read().replace(b"IOVE01", b"IOVE02"), g.read())
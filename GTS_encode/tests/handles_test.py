@@ -0,0 +1,47 @@
+import unittest
+
+from eccodes import codes_get, codes_get_array, codes_release, codes_set
+
+from GTS_encode.handles import HeaderCache
+
+HEADER = [
+    ("edition", 4),
+    ("masterTableNumber", 0),
+    ("bufrHeaderCentre", 69),
+    ("dataCategory", 31),
+    ("masterTablesVersionNumber", 28),
+    ("numberOfSubsets", 1),
+    ("observedData", 1),
+    ("compressedData", 0),
+]
+DESCRIPTORS = [1125, 1126, 1127, 1128, 315007]
+
+
+class Test_header_cache(unittest.TestCase):
+    def setUp(self):
+        self.cache = HeaderCache(maxsize=2)
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def _new(self, n_levels):
+        return self.cache.new_message("BUFR4_local", HEADER, [n_levels, 1, 1], DESCRIPTORS)
+
+    def test_layout_built_once(self):
+        first = self._new(10)
+        codes_set(first, "#1#waterPressure", 123.0)
+        second = self._new(10)
+        self.assertEqual(len(self.cache), 1)
+        # Clones do not share the values set in another message
+        self.assertNotEqual(codes_get(second, "#1#waterPressure"), 123.0)
+        self.assertEqual(codes_get(second, "bufrHeaderCentre"), 69)
+        self.assertEqual(len(codes_get_array(second, "waterPressure")), 12)
+        codes_release(first)
+        codes_release(second)
+
+    def test_least_recently_used_is_released(self):
+        for n_levels in (10, 20, 10, 30):
+            codes_release(self._new(n_levels))
+        self.assertEqual(len(self.cache), 2)
+        keys = [key[2][0] for key in self.cache._templates]
+        self.assertEqual(keys, [10, 30])
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import xarray as xr
+
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from GTS_encode.index import EligibilityIndex
+from sample import write_sample
+
+
+class Test_index(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+        self.index_path = os.path.join(self.tmpdir.name, "index.json")
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lookup_after_record(self):
+        index = EligibilityIndex(self.index_path)
+        index.record(self.file, True, {"wigos_id": "0-22000-0-MSN58"}, "out.bufr")
+        index.save()
+        entry = EligibilityIndex(self.index_path).lookup(self.file)
+        self.assertTrue(entry["available"])
+        self.assertEqual(entry["gts_filename"], "out.bufr")
+
+    def test_changed_file_is_not_found(self):
+        index = EligibilityIndex(self.index_path)
+        index.record(self.file, False)
+        stat = os.stat(self.file)
+        os.utime(self.file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertIsNone(index.lookup(self.file))
+
+    def test_deleted_file_dropped_on_save(self):
+        index = EligibilityIndex(self.index_path)
+        index.record(self.file, True)
+        kept = write_sample(self.tmpdir.name, "kept_qc.nc")
+        index.record(kept, True)
+        os.remove(self.file)
+        index.save()
+        self.assertEqual(list(EligibilityIndex(self.index_path).entries), [kept])
+
+    def test_invalidate_by_attribute(self):
+        index = EligibilityIndex(self.index_path)
+        index.record(self.file, False, {"wigos_id": "0-22000-0-MSN58"})
+        self.assertEqual(index.invalidate(wigos_id="0-22000-0-OTHER"), 0)
+        self.assertEqual(index.invalidate(wigos_id="0-22000-0-MSN58"), 1)
+        self.assertIsNone(index.lookup(self.file))
+        with self.assertRaises(ValueError):
+            index.invalidate(platform_code="msn58du5107")
+
+    def test_wrapper_skips_decided_files(self):
+        Wrapper(
+            filelist=[self.file], out_dir=self.out_dir, index_path=self.index_path
+        ).run()
+        wrapper = Wrapper(
+            filelist=[self.file], out_dir=self.out_dir, index_path=self.index_path
+        )
+        with patch("xarray.open_dataset", wraps=xr.open_dataset) as open_dataset:
+            saved = wrapper.run()
+        open_dataset.assert_not_called()
+        self.assertEqual(saved["filelist"], [])
+        self.assertEqual(wrapper.invalidate_index(publication_date="01/01/2023"), 1)
+        self.assertEqual(len(wrapper.run()["filelist"]), 1)
@@ -0,0 +1,67 @@
+import os
+import json
+import tempfile
+import unittest
+
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from sample import write_sample
+
+
+class Test_metrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+        self.late = write_sample(
+            self.tmpdir.name, "late_qc.nc", publication_date="01/01/2024"
+        )
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+        self.metrics_path = os.path.join(self.tmpdir.name, "metrics.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _run(self, **kwargs):
+        wrapper = Wrapper(
+            filelist=[self.file, self.late],
+            out_dir=self.out_dir,
+            metrics=True,
+            metrics_path=self.metrics_path,
+            **kwargs,
+        )
+        saved = wrapper.run()
+        with open(self.metrics_path) as f:
+            return saved, json.load(f)
+
+    def _check(self, saved, metrics):
+        summary = metrics["summary"]
+        self.assertEqual(summary["files"], 2)
+        self.assertEqual(summary["counters"]["files_encoded"], 1)
+        self.assertEqual(summary["counters"]["files_unavailable"], 1)
+        self.assertGreater(summary["counters"]["samples"], 0)
+        self.assertEqual(
+            summary["counters"]["bytes_written"], os.path.getsize(saved["filelist"][0])
+        )
+        for stage in ("open", "check", "read", "message", "write"):
+            self.assertIn(stage, summary["stages"])
+        records = {record["filename"]: record for record in metrics["files"]}
+        self.assertEqual(records[self.file]["gts_filename"], saved["filelist"][0])
+        self.assertIn("write", records[self.file]["stages"])
+        self.assertEqual(records[self.late]["status"], "unavailable")
+
+    def test_serial_metrics(self):
+        os.mkdir(self.out_dir)
+        # Left over from before the sequence counter, the name is taken once
+        open(os.path.join(self.out_dir, "IOVE01_NZKL_280818.bufr"), "w").close()
+        saved, metrics = self._run()
+        self._check(saved, metrics)
+        self.assertEqual(metrics["summary"]["counters"]["collision_retries"], 1)
+
+    def test_parallel_metrics(self):
+        saved, metrics = self._run(workers=2)
+        self._check(saved, metrics)
+
+    def test_disabled_by_default(self):
+        wrapper = Wrapper(filelist=[self.file], out_dir=self.out_dir)
+        wrapper.run()
+        self.assertFalse(wrapper.metrics.enabled)
+        self.assertFalse(os.path.exists(self.metrics_path))
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from sample import write_sample
+
+
+class Test_parallel(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # Same observation times, so every bulletin shares its identifier
+        self.filelist = [
+            write_sample(self.tmpdir.name, f"MOANA_0058_43{i}_230228081912_qc.nc")
+            for i in range(4)
+        ]
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_parallel_names_are_unique(self):
+        saved = Wrapper(filelist=self.filelist, out_dir=self.out_dir, workers=2).run()
+        self.assertEqual(len(saved["filelist"]), 4)
+        self.assertEqual(len(set(saved["filelist"])), 4)
+        bufr_files = [f for f in os.listdir(self.out_dir) if f.endswith(".bufr")]
+        self.assertEqual(len(bufr_files), 4)
+
+    def test_parallel_failure_skips_file(self):
+        broken = write_sample(
+            self.tmpdir.name, "MOANA_0058_439_230228081912_qc.nc", wigos_id="broken"
+        )
+        filelist = [self.filelist[0], broken, self.filelist[1]]
+        saved = Wrapper(filelist=filelist, out_dir=self.out_dir, workers=2).run()
+        serial = Wrapper(
+            filelist=filelist, out_dir=os.path.join(self.tmpdir.name, "serial")
+        ).run()
+        self.assertEqual(
+            [os.path.basename(f) for f in saved["filelist"]],
+            [os.path.basename(f) for f in serial["filelist"]],
+        )
+        self.assertEqual(len(saved["filelist"]), 2)
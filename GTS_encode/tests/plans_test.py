@@ -0,0 +1,79 @@
+import tempfile
+import unittest
+
+from eccodes import codes_get_message, codes_release, codes_set
+
+from GTS_encode.GTS_encode import GTS_encode_ship, GTS_encode_subfloat
+from GTS_encode.handles import HeaderCache
+from GTS_encode.plans import PlanCache
+from sample import write_sample
+
+SUBFLOAT_METADATA = {
+    "centre code": 69,
+    "internal ship id": 5501234,
+    "sensor model": "Moana TD",
+    "sensor serial": "58",
+}
+
+
+def packed(GTS):
+    ibufr = GTS.create_bufr_message()
+    try:
+        codes_set(ibufr, "pack", 1)
+        return codes_get_message(ibufr)
+    finally:
+        codes_release(ibufr)
+
+
+class Test_plans(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+        self.header_cache = HeaderCache()
+        self.plan_cache = PlanCache(maxsize=2)
+
+    def tearDown(self):
+        self.plan_cache.clear()
+        self.header_cache.clear()
+        self.tmpdir.cleanup()
+
+    def _ship(self, **kwargs):
+        GTS = GTS_encode_ship(self.file, 69, self.tmpdir.name, **kwargs)
+        GTS.header_cache = self.header_cache
+        GTS.plan_cache = self.plan_cache
+        GTS.create_variables_from_netcdf()
+        return GTS
+
+    def test_subfloat_plan_matches_reference(self):
+        messages = []
+        for bulk in (False, True):
+            GTS = GTS_encode_subfloat(self.file, SUBFLOAT_METADATA, bulk=bulk)
+            GTS.plan_cache = self.plan_cache
+            GTS.create_variables_from_netcdf()
+            messages.append(packed(GTS))
+        self.assertEqual(messages[0], messages[1])
+
+    def test_plan_compiled_once_per_levels(self):
+        GTS = self._ship()
+        first, second = packed(GTS), packed(GTS)
+        # The message the plan was compiled on and the clones are the same
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.plan_cache), 1)
+        full = self._ship(upcast=False)
+        self.assertNotEqual(len(full.depths), len(GTS.depths))
+        self.assertEqual(packed(full), packed(self._ship(upcast=False, bulk=False)))
+        self.assertEqual(len(self.plan_cache), 2)
+        plan = self.plan_cache.get("315007", len(GTS.depths), self.header_cache, centre_code=69)
+        self.assertIs(
+            plan, self.plan_cache.get("315007", len(GTS.depths), self.header_cache, centre_code=69)
+        )
+        self.assertIsNot(
+            plan, self.plan_cache.get("315007", len(GTS.depths), self.header_cache, centre_code=68)
+        )
+        # The least recently used plan is released
+        centres = [dict(key[2])["centre_code"] for key in self.plan_cache._plans]
+        self.assertEqual(centres, [69, 68])
+
+
+if __name__ == "__main__":
+    unittest.main()
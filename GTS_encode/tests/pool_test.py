@@ -0,0 +1,104 @@
+import os
+import signal
+import tempfile
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+
+from GTS_encode.GTS_encode import GTS_encode_ship
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from GTS_encode.handles import HANDLES
+from GTS_encode.pool import RecyclingPool
+from sample import write_sample
+
+
+def _pid(value):
+    return value, os.getpid()
+
+
+def _crash(value):
+    os.kill(os.getpid(), signal.SIGSEGV)
+
+
+def _failing_initializer():
+    raise ValueError("bad wrapper kwargs")
+
+
+def _dying_initializer():
+    os._exit(3)
+
+
+class Test_recycling_pool(unittest.TestCase):
+    def test_workers_recycled_past_ceiling(self):
+        # Every worker is above one byte once it ran a task
+        with RecyclingPool(2, max_rss=1) as pool:
+            futures = [pool.submit(_pid, value) for value in range(6)]
+            results = [future.result(timeout=60) for future in futures]
+        self.assertEqual([value for value, _ in results], list(range(6)))
+        self.assertEqual(len({pid for _, pid in results}), 6)
+        self.assertEqual(pool.recycled, 6)
+
+    def test_workers_kept_below_ceiling(self):
+        with RecyclingPool(1, max_rss=2**40) as pool:
+            results = [pool.submit(_pid, value).result(timeout=60) for value in range(3)]
+        self.assertEqual(len({pid for _, pid in results}), 1)
+        self.assertEqual(pool.recycled, 0)
+
+    def test_crashed_worker_fails_its_task_only(self):
+        with RecyclingPool(1) as pool:
+            crashed = pool.submit(_crash, 0)
+            after = pool.submit(_pid, 1)
+            with self.assertRaises(RuntimeError):
+                crashed.result(timeout=60)
+            self.assertEqual(after.result(timeout=60)[0], 1)
+        self.assertEqual(pool.crashed, 1)
+
+    def test_failing_initializer_breaks_pool(self):
+        for initializer in (_failing_initializer, _dying_initializer):
+            with RecyclingPool(2, initializer=initializer) as pool:
+                # Raised by the future, or by submit once the pool is broken
+                with self.assertRaises(BrokenProcessPool):
+                    pool.submit(_pid, 0).result(timeout=60)
+                with self.assertRaises(BrokenProcessPool):
+                    pool.submit(_pid, 1)
+
+
+class Test_bounded_memory(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_handle_and_dataset_released_on_error(self):
+        # The output directory is a file, so the write fails
+        GTS = GTS_encode_ship(self.file, 69, self.file)
+        with self.assertRaises(OSError):
+            with GTS:
+                GTS.run()
+        self.assertIsNone(GTS.ds)
+        # Apart from the header and plan the caches keep, nothing is left
+        live = HANDLES.live
+        for _ in range(3):
+            with self.assertRaises(OSError):
+                with GTS_encode_ship(self.file, 69, self.file) as GTS:
+                    GTS.run()
+        self.assertEqual(HANDLES.live, live)
+
+    def test_memory_recorded_per_file(self):
+        wrapper = Wrapper(
+            out_dir=os.path.join(self.tmpdir.name, "GTS"), metrics=True, max_rss=2**20
+        )
+        saved = wrapper.encode_batch([self.file])
+        self.assertEqual(len(saved["filelist"]), 1)
+        (record,) = wrapper.metrics.files
+        self.assertEqual(record["status"], "encoded")
+        self.assertGreater(record["gauges"]["rss_mb"], 0)
+        self.assertGreater(record["gauges"]["live_handles"], 0)
+        summary = wrapper.metrics.summary()
+        self.assertEqual(summary["gauges"], record["gauges"])
+        self.assertEqual(summary["counters"]["workers_recycled"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from GTS_encode.reader import (
+    DIRECTION_DOWN,
+    DIRECTION_UP,
+    read_casts,
+    read_profile,
+    thin_profile,
+    time_components,
+)
+from GTS_encode.utils import (
+    extract_upcast,
+    pres,
+    segment_casts,
+    significant_levels,
+    upcast_start,
+)
+from sample import DATA
+
+
+class Test_reader(unittest.TestCase):
+    def test_time_components_match_pandas(self):
+        times = pd.date_range("2023-12-31T23:58:30", periods=300, freq="7s")
+        components = time_components(times.values)
+        for name, attr in [
+            ("years", "year"),
+            ("months", "month"),
+            ("days", "day"),
+            ("hours", "hour"),
+            ("minutes", "minute"),
+            ("seconds", "second"),
+        ]:
+            np.testing.assert_array_equal(components[name], getattr(times, attr))
+
+    def test_read_profile_matches_dataframe(self):
+        ds = xr.open_dataset(DATA)
+        for upcast in (True, False):
+            for QC_flag in (1, [1, 3]):
+                df = ds.to_dataframe()
+                df = df[df["QC_FLAG"].isin(np.atleast_1d(QC_flag))]
+                if upcast:
+                    df = extract_upcast(df)
+                profile = read_profile(ds, QC_flag, upcast)
+                np.testing.assert_array_equal(profile["depths"], df["DEPTH"].values)
+                np.testing.assert_array_equal(profile["minutes"], df.index.minute)
+                np.testing.assert_array_equal(
+                    profile["pressures"],
+                    np.round(pres(df["DEPTH"], df["LATITUDE"]), 2),
+                )
+                np.testing.assert_array_equal(
+                    profile["temperatures"], df["TEMPERATURE"].values + 273.15
+                )
+        ds.close()
+
+    def test_segment_casts_yoyo(self):
+        # Three down and up casts with a small wobble at the turns
+        t = np.linspace(0, 3, 601)
+        depths = 50 * (1 - np.cos(2 * np.pi * t)) + 0.2 * np.sin(40 * np.pi * t)
+        casts = segment_casts(depths)
+        self.assertEqual([direction for _, _, direction in casts], [1, -1] * 3)
+        self.assertEqual(casts[0][0], 0)
+        self.assertEqual(casts[-1][1], len(depths))
+        for (_, stop, _), (start, _, _) in zip(casts, casts[1:]):
+            self.assertEqual(stop, start)
+
+    def test_segment_casts_ignores_small_movements(self):
+        self.assertEqual(segment_casts(np.array([1.0, 1.2, 1.1, 1.3])), [])
+        self.assertEqual(segment_casts(np.array([1.0, 1.2, 1.1, 5.0])), [(0, 4, 1)])
+
+    def test_read_casts_matches_upcast(self):
+        ds = xr.open_dataset(DATA)
+        down, up = read_casts(ds)
+        self.assertEqual(down["direction"], DIRECTION_DOWN)
+        self.assertEqual(up["direction"], DIRECTION_UP)
+        profile = read_profile(ds, upcast=True)
+        for name in ("depths", "pressures", "temperatures", "seconds"):
+            np.testing.assert_array_equal(up[name], profile[name])
+        self.assertEqual(len(down["depths"]), upcast_start(read_profile(ds, upcast=False)["depths"]))
+        ds.close()
+
+    def test_thin_profile(self):
+        ds = xr.open_dataset(DATA)
+        profile = read_profile(ds)
+        for thinning, levels in ((("bins", 5.0), 8), (("max", 10), 10)):
+            thinned = read_profile(ds, thinning=thinning)
+            self.assertEqual(len(thinned["depths"]), levels)
+            for name in ("depths", "pressures", "temperatures", "minutes"):
+                self.assertEqual(thinned[name][0], profile[name][0])
+                self.assertEqual(thinned[name][-1], profile[name][-1])
+            self.assertEqual(thinned["direction"], profile["direction"])
+        self.assertEqual(len(thin_profile(profile, "max", 1000)["depths"]), len(profile["depths"]))
+        with self.assertRaises(ValueError):
+            thin_profile(profile, "nearest", 1)
+        ds.close()
+
+    def test_significant_levels_within_tolerance(self):
+        rng = np.random.default_rng(0)
+        depths = np.linspace(0, 100, 5000)
+        temperatures = np.sin(depths / 5) + 0.01 * rng.standard_normal(len(depths))
+        kept = significant_levels(depths, temperatures, 0.05)
+        self.assertLess(len(kept), 500)
+        self.assertEqual((kept[0], kept[-1]), (0, len(depths) - 1))
+        rebuilt = np.interp(depths, depths[kept], temperatures[kept])
+        self.assertLessEqual(np.max(np.abs(rebuilt - temperatures)), 0.05)
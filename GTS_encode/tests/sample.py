@@ -0,0 +1,24 @@
+"""Sample Mangopare file with the attributes required for publication"""
+
+import os
+import xarray as xr
+
+DATA = os.path.join(
+    os.path.dirname(__file__), "..", "..", "data", "MOANA_0058_434_230228081912_qc.nc"
+)
+
+PUBLICATION_ATTRS = {
+    "wigos_id": "0-22000-0-MSN58",
+    "internal_id": "SHIP123",
+    "public": "True",
+    "publication_date": "01/01/2023",
+}
+
+
+def write_sample(outdir, filename=None, **attrs):
+    """Writes the sample file with publication attributes into `outdir`"""
+    ds = xr.open_dataset(DATA).load()
+    ds.attrs.update(PUBLICATION_ATTRS, **attrs)
+    filename = os.path.join(outdir, filename or os.path.basename(DATA))
+    ds.to_netcdf(filename)
+    return filename
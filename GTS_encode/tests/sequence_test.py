@@ -0,0 +1,71 @@
+import os
+import time
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from GTS_encode.GTS_encode import GTS_encode_ship
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from GTS_encode.sequence import SequenceAllocator
+from GTS_encode.utils import set_identifier_number
+from sample import write_sample
+
+
+def allocate_many(state_dir, n):
+    allocator = SequenceAllocator(state_dir)
+    return [allocator.next_number("NZKL 280818") for _ in range(n)]
+
+
+class Test_sequence(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state_dir = os.path.join(self.tmpdir.name, ".sequence")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_numbers_persist_between_allocators(self):
+        self.assertEqual(allocate_many(self.state_dir, 3), [1, 2, 3])
+        self.assertEqual(allocate_many(self.state_dir, 1), [4])
+        self.assertEqual(SequenceAllocator(self.state_dir).next_number("NZKL 280819"), 1)
+
+    def test_numbers_unique_across_processes(self):
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            results = executor.map(allocate_many, [self.state_dir] * 4, [25] * 4)
+            numbers = [number for result in results for number in result]
+        self.assertEqual(sorted(numbers), list(range(1, 101)))
+
+    def test_unused_counter_restarts(self):
+        allocator = SequenceAllocator(self.state_dir, reset_after=60)
+        allocator.next_number("NZKL 280818")
+        path = allocator._counter_path("NZKL 280818")
+        os.utime(path, (time.time() - 120, time.time() - 120))
+        self.assertEqual(allocator.prune(), 1)
+        self.assertEqual(allocator.next_number("NZKL 280818"), 1)
+
+    def test_wrapper_prunes_counters(self):
+        allocator = SequenceAllocator(self.state_dir)
+        allocator.next_number("NZKL 280818")
+        allocator.next_number("NZKL 280819")
+        path = allocator._counter_path("NZKL 280818")
+        old = time.time() - 2 * 86400
+        os.utime(path, (old, old))
+        Wrapper(out_dir=self.tmpdir.name).encode_batch([])
+        self.assertEqual(os.listdir(self.state_dir), ["NZKL_280819.seq"])
+
+    def test_set_identifier_number(self):
+        self.assertEqual(
+            set_identifier_number("IOVE01 NZKL 280818", 12), "IOVE12 NZKL 280818"
+        )
+
+    def test_ship_heading_matches_filename(self):
+        file = write_sample(self.tmpdir.name)
+        outputs = [
+            GTS_encode_ship(file, 69, self.tmpdir.name).run() for _ in range(2)
+        ]
+        self.assertEqual(
+            [os.path.basename(f) for f in outputs],
+            ["IOVE01_NZKL_280818.bufr", "IOVE02_NZKL_280818.bufr"],
+        )
+        with open(outputs[1], "rb") as f:
+            self.assertEqual(f.read(23), b"001\nIOVE02 NZKL 280818\n")
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from GTS_encode.spool import TransferSpool
+
+
+class Test_transfer_spool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "spool.sqlite")
+        self.spool = TransferSpool(self.path, max_attempts=3, backoff=10, lease=100)
+        self.files = [os.path.join(self.tmpdir.name, f"IOVE0{i}.bufr") for i in range(1, 4)]
+        for i, filename in enumerate(self.files):
+            self.spool.enqueue(filename, now=1000 + i)
+
+    def tearDown(self):
+        self.spool.close()
+        self.tmpdir.cleanup()
+
+    def test_claim_oldest_first_once(self):
+        self.assertEqual(self.spool.claim(2, now=1010), self.files[:2])
+        self.assertEqual(self.spool.claim(2, now=1010), self.files[2:])
+        self.assertEqual(self.spool.claim(now=1010), [])
+        self.spool.ack(self.files[0], now=1015)
+        row = self.spool.get(self.files[0])
+        self.assertEqual((row["state"], row["attempts"], row["acked"]), ("sent", 1, 1015))
+        stats = self.spool.stats()
+        self.assertEqual(stats["states"], {"sent": 1, "claimed": 2})
+        self.assertEqual(stats["mean_latency"], 15)
+
+    def test_failure_scheduled_with_backoff(self):
+        filename = self.files[0]
+        self.spool.claim(1, now=1010)
+        self.assertTrue(self.spool.fail(filename, "500 Internal Server Error", now=1010))
+        # The healthy bulletins are not held back by the failed one
+        self.assertEqual(self.spool.claim(now=1019), self.files[1:])
+        for healthy in self.files[1:]:
+            self.spool.ack(healthy, now=1019)
+        self.assertEqual(self.spool.claim(now=1020), [filename])
+        self.assertTrue(self.spool.fail(filename, "timed out", now=1020))
+        self.assertEqual(self.spool.claim(now=1039), [])
+        self.assertEqual(self.spool.claim(now=1040), [filename])
+        self.assertFalse(self.spool.fail(filename, "timed out", now=1040))
+        row = self.spool.get(filename)
+        self.assertEqual((row["state"], row["attempts"], row["last_error"]), ("failed", 3, "timed out"))
+        self.assertEqual(self.spool.claim(now=10**6), [])
+        # Enqueued again when the bulletin is written again
+        self.spool.enqueue(filename, now=2000)
+        self.assertEqual(self.spool.get(filename)["attempts"], 0)
+
+    def test_survives_restart_and_stale_claims(self):
+        self.spool.claim(now=1010)
+        self.spool.close()
+        # An uploader that died leaves its claims to expire
+        self.spool = TransferSpool(self.path, lease=100)
+        self.assertEqual(self.spool.claim(now=1100), [])
+        self.assertEqual(self.spool.claim(now=1111), self.files)
+
+    def test_prune_sent_and_failed(self):
+        for filename in self.spool.claim(now=1010):
+            self.spool.ack(filename, now=1020)
+        self.assertEqual(self.spool.prune(older_than=60, now=1060), 0)
+        self.assertEqual(self.spool.prune(older_than=60, now=1081), 3)
+        self.assertEqual(self.spool.stats()["states"], {})
+        # Failed bulletins go once they are as old, queued ones stay
+        self.spool.enqueue(self.files[0], now=2000)
+        self.spool.enqueue(self.files[1], now=2000)
+        self.spool.claim(1, now=2000)
+        for attempt in range(3):
+            self.spool.fail(self.files[0], "timed out", now=2000)
+        self.assertEqual(self.spool.prune(older_than=60, now=2061), 1)
+        self.assertEqual(self.spool.stats()["states"], {"queued": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+import http.client
+from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from GTS_encode.spool import TransferSpool
+from GTS_encode.transfer import GTS, MHSUploader
+from sample import write_sample
+
+
+class MHSHandler(BaseHTTPRequestHandler):
+    """Stand-in message switch queue recording what it receives"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        name = body.split(b"\n")[1].decode()
+        with self.server.lock:
+            self.server.paths.append(self.path)
+            self.server.attempts[name] = self.server.attempts.get(name, 0) + 1
+            failures = self.server.failures.get(name, 0)
+            status = 500 if self.server.attempts[name] <= failures else 200
+            if status == 200:
+                self.server.received[name] = body
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Test_transfer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "GTS") + "/"
+        self.transfer_path = os.path.join(self.path, "transfer") + "/"
+        os.makedirs(self.transfer_path)
+        self.names = [f"IOVE{i:02d} NZKL 280818" for i in range(1, 9)]
+        for name in self.names:
+            with open(self.path + name.replace(" ", "_") + ".bufr", "wb") as f:
+                f.write(b"001\n" + name.encode() + b"\nBUFR...7777")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MHSHandler)
+        self.server.lock = threading.Lock()
+        self.server.connections = 0
+        self.server.attempts = {}
+        self.server.failures = {}
+        self.server.received = {}
+        self.server.paths = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/mhs/queue"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def _transfer(self, **kwargs):
+        return GTS(
+            path=self.path,
+            transfer_path=self.transfer_path,
+            server=self.url,
+            concurrency=2,
+            retries=2,
+            backoff=0.01,
+            **kwargs,
+        )
+
+    def test_files_sent_over_reused_connections(self):
+        sent = self._transfer().run()
+        self.assertEqual(len(sent), len(self.names))
+        self.assertEqual(sorted(self.server.received), sorted(self.names))
+        self.assertLessEqual(self.server.connections, 2)
+        self.assertEqual(len(os.listdir(self.transfer_path)), len(self.names))
+
+    def test_retry_then_success(self):
+        self.server.failures[self.names[0]] = 2
+        self._transfer().run()
+        self.assertEqual(self.server.attempts[self.names[0]], 3)
+        self.assertIn(self.names[0], self.server.received)
+
+    def test_failed_file_stays_for_next_run(self):
+        self.server.failures[self.names[3]] = 10
+        with self.assertRaises(Exception):
+            self._transfer().run()
+        remaining = [f for f in os.listdir(self.path) if f.endswith(".bufr")]
+        self.assertEqual(remaining, [self.names[3].replace(" ", "_") + ".bufr"])
+        self.assertEqual(len(os.listdir(self.transfer_path)), len(self.names) - 1)
+
+    def test_put_bytes_without_file(self):
+        uploader = MHSUploader(self.url, retries=0)
+        uploader.put("IOVE99 NZKL 280818", b"001\nIOVE99 NZKL 280818\nBUFR...7777")
+        self.assertIn("IOVE99 NZKL 280818", self.server.received)
+
+    def test_server_url(self):
+        uploader = MHSUploader("https://mhs.example:8443/mhs/queue?queue=GTS")
+        self.assertIs(uploader._connection_class, http.client.HTTPSConnection)
+        self.assertEqual((uploader.host, uploader.port), ("mhs.example", 8443))
+        self.assertEqual(uploader.path, "/mhs/queue?queue=GTS")
+        with self.assertRaises(ValueError):
+            MHSUploader("ftp://mhs.example/mhs/queue")
+        uploader = MHSUploader(self.url + "?queue=GTS", retries=0)
+        uploader.put("IOVE99 NZKL 280818", b"001\nIOVE99 NZKL 280818\nBUFR...7777")
+        self.assertEqual(self.server.paths, ["/mhs/queue?queue=GTS"])
+
+    def test_spool_claims_instead_of_listing(self):
+        spool_db = os.path.join(self.tmpdir.name, "spool.sqlite")
+        spool = TransferSpool(spool_db)
+        filelist = sorted(os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith(".bufr"))
+        for filename in filelist[:4]:
+            spool.enqueue(filename)
+        self.server.failures[self.names[1]] = 10
+        transfer = self._transfer(spool_db=spool_db, spool_batch=3, spool_retry=0)
+        sent = transfer.run()
+        # Files not enqueued are not listed, the failed one is rescheduled
+        self.assertEqual(sorted(sent), [filelist[0]] + filelist[2:4])
+        row = spool.get(filelist[1])
+        self.assertEqual((row["state"], row["attempts"]), ("queued", 1))
+        self.assertEqual(row["last_error"], "500 Internal Server Error")
+        self.server.failures.clear()
+        self.assertEqual(transfer.run(), [filelist[1]])
+        self.assertEqual(spool.stats()["states"], {"sent": 4})
+        self.assertEqual(transfer.run(), [])
+        spool.close()
+
+    def test_spool_gives_up(self):
+        spool_db = os.path.join(self.tmpdir.name, "spool.sqlite")
+        filename = os.path.join(self.path, self.names[0].replace(" ", "_") + ".bufr")
+        TransferSpool(spool_db).enqueue(filename)
+        self.server.failures[self.names[0]] = 100
+        transfer = self._transfer(spool_db=spool_db, spool_retry=0, spool_attempts=2)
+        self.assertEqual(transfer.run(), [])
+        with self.assertRaises(Exception):
+            transfer.run()
+        self.assertEqual(TransferSpool(spool_db).get(filename)["state"], "failed")
+        # Pruned once older than the retention
+        self._transfer(spool_db=spool_db, spool_retention=-1).run()
+        self.assertIsNone(TransferSpool(spool_db).get(filename))
+
+    def _run_pipelined(self, **kwargs):
+        self.spool_path = os.path.join(self.tmpdir.name, "spool") + "/"
+        wrapper = Wrapper(
+            filelist=[write_sample(self.tmpdir.name)],
+            out_dir=os.path.join(self.tmpdir.name, "encoded"),
+            upload_server=self.url,
+            spool_path=self.spool_path,
+            transfer_path=self.transfer_path,
+            **kwargs,
+        )
+        with patch("GTS_encode.transfer.time.sleep"):
+            return wrapper.run()
+
+    def test_pipelined_upload(self):
+        saved = self._run_pipelined()
+        name = "IOVE01 NZKL 280818"
+        self.assertIn(name, self.server.received)
+        uploaded = os.path.join(self.transfer_path, name.replace(" ", "_") + ".bufr")
+        self.assertEqual(saved["transferred"], [uploaded])
+        self.assertEqual(saved["spooled"], [])
+        with open(uploaded, "rb") as f:
+            self.assertEqual(f.read(), self.server.received[name])
+        self.assertFalse(os.path.exists(saved["filelist"][0]))
+
+    def test_pipelined_upload_skips_write(self):
+        for kwargs in ({}, {"workers": 2}, {"aggregate": True}):
+            # The bulletins go from memory to the message switch
+            with patch("GTS_encode.GTS_encode.write_bulletin", side_effect=AssertionError):
+                saved = self._run_pipelined(**kwargs)
+            self.assertEqual(len(saved["transferred"]), 1)
+            self.assertEqual(saved["spooled"], [])
+            with open(saved["transferred"][0], "rb") as f:
+                self.assertIn(f.read(), self.server.received.values())
+
+    def test_pipelined_failure_spooled(self):
+        name = "IOVE01 NZKL 280818"
+        # Past the three retries of the pipeline uploader
+        self.server.failures[name] = 10
+        saved = self._run_pipelined()
+        spooled = os.path.join(self.spool_path, name.replace(" ", "_") + ".bufr")
+        self.assertEqual(saved["spooled"], [spooled])
+        self.assertTrue(os.path.exists(spooled))
+        # Picked up by the next transfer run
+        self.server.failures.clear()
+        transfer = self._transfer()
+        transfer.path = self.spool_path
+        self.assertEqual(transfer.run(), [spooled])
+        self.assertIn(name, self.server.received)
+
+    def test_pipelined_failure_queued_in_spool(self):
+        name = "IOVE01 NZKL 280818"
+        spool_db = os.path.join(self.tmpdir.name, "spool.sqlite")
+        self.server.failures[name] = 10
+        saved = self._run_pipelined(spool_db=spool_db)
+        # Left where it was written, for the transfer task to claim
+        self.assertEqual(saved["spooled"], saved["filelist"])
+        spool = TransferSpool(spool_db)
+        self.assertEqual(spool.get(saved["filelist"][0])["state"], "queued")
+        self.server.failures.clear()
+        transfer = self._transfer(spool_db=spool_db)
+        self.assertEqual(transfer.run(), [])
+        # Due once the spool backoff has passed
+        with patch("GTS_encode.transfer.time.time", return_value=time.time() + 120):
+            sent = transfer.run()
+        self.assertEqual(sent, saved["filelist"])
+        self.assertIn(name, self.server.received)
+        self.assertEqual(spool.stats()["states"], {"sent": 1})
+        spool.close()
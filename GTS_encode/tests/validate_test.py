@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from GTS_encode.GTS_encode import GTS_encode_glider, GTS_encode_ship
+from GTS_encode.validate import validate_bulletin, validate_directory
+from sample import write_sample
+
+
+class Test_validate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+        os.mkdir(self.out_dir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_templates_round_trip(self):
+        GTS_encode_ship(self.file, 69, self.out_dir).run()
+        GTS_encode_ship(self.file, 69, self.out_dir, upcast=False).run()
+        GTS_encode_ship(self.file, 69, self.out_dir).run_casts()
+        GTS_encode_glider(self.file, 69, self.out_dir).run()
+        results = validate_directory(self.out_dir, [self.tmpdir.name], workers=2)
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertEqual(result["status"], "ok", result)
+            self.assertEqual(result["source"], self.file)
+
+    def test_mismatch_reported(self):
+        GTS = GTS_encode_ship(self.file, 69, self.out_dir)
+        GTS.create_variables_from_netcdf()
+        GTS.temperatures = GTS.temperatures.copy()
+        GTS.temperatures[3] += 0.5
+        result = validate_bulletin(GTS.create_bufr_file(), [self.file])
+        self.assertEqual(result["status"], "mismatch")
+        (mismatch,) = result["mismatches"]
+        self.assertEqual(mismatch["variable"], "temperatures")
+        self.assertEqual(mismatch["count"], 1)
+        self.assertEqual(mismatch["first_index"], 3)
+
+    def test_unmatched_without_source(self):
+        filename = GTS_encode_ship(self.file, 69, self.out_dir).run()
+        self.assertEqual(validate_bulletin(filename, {})["status"], "unmatched")
+
+    def test_thinned_round_trip(self):
+        thinning = ("bins", 5.0)
+        filename = GTS_encode_ship(self.file, 69, self.out_dir, thinning=thinning).run()
+        result = validate_bulletin(filename, [self.file], thinning=thinning)
+        self.assertEqual(result["status"], "ok", result)
+        # Without the thinning the levels do not match the source
+        self.assertEqual(validate_bulletin(filename, [self.file])["status"], "mismatch")
@@ -0,0 +1,82 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from GTS_encode.watch import Watcher
+from sample import write_sample
+
+
+class Test_watch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # Cleanups run last in first, so after the watchers are stopped
+        self.addCleanup(self.tmpdir.cleanup)
+        self.qc_dir = os.path.join(self.tmpdir.name, "qc")
+        os.mkdir(self.qc_dir)
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+
+    def _watch(self, inotify, **kwargs):
+        wrapper = Wrapper(out_dir=self.out_dir, **kwargs)
+        watcher = Watcher(wrapper, self.qc_dir, settle=0.2, interval=0.5, inotify=inotify)
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(watcher.stop.set)
+        return watcher
+
+    def _wait_for_output(self, count, timeout=20):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.path.isdir(self.out_dir):
+                outputs = [name for name in os.listdir(self.out_dir) if name.endswith(".bufr")]
+                if len(outputs) >= count:
+                    return sorted(outputs)
+            time.sleep(0.05)
+        self.fail("No bulletin written within {}s".format(timeout))
+
+    def _check_new_file_encoded(self, inotify):
+        self._watch(inotify)
+        write_sample(self.qc_dir)
+        self.assertEqual(len(self._wait_for_output(1)), 1)
+
+    def test_new_file_encoded_inotify(self):
+        self._check_new_file_encoded(inotify=True)
+
+    def test_new_file_encoded_polling(self):
+        self._check_new_file_encoded(inotify=False)
+
+    def test_existing_files_need_an_index(self):
+        write_sample(self.qc_dir)
+        index_path = os.path.join(self.tmpdir.name, "index.json")
+        self._watch(inotify=False, index_path=index_path)
+        self._wait_for_output(1)
+        self.assertTrue(os.path.exists(index_path))
+
+    def test_files_wait_to_settle(self):
+        watcher = Watcher(Wrapper(out_dir=self.out_dir), self.qc_dir, settle=5)
+        path = os.path.join(self.qc_dir, "partial_qc.nc")
+        with open(path, "wb") as f:
+            f.write(b"CDF")
+        watcher._scan(now=0)
+        self.assertEqual(watcher._settled(now=4), [])
+        # Still being written, the wait starts again
+        with open(path, "ab") as f:
+            f.write(b"\x01")
+        watcher._scan(now=4)
+        self.assertEqual(watcher._settled(now=8), [])
+        self.assertEqual(watcher._settled(now=9), [path])
+        watcher._scan(now=10)
+        self.assertEqual(watcher._settled(now=20), [])
+
+    def test_scan_error_retried(self):
+        watcher = Watcher(Wrapper(out_dir=self.out_dir), self.qc_dir, settle=0)
+        os.rename(self.qc_dir, self.qc_dir + ".moved")
+        with self.assertLogs(level="ERROR"):
+            watcher._scan(now=0)
+        os.rename(self.qc_dir + ".moved", self.qc_dir)
+        write_sample(self.qc_dir)
+        watcher._scan(now=1)
+        self.assertEqual(len(watcher._settled(now=1)), 1)
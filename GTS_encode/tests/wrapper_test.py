@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import subprocess
+import unittest
+from unittest.mock import patch
+
+import xarray as xr
+
+from GTS_encode.GTS_encode_wrapper import Wrapper
+from sample import write_sample
+
+
+class Test_wrapper(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file = write_sample(self.tmpdir.name)
+        self.out_dir = os.path.join(self.tmpdir.name, "GTS")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_available_for_GTS_publication(self):
+        wrapper = Wrapper(filelist=[self.file], out_dir=self.out_dir)
+        self.assertTrue(wrapper._available_for_GTS_publication(self.file))
+        self.assertEqual(wrapper.wigos_id, "0-22000-0-MSN58")
+
+    def test_not_available_before_publication_date(self):
+        file = write_sample(
+            self.tmpdir.name, "late_qc.nc", publication_date="01/01/2024"
+        )
+        wrapper = Wrapper(filelist=[file], out_dir=self.out_dir)
+        self.assertFalse(wrapper._available_for_GTS_publication(file))
+
+    def test_run_opens_each_file_once(self):
+        wrapper = Wrapper(filelist=[self.file], out_dir=self.out_dir)
+        with patch("xarray.open_dataset", wraps=xr.open_dataset) as open_dataset:
+            saved = wrapper.run()
+        self.assertEqual(open_dataset.call_count, 1)
+        self.assertEqual(len(saved["filelist"]), 1)
+        self.assertTrue(os.path.exists(saved["filelist"][0]))
+
+    def test_glider_template(self):
+        dedup_path = os.path.join(self.tmpdir.name, "dedup")
+
+        def run(**kwargs):
+            wrapper = Wrapper(
+                filelist=[self.file],
+                out_dir=self.out_dir,
+                GTS_template="GTS_encode_glider",
+                **kwargs,
+            )
+            return wrapper.run()["filelist"]
+
+        (GTS_filename,) = run(dedup_path=dedup_path)
+        self.assertEqual(os.path.dirname(GTS_filename), self.out_dir)
+        with open(GTS_filename, "rb") as f:
+            self.assertTrue(f.read().startswith(b"001\nIOVE01 NZKL 280818\nBUFR"))
+        self.assertEqual(run(dedup_path=dedup_path, workers=2), [])
+        self.assertEqual(len(run(aggregate=True)), 1)
+
+    def test_empty_cycle_loads_no_encoding_dependencies(self):
+        code = (
+            "import sys\n"
+            "from GTS_encode.GTS_encode_wrapper import Wrapper\n"
+            "Wrapper(filelist=[], out_dir='GTS').run()\n"
+            "print(' '.join(m for m in ('eccodes', 'numpy', 'pandas', 'xarray', 'seawater')"
+            " if m in sys.modules))\n"
+        )
+        completed = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(completed.stdout.strip(), "")
@@ -1,19 +1,319 @@
 
+import os
+import re
+import queue
 import logging
 import subprocess
+import tempfile
+import threading
 import time
 import glob
 import shutil
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(level=logging.INFO)
 
+# rsync exit codes of a transfer where only some files failed
+RSYNC_PARTIAL_CODES = (23, 24)
+# Line of --itemize-changes for a file, unchanged ones included with -ii
+RSYNC_ITEMIZED_FILE = re.compile(r"^[<>ch.]f\S*\s+(.+)$")
+
+
+class MHSUploader(object):
+    """
+    Uploads files to the message switch queue with HTTP PUT.
+
+    Each worker thread keeps its own keep-alive connection, so files are
+    sent several at once without a new process or TCP connection per file.
+
+    Args:
+        server (str): The http or https URL of the message switch queue.
+        concurrency (int): Number of files uploaded at the same time.
+        retries (int): Number of new attempts after a failed upload.
+        backoff (float): Seconds to wait before the first retry, doubled on each retry.
+        timeout (float): Seconds to wait for the server on each request.
+        logger (logging.Logger): An instance of the logger class for logging messages.
+
+    Raises:
+        ValueError: If the URL is not http or https.
+    """
+
+    def __init__(
+        self,
+        server,
+        concurrency=4,
+        retries=3,
+        backoff=1.0,
+        timeout=60,
+        logger=logging,
+    ):
+        url = urlsplit(server)
+        if url.scheme == "https":
+            self._connection_class = http.client.HTTPSConnection
+        elif url.scheme == "http":
+            self._connection_class = http.client.HTTPConnection
+        else:
+            raise ValueError(f"Unsupported message switch URL {server}, expected http or https")
+        self.host = url.hostname
+        self.port = url.port
+        # The query selects the queue on some servers
+        self.path = (url.path or "/") + ("?" + url.query if url.query else "")
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.logger = logger
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = self._connection_class(
+                self.host, self.port, timeout=self.timeout
+            )
+        return self._local.connection
+
+    def _close_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _put_once(self, filename, data=None):
+        if data is None:
+            with open(filename, "rb") as f:
+                data = f.read()
+        connection = self._connection()
+        # Same content type curl --data-binary sent
+        connection.request(
+            "PUT",
+            self.path,
+            body=data,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        response = connection.getresponse()
+        response.read()
+        if response.will_close:
+            self._close_connection()
+        if not 200 <= response.status < 300:
+            raise IOError(f"{response.status} {response.reason}")
+
+    def put(self, filename, data=None):
+        """
+        Uploads a file, retrying with exponential backoff.
+
+        Args:
+            filename (str): The file to upload, or the name of the bulletin in logs.
+            data (bytes, optional): The bulletin already in memory, e.g. from
+                `encode_bulletin`, in which case nothing is read from disk.
+
+        Raises:
+            Exception: The error of the last attempt if every attempt failed.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._put_once(filename, data)
+            except Exception as exc:
+                self._close_connection()
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2**attempt
+                self.logger.warning(
+                    f"Upload of {filename} failed ({exc}), retrying in {delay}s"
+                )
+                time.sleep(delay)
+
+    def upload(self, filelist, on_success=None):
+        """
+        Uploads the files with at most `concurrency` uploads at a time.
+
+        Args:
+            filelist (list): The files to upload.
+            on_success (callable, optional): Called with each file once its upload succeeded.
+
+        Returns:
+            tuple: The list of uploaded files and a dict of failed files and their errors.
+        """
+
+        def send(filename):
+            self.put(filename)
+            if on_success is not None:
+                on_success(filename)
+
+        sent, failed = [], {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(send, filename) for filename in filelist]
+            for filename, future in zip(filelist, futures):
+                try:
+                    future.result()
+                    sent.append(filename)
+                except Exception as exc:
+                    failed[filename] = exc
+                    self.logger.error(f"Could not upload {filename}: {exc}")
+        return sent, failed
+
+
+class UploadPipeline(object):
+    """
+    Uploads bulletins in background threads while the next ones are encoded.
+
+    Bulletins are handed over with `submit` through a queue of at most
+    `maxsize` files, which blocks the encoding when the uploads fall behind.
+    An uploaded bulletin is moved to `transfer_path` as `GTS.run` does. A
+    bulletin that could not be uploaded is moved to `spool_path`, where the
+    next run of the transfer task picks it up. With a `TransferSpool`, the
+    bulletins were enqueued as claimed by the encoder, each upload is
+    recorded in it and a failed bulletin stays where it is, queued for the
+    transfer task after the spool backoff. A bulletin submitted as bytes
+    was never written, it is only written where it would have been moved.
+
+    Args:
+        server (str): The URL of the message switch queue.
+        spool_path (str): The directory read by the transfer task.
+        transfer_path (str): The directory where the files are moved once transferred.
+        maxsize (int): Maximum number of bulletins waiting to be uploaded.
+        concurrency (int): Number of bulletins uploaded at the same time.
+        retries (int): Number of new attempts after a failed upload.
+        backoff (float): Seconds to wait before the first retry, doubled on each retry.
+        logger (logging.Logger): An instance of the logger class for logging messages.
+        spool (TransferSpool, optional): The spool recording the uploads. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        server,
+        spool_path='/data/obs/GTS/',
+        transfer_path='/data/obs/GTS/transfer/',
+        maxsize=8,
+        concurrency=2,
+        retries=3,
+        backoff=1.0,
+        logger=logging,
+        spool=None,
+    ):
+        self.uploader = MHSUploader(
+            server, concurrency=concurrency, retries=retries, backoff=backoff, logger=logger
+        )
+        self.spool_path = spool_path
+        self.transfer_path = transfer_path
+        self.concurrency = concurrency
+        self.logger = logger
+        self.spool = spool
+        self.queue = queue.Queue(maxsize)
+        self.sent = []
+        self.spooled = []
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        os.makedirs(self.spool_path, exist_ok=True)
+        os.makedirs(self.transfer_path, exist_ok=True)
+        for _ in range(self.concurrency):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, filename, data=None):
+        """
+        Queues a bulletin, waiting while the queue is full.
+
+        Args:
+            filename (str): The written bulletin, or the name it was encoded as.
+            data (bytes, optional): The bulletin in memory, e.g. from a
+                MemorySink, in which case nothing is read from disk.
+        """
+        self.queue.put((filename, data))
+
+    def close(self):
+        """
+        Waits for the queued bulletins to be uploaded or spooled.
+
+        Returns:
+            tuple: The list of files transferred and the list of files spooled.
+        """
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return self.sent, self.spooled
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _work(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                filename, data = item
+                try:
+                    self.uploader.put(filename, data)
+                except Exception as exc:
+                    self.logger.error(f"Could not upload {filename}, spooling it: {exc}")
+                    if self.spool is None:
+                        self._move(filename, self.spool_path, self.spooled, data)
+                        continue
+                    if data is not None:
+                        # The transfer task reads it where it was enqueued
+                        self._move(filename, os.path.dirname(filename), [], data)
+                    self.spool.fail(filename, exc)
+                    with self._lock:
+                        self.spooled.append(filename)
+                else:
+                    self._move(filename, self.transfer_path, self.sent, data)
+                    if self.spool is not None:
+                        self.spool.ack(filename)
+        finally:
+            self.uploader._close_connection()
+
+    def _move(self, filename, path, done, data=None):
+        """Moves a written bulletin to `path`, or writes it there from `data`"""
+        destination = os.path.join(path, os.path.basename(filename))
+        try:
+            if data is not None:
+                with open(destination, "xb") as f:
+                    f.write(data)
+            elif os.path.abspath(destination) != os.path.abspath(filename):
+                if os.path.exists(destination):
+                    raise FileExistsError(destination)
+                shutil.move(filename, destination)
+        except Exception as exc:
+            self.logger.error(f"Could not move {filename} to {path}: {exc}")
+            destination = filename
+        with self._lock:
+            done.append(destination)
+
+
 class GTS(object):
     """
-    A class that wraps the functionality of transferring files using curl.
+    A class that wraps the functionality of transferring files to the message switch.
 
     Args:
-        filelist (list): A list of files to transfer.
+        path (str): The directory with the bufr files to transfer.
+        transfer_path (str): The directory where the files are moved once transferred.
         logger (logging.Logger): An instance of the logger class for logging messages.
+        server (str): The URL of the message switch queue.
+        concurrency (int): Number of files uploaded at the same time.
+        retries (int): Number of new attempts after a failed upload.
+        backoff (float): Seconds to wait before the first retry, doubled on each retry.
+        spool_db (str): SQLite file of the transfer spool the encoder enqueues
+            into. When set, the bulletins are claimed from it in batches
+            instead of listed from `path`. Defaults to None.
+        spool_batch (int): Number of bulletins claimed at a time. Defaults to 100.
+        spool_retry (float): Seconds before a bulletin that failed every
+            retry is attempted again by a later run, doubled on each attempt.
+            Defaults to 60.
+        spool_attempts (int): Attempts before a bulletin is left failed in
+            the spool. Defaults to 10.
+        spool_retention (float): Days the sent and failed bulletins are kept
+            in the spool, pruned after each run. Defaults to 30.
     """
 
     def __init__(
@@ -22,12 +322,28 @@ class GTS(object):
         transfer_path='/data/obs/GTS/transfer/',
         logger=logging,
         server='http://nsmhs.met.co.nz:11120/mhs/queue',
+        concurrency=4,
+        retries=3,
+        backoff=1.0,
+        spool_db=None,
+        spool_batch=100,
+        spool_retry=60.0,
+        spool_attempts=10,
+        spool_retention=30,
         **kwargs,
     ):
         self.path = path
         self.transfer_path = transfer_path
         self.logger = logging
         self.server = server
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.spool_db = spool_db
+        self.spool_batch = spool_batch
+        self.spool_retry = spool_retry
+        self.spool_attempts = spool_attempts
+        self.spool_retention = spool_retention
 
     def _raise_exception(self, err_message, subset):
         self.logger.error(err_message)
@@ -35,34 +351,120 @@ class GTS(object):
         self.failed["err"].append(err_message)
         raise Exception(err_message)
 
+    def _move_to_transfer(self, file):
+        shutil.move(file, f"{self.transfer_path}{file.split('/')[-1]}")
+
     def run(self):
         """
-        Transfers the files in the filelist using curl.
+        Transfers the bufr files in `path` with HTTP PUT.
+
+        Each file is moved to `transfer_path` as soon as its own upload
+        succeeds, files that failed stay in `path` for the next run.
+
+        Returns:
+            list: The files transferred.
 
         Raises:
-            Exception: If no files are found in the filelist.
+            Exception: If any file could not be transferred.
         """
+        if self.spool_db:
+            return self._run_spool()
         filelist = sorted(glob.glob(f"{self.path}*.bufr"))
+        if not filelist:
+            self.logger.info("No files to publish")
+            return []
+        uploader = MHSUploader(
+            self.server,
+            concurrency=self.concurrency,
+            retries=self.retries,
+            backoff=self.backoff,
+            logger=self.logger,
+        )
+        sent, failed = uploader.upload(filelist, on_success=self._move_to_transfer)
+        self.logger.info(f"Transferred {len(sent)} of {len(filelist)} files")
+        if failed:
+            raise Exception(
+                f"Could not transfer {len(failed)} files: "
+                + ", ".join(os.path.basename(f) for f in failed)
+            )
+        return sent
+
+    def _run_spool(self):
+        """
+        Transfers the due bulletins of the spool with HTTP PUT.
+
+        Bulletins are claimed in batches of `spool_batch` until none is due.
+        A bulletin that failed every retry is scheduled again in the spool
+        without stopping the others, so this run only fails for the
+        bulletins that used up their attempts. The rows older than
+        `spool_retention` days are then pruned.
+
+        Returns:
+            list: The files transferred.
+
+        Raises:
+            Exception: If any bulletin was left failed.
+        """
+        from GTS_encode.spool import TransferSpool
+
+        spool = TransferSpool(
+            self.spool_db, max_attempts=self.spool_attempts, backoff=self.spool_retry
+        )
+        uploader = MHSUploader(
+            self.server,
+            concurrency=self.concurrency,
+            retries=self.retries,
+            backoff=self.backoff,
+            logger=self.logger,
+        )
+
+        def on_success(filename):
+            self._move_to_transfer(filename)
+            spool.ack(filename)
+
+        # Bulletins rescheduled during this run are left for the next one
+        started = time.time()
+        sent, given_up = [], []
         try:
-            for file in filelist:
-                jobstr = f"curl -X PUT --data-binary @{file} {self.server}"
-                proc = subprocess.run(
-                    jobstr, shell=True, check=True, capture_output=True
-                )
-                # time.sleep(5)
-                shutil.move(file, f"{self.transfer_path}{file.split('/')[-1]}")
-        except Exception as exc:
-            self.logger.info(f"No files to publish")
-            self.logger.error("No files to publish")
-            raise type(exc)(f"No file list found due to: {exc}")
+            while True:
+                batch = spool.claim(self.spool_batch, now=started)
+                if not batch:
+                    break
+                done, failed = uploader.upload(batch, on_success=on_success)
+                sent.extend(done)
+                for filename, exc in failed.items():
+                    if not spool.fail(filename, exc):
+                        given_up.append(filename)
+            pruned = spool.prune(self.spool_retention * 86400)
+            stats = spool.stats()
+        finally:
+            spool.close()
+        self.logger.info(
+            f"Transferred {len(sent)} files, pruned {pruned}, spool: {stats['states']}, "
+            f"mean latency {stats['mean_latency'] or 0:.1f}s"
+        )
+        if stats["states"].get("failed"):
+            self.logger.warning(
+                f"{stats['states']['failed']} bulletins used up their attempts, "
+                f"kept failed in {self.spool_db} for {self.spool_retention} days"
+            )
+        if given_up:
+            raise Exception(
+                f"Gave up transferring {len(given_up)} files: "
+                + ", ".join(os.path.basename(f) for f in given_up)
+            )
+        return sent
 
 class dataserv(object):
     """
-    A class that wraps the functionality of transferring files using curl.
+    A class that wraps the functionality of transferring files using rsync.
 
     Args:
         filelist (list): A list of files to transfer.
+        destination (str): The rsync destination of the files.
         logger (logging.Logger): An instance of the logger class for logging messages.
+        batch (bool): Whether to send the whole filelist in a single rsync call,
+            i.e. over a single SSH session. Defaults to False.
     """
 
     def __init__(
@@ -70,11 +472,15 @@ class dataserv(object):
         filelist=None,
         destination='metocean@dataserv2.hm:/hub/data/obs/GTS/',
         logger=logging,
+        batch=False,
         **kwargs,
     ):
         self.filelist = filelist
         self.destination = destination
         self.logger = logger
+        self.batch = batch
+        self.transferred = []
+        self.failed = {}
 
     def run(self):
         """
@@ -83,6 +489,8 @@ class dataserv(object):
         Raises:
             Exception: If no files are found in the filelist.
         """
+        if self.batch:
+            return self._run_batch()
         filelist = self.filelist
         try:
             for files in filelist:
@@ -94,3 +502,79 @@ class dataserv(object):
         except Exception as exc:
             self.logger.error("No files to send")
             raise type(exc)(f"No file list found due to: {exc}")
+
+    def _run_batch(self):
+        """
+        Transfers the whole filelist with one rsync call reading it from --files-from.
+
+        A file that cannot be sent does not stop the others. When some
+        failed, a file only counts as sent if rsync itemized it and no error
+        names it or its temporary file on the receiver. The files sent and
+        the files that failed, with their error, are kept in `transferred`
+        and `failed`.
+
+        Returns:
+            list: The files transferred.
+
+        Raises:
+            Exception: If any file could not be transferred.
+        """
+        self.transferred, self.failed = [], {}
+        filelist = []
+        for file in self.filelist or []:
+            if os.path.isfile(file):
+                filelist.append(os.path.abspath(file))
+            else:
+                self.failed[file] = "No such file"
+        if filelist:
+            with tempfile.NamedTemporaryFile("w", suffix=".txt") as files_from:
+                files_from.write("\n".join(filelist) + "\n")
+                files_from.flush()
+                proc = subprocess.run(
+                    [
+                        "rsync",
+                        "-aii",
+                        "--no-relative",
+                        f"--files-from={files_from.name}",
+                        "/",
+                        self.destination,
+                    ],
+                    capture_output=True,
+                    text=True,
+                )
+            if proc.returncode == 0:
+                self.transferred = filelist
+            elif proc.returncode in RSYNC_PARTIAL_CODES:
+                itemized = set()
+                for line in proc.stdout.splitlines():
+                    match = RSYNC_ITEMIZED_FILE.match(line)
+                    if match:
+                        itemized.add(match.group(1))
+                # The sender names the local file, the receiver the remote one
+                # or its temporary .name.XXXXXX
+                errors = {}
+                for line in proc.stderr.splitlines():
+                    for path in re.findall(r'"([^"]+)"', line):
+                        errors.setdefault(os.path.basename(path), line.strip())
+                for file in filelist:
+                    name = os.path.basename(file)
+                    error = errors.get(name) or next(
+                        (line for temp, line in errors.items() if temp.startswith(f".{name}.")),
+                        None,
+                    )
+                    if error is None and name in itemized:
+                        self.transferred.append(file)
+                    else:
+                        self.failed[file] = error or "Not confirmed by rsync"
+            else:
+                err = proc.stderr.strip() or f"rsync exit code {proc.returncode}"
+                for file in filelist:
+                    self.failed[file] = err
+        self.logger.info(
+            f"Transferred {len(self.transferred)} of {len(self.filelist or [])} files"
+        )
+        for file, err in self.failed.items():
+            self.logger.error(f"Could not transfer {file}: {err}")
+        if self.failed:
+            raise Exception(f"Could not transfer {len(self.failed)} files")
+        return self.transferred
@@ -1,13 +1,13 @@
 """Useful functions to support the encoding of mangopare sensors
 - inflection_data - Identification of inflection points
+- upcast_start - Index where the last upcast starts
+- segment_casts - Index ranges of every down and up cast
+- bin_levels, significant_levels, max_levels - Levels kept when thinning a profile
 - extract_upcast - Extraction of upcast measurements
 - pres - conversion of depth (m) to pressure (Pa)
 """
 
 import numpy as np
-import xarray as xr
-import pandas as pd
-import pdb
 import datetime
 import os
 import re
@@ -18,6 +18,10 @@ def increment_identifier_number(filename):
     new_filename = re.sub(r'IOVE\d+', f'IOVE{str(number_part).zfill(len(match.group(1)))}', filename)
     return new_filename
 
+def set_identifier_number(identifier, number):
+    match = re.search(r'IOVE(\d+)', identifier)
+    return re.sub(r'IOVE\d+', f'IOVE{str(number).zfill(len(match.group(1)))}', identifier)
+
 def generate_identifier(day,hour,minute):
     first_identifier = "IOVE01"
     second_identifier = "NZKL"
@@ -42,11 +46,145 @@ def inflection_points(data):
         return inflection_index[big_changes]
 
 
+def upcast_start(depth):
+    """Index where the last upcast of a depth array starts"""
+    inflection = inflection_points(depth)
+    return inflection[::-1][0]
+
+
+def segment_casts(depth, threshold=1.0):
+    """
+    Splits a depth series into its down and up casts in a single vectorized pass.
+
+    Monotonic runs are found from the sign of the depth differences, flat
+    steps keeping the direction of the previous movement. Runs that move
+    less than `threshold` metres are noise and left to their neighbours,
+    and consecutive runs in the same direction make a cast. Each cast
+    starts at the deepest (or shallowest) sample between it and the
+    previous one, so the casts tile the whole series.
+
+    Args:
+        depth (array_like): Depths in metres, positive downwards.
+        threshold (float, optional): Minimum depth change of a run, in metres.
+            Defaults to 1.0.
+
+    Returns:
+        list: The (start, stop, direction) of each cast, `direction` being 1
+            for a downcast and -1 for an upcast. Empty if the depth never
+            moves by `threshold`.
+    """
+    depth = np.asarray(depth, dtype=float)
+    sign = np.sign(np.diff(depth))
+    moving = np.flatnonzero(sign)
+    if len(moving) == 0:
+        return []
+    # Forward fill the flat steps, leading ones take the first movement
+    filled = sign[np.maximum.accumulate(np.where(sign != 0, np.arange(len(sign)), moving[0]))]
+    # Run k covers the samples run_starts[k] to run_stops[k], both included
+    run_starts = np.concatenate([[0], np.flatnonzero(np.diff(filled)) + 1])
+    run_stops = np.concatenate([run_starts[1:], [len(filled)]])
+    kept = np.flatnonzero(np.abs(depth[run_stops] - depth[run_starts]) >= threshold)
+    if len(kept) == 0:
+        return []
+    directions = filled[run_starts[kept]]
+    first = np.concatenate([[0], np.flatnonzero(np.diff(directions)) + 1])
+    boundaries = []
+    # One iteration per turn, the samples in between are searched with NumPy
+    for k in first[1:]:
+        gap = depth[run_stops[kept[k - 1]] : run_starts[kept[k]] + 1]
+        turn = np.argmax(gap) if directions[k - 1] > 0 else np.argmin(gap)
+        boundaries.append(run_stops[kept[k - 1]] + turn)
+    starts = [0] + boundaries
+    stops = boundaries + [len(depth)]
+    return [
+        (int(start), int(stop), int(direction))
+        for start, stop, direction in zip(starts, stops, directions[first])
+    ]
+
+
+def bin_levels(depth, bin_size):
+    """
+    Index of the first sample each time the profile enters a depth bin.
+
+    Args:
+        depth (array_like): Depths in metres.
+        bin_size (float): Height of the bins in metres.
+
+    Returns:
+        numpy.ndarray: Sorted indices, always including the first and last samples.
+    """
+    depth = np.asarray(depth, dtype=float)
+    if len(depth) == 0:
+        return np.arange(0)
+    bins = np.floor(depth / bin_size)
+    entered = np.flatnonzero(np.diff(bins)) + 1
+    return np.unique(np.concatenate([[0], entered, [len(depth) - 1]]))
+
+
+def significant_levels(depth, values, tolerance):
+    """
+    Index of the levels needed to rebuild `values` by linear interpolation in depth.
+
+    Douglas-Peucker simplification run breadth first: each pass adds, to
+    every segment between two kept levels, its sample furthest from the
+    interpolation if that is more than `tolerance`. All the segments are
+    handled at once with NumPy, so the number of passes only grows with
+    the depth of the refinement, not with the number of samples.
+
+    Args:
+        depth (array_like): Depths in metres.
+        values (array_like): The measured values, e.g. temperatures.
+        tolerance (float): Largest interpolation error left, in the unit of `values`.
+
+    Returns:
+        numpy.ndarray: Sorted indices, always including the first and last samples.
+    """
+    depth = np.asarray(depth, dtype=float)
+    values = np.asarray(values, dtype=float)
+    n = len(depth)
+    if n <= 2:
+        return np.arange(n)
+    samples = np.arange(n)
+    kept = np.array([0, n - 1])
+    while True:
+        segment = np.minimum(np.searchsorted(kept, samples, side="right") - 1, len(kept) - 2)
+        low, high = kept[segment], kept[segment + 1]
+        span = depth[high] - depth[low]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.clip(np.where(span != 0, (depth - depth[low]) / span, 0.0), 0, 1)
+        error = np.abs(values - (values[low] + fraction * (values[high] - values[low])))
+        error[kept] = 0
+        # Sample with the largest error of each segment
+        order = np.lexsort((-error, segment))
+        worst = order[np.concatenate([[0], np.flatnonzero(np.diff(segment[order])) + 1])]
+        added = worst[error[worst] > tolerance]
+        if len(added) == 0:
+            return kept
+        kept = np.union1d(kept, added)
+
+
+def max_levels(n_samples, n_levels):
+    """
+    Index of at most `n_levels` samples evenly spread over the profile.
+
+    Args:
+        n_samples (int): Number of samples of the profile.
+        n_levels (int): Maximum number of levels, at least 2.
+
+    Returns:
+        numpy.ndarray: Sorted indices, always including the first and last samples.
+    """
+    if n_levels < 2:
+        raise ValueError("At least the first and last levels are kept")
+    if n_samples <= n_levels:
+        return np.arange(n_samples)
+    return np.unique(np.round(np.linspace(0, n_samples - 1, n_levels)).astype(int))
+
+
 def extract_upcast(ds):
     """Extracts the upcast from a dataset or dataframe with mangopare format"""
     depth = ds["DEPTH"].values
-    inflection = inflection_points(depth)
-    last_upcast_index = inflection[::-1][0]
+    last_upcast_index = upcast_start(depth)
     try:
         upcast = ds.isel({"DATETIME": np.arange(last_upcast_index, len(depth), 1)})
     except:
@@ -0,0 +1,320 @@
+"""Round-trip validation of the produced bulletins against their source files
+- validate_directory - validates every bulletin of a directory in parallel
+- validate_bulletin - decodes one bulletin and compares it with its source
+- decode_bulletin - decoded arrays and encoding resolution of a bulletin
+
+Usage: python -m GTS_encode.validate OUTDIR SOURCE [SOURCE ...] [-w WORKERS]
+"""
+
+import os
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+from eccodes import (
+    codes_bufr_new_from_file,
+    codes_get,
+    codes_get_array,
+    codes_get_size,
+    codes_is_defined,
+    codes_release,
+    codes_set,
+)
+
+from GTS_encode.reader import (
+    DIRECTION_DOWN,
+    DIRECTION_UP,
+    read_casts,
+    read_profile,
+)
+
+# Where each template puts the profile, as (profile variable, BUFR key, first
+# occurrence). "levels" gives the key counting the levels and its extra
+# occurrences, "last" the keys only holding the last value of the profile.
+LAYOUTS = {
+    "ship": {
+        "levels": ("waterPressure", 2),
+        "arrays": [
+            ("pressures", "waterPressure", 0),
+            ("temperatures", "oceanographicWaterTemperature", 1),
+            ("depths", "depthBelowWaterSurface", 2),
+        ],
+        "last": [
+            ("latitudes", "latitude"),
+            ("longitudes", "longitude"),
+            ("years", "year"),
+            ("months", "month"),
+            ("days", "day"),
+            ("hours", "hour"),
+            ("minutes", "minute"),
+        ],
+    },
+    "glider": {
+        "levels": ("oceanographicWaterPressure", 0),
+        "arrays": [
+            ("pressures", "oceanographicWaterPressure", 0),
+            ("temperatures", "oceanographicWaterTemperature", 0),
+            ("depths", "depthBelowWaterSurface", 0),
+            ("latitudes", "latitude", 2),
+            ("longitudes", "longitude", 2),
+            ("years", "year", 2),
+            ("months", "month", 2),
+            ("days", "day", 2),
+            ("hours", "hour", 2),
+            ("minutes", "minute", 2),
+        ],
+        "last": [],
+    },
+}
+
+
+def profile_key(filename):
+    """The uniqueIdentifierForProfile the templates derive from a file name"""
+    return filename.split("_")[-2][5::]
+
+
+def _tolerance(ibufr, key):
+    """Half the resolution of each occurrence of `key`, from its BUFR scale"""
+    try:
+        scale = codes_get_array(ibufr, key + "->scale")
+    except Exception:
+        # Integer elements such as the date have no scale
+        return np.zeros(codes_get_size(ibufr, key))
+    return 0.5 * 10.0 ** -scale.astype(float)
+
+
+def decode_bulletin(filename):
+    """
+    Decodes the profile of a single-subset bulletin with one array call per key.
+
+    Args:
+        filename (str): The bulletin, with or without its GTS heading.
+
+    Returns:
+        dict: The layout name, the `uniqueIdentifierForProfile`, the
+            `directionOfProfile`, the number of levels, and the decoded
+            values and tolerances of each BUFR key of the layout.
+
+    Raises:
+        ValueError: If the file holds no message, several subsets, or a
+            layout that cannot be validated.
+    """
+    with open(filename, "rb") as f:
+        ibufr = codes_bufr_new_from_file(f)
+    if ibufr is None:
+        raise ValueError("No BUFR message in {}".format(filename))
+    try:
+        if codes_get(ibufr, "numberOfSubsets") != 1:
+            raise ValueError("Only single-subset bulletins are validated")
+        codes_set(ibufr, "unpack", 1)
+        for layout, spec in LAYOUTS.items():
+            if codes_is_defined(ibufr, spec["levels"][0]):
+                break
+        else:
+            raise ValueError("No layout to validate {}".format(filename))
+        keys = [key for _, key, _ in spec["arrays"]] + [key for _, key in spec["last"]]
+        decoded = {
+            "layout": layout,
+            "profile": str(codes_get(ibufr, "uniqueIdentifierForProfile")),
+            "direction": int(codes_get_array(ibufr, "directionOfProfile")[0]),
+            "levels": codes_get_size(ibufr, spec["levels"][0]) - spec["levels"][1],
+            "values": {},
+            "tolerances": {},
+        }
+        for key in set(keys):
+            decoded["values"][key] = codes_get_array(ibufr, key)
+            decoded["tolerances"][key] = _tolerance(ibufr, key)
+    finally:
+        codes_release(ibufr)
+    return decoded
+
+
+def _candidate_profiles(ds, direction, QC_flag, cast_threshold, thinning):
+    """The profiles of a file a bulletin with `direction` may have been encoded from"""
+    # The code 3 fills the two bits of the element, so it decodes as missing
+    if direction not in (DIRECTION_UP, DIRECTION_DOWN):
+        return [read_profile(ds, QC_flag, upcast=False, thinning=thinning)]
+    candidates = []
+    if direction == DIRECTION_UP:
+        candidates.append(read_profile(ds, QC_flag, upcast=True, thinning=thinning))
+    if direction in (DIRECTION_UP, DIRECTION_DOWN):
+        candidates.extend(
+            cast
+            for cast in read_casts(ds, QC_flag, cast_threshold, thinning)
+            if cast["direction"] == direction
+        )
+    return candidates
+
+
+def compare_profile(decoded, profile):
+    """
+    Compares the decoded arrays of a bulletin with a profile read from its source.
+
+    Returns:
+        list: One dict per variable out of tolerance, with the number of
+            values out of tolerance and the largest error.
+    """
+    spec = LAYOUTS[decoded["layout"]]
+    n = len(profile["depths"])
+    if decoded["levels"] != n:
+        return [{"variable": "levels", "count": abs(decoded["levels"] - n), "max_error": None}]
+    expected = [
+        (name, key, start, profile[name]) for name, key, start in spec["arrays"]
+    ] + [(name, key, 0, profile[name][-1:]) for name, key in spec["last"]]
+    mismatches = []
+    for name, key, start, values in expected:
+        stop = start + len(values)
+        decoded_values = decoded["values"][key][start:stop].astype(float)
+        tolerance = decoded["tolerances"][key][start:stop]
+        error = np.abs(decoded_values - np.asarray(values, dtype=float))
+        # A tenth of the resolution is left for the rounding of the encoder
+        bad = ~(error <= tolerance * 1.1 + 1e-9)
+        if bad.any():
+            mismatches.append(
+                {
+                    "variable": name,
+                    "key": key,
+                    "count": int(bad.sum()),
+                    "first_index": int(np.flatnonzero(bad)[0]),
+                    "max_error": float(np.max(np.where(np.isfinite(error), error, np.inf))),
+                }
+            )
+    return mismatches
+
+
+def validate_bulletin(bulletin, sources, QC_flag=1, cast_threshold=1.0, thinning=None):
+    """
+    Decodes a bulletin and compares it with the profiles of its source files.
+
+    Args:
+        bulletin (str): The bulletin to validate.
+        sources (list or dict): The NetCDF files the bulletin may come from, or
+            lists of them keyed by `profile_key`.
+        QC_flag (int or list, optional): The QC flags the bulletin was encoded with.
+        cast_threshold (float, optional): The threshold the casts were split with.
+        thinning (tuple, optional): The thinning the profiles were encoded with.
+
+    Returns:
+        dict: The bulletin, the source it was matched with, a status of "ok",
+            "mismatch", "unmatched", "skipped" or "error", and the mismatches.
+    """
+    result = {"bulletin": bulletin, "source": None, "status": "ok", "mismatches": []}
+    try:
+        decoded = decode_bulletin(bulletin)
+    except ValueError as exc:
+        result.update(status="skipped", error=str(exc))
+        return result
+    except Exception as exc:
+        result.update(status="error", error=str(exc))
+        return result
+    if isinstance(sources, dict):
+        sources = sources.get(decoded["profile"], [])
+    best = None
+    for source in sources:
+        try:
+            with xr.open_dataset(source) as ds:
+                candidates = _candidate_profiles(
+                    ds, decoded["direction"], QC_flag, cast_threshold, thinning
+                )
+        except Exception as exc:
+            result.update(status="error", error="{}: {}".format(source, exc))
+            continue
+        for profile in candidates:
+            mismatches = compare_profile(decoded, profile)
+            if best is None or len(mismatches) < len(best[1]):
+                best = (source, mismatches)
+            if not mismatches:
+                break
+        if best is not None and not best[1]:
+            break
+    if best is None:
+        if result["status"] == "ok":
+            result["status"] = "unmatched"
+        return result
+    result["source"], result["mismatches"] = best
+    result["status"] = "mismatch" if best[1] else "ok"
+    result.pop("error", None)
+    return result
+
+
+def validate_directory(
+    outdir, sources, workers=None, QC_flag=1, cast_threshold=1.0, thinning=None
+):
+    """
+    Validates every bulletin of `outdir` against the source files in parallel.
+
+    A bulletin is matched with its sources by `uniqueIdentifierForProfile`,
+    which the templates derive from the source file name.
+
+    Args:
+        outdir (str): The directory with the `.bufr` bulletins.
+        sources (list): NetCDF files or directories of `*_qc.nc` files.
+        workers (int, optional): Number of worker processes. Defaults to the
+            number of CPUs.
+
+    Returns:
+        list: The result of `validate_bulletin` for each bulletin.
+    """
+    source_files = []
+    for source in sources:
+        if os.path.isdir(source):
+            source_files.extend(sorted(glob.glob(os.path.join(source, "*_qc.nc"))))
+        else:
+            source_files.append(source)
+    by_profile = {}
+    for source in source_files:
+        by_profile.setdefault(profile_key(os.path.basename(source)), []).append(source)
+    bulletins = sorted(glob.glob(os.path.join(outdir, "*.bufr")))
+    if not bulletins:
+        return []
+    # The profile identifier is only known once decoded, so each worker
+    # picks the sources of its bulletin
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                validate_bulletin, bulletin, by_profile, QC_flag, cast_threshold, thinning
+            )
+            for bulletin in bulletins
+        ]
+        return [future.result() for future in futures]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("outdir")
+    parser.add_argument("sources", nargs="+")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--qc-flag", type=int, nargs="+", default=[1])
+    parser.add_argument("--cast-threshold", type=float, default=1.0)
+    parser.add_argument("--thinning", nargs=2, metavar=("METHOD", "VALUE"))
+    args = parser.parse_args(argv)
+
+    QC_flag = args.qc_flag[0] if len(args.qc_flag) == 1 else args.qc_flag
+    thinning = (args.thinning[0], float(args.thinning[1])) if args.thinning else None
+    results = validate_directory(
+        args.outdir, args.sources, args.workers, QC_flag, args.cast_threshold, thinning
+    )
+    failed = 0
+    for result in results:
+        name = os.path.basename(result["bulletin"])
+        if result["status"] == "ok":
+            continue
+        if result["status"] != "skipped":
+            failed += 1
+        print("{} {} {}".format(name, result["status"], result.get("error", "")).rstrip())
+        for mismatch in result["mismatches"]:
+            print(
+                "    {variable}: {count} values out of tolerance from index "
+                "{first_index}, max error {max_error}".format(**mismatch)
+                if "first_index" in mismatch
+                else "    {variable}: {count} levels differ".format(**mismatch)
+            )
+    print("{} bulletins validated, {} failed".format(len(results), failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Watch mode, encoding the QC files as they land instead of once per cycle
+- Watcher - picks up new and rewritten files and hands them to a Wrapper
+- InotifyWaiter - wakes the watcher on directory events, Linux only
+- PollingWaiter - sleeps between scans where inotify is not available
+"""
+
+import os
+import sys
+import time
+import fnmatch
+import logging
+import select
+import struct
+import threading
+
+# inotify(7) events of a file written, closed or moved into the directory
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWaiter(object):
+    """Waits for the next scan by sleeping"""
+
+    def __init__(self, stop):
+        self.stop = stop
+
+    def wait(self, timeout):
+        self.stop.wait(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+class InotifyWaiter(object):
+    """
+    Waits for the next scan until something is written in `directory`.
+
+    Args:
+        directory (str): The directory to watch.
+
+    Raises:
+        OSError: If inotify is not available, e.g. on another system than Linux.
+    """
+
+    def __init__(self, directory):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), directory)
+
+    def wait(self, timeout):
+        """
+        Returns:
+            bool: Whether events arrived before `timeout` seconds.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        # The events only wake the watcher, the scan finds what changed
+        try:
+            while os.read(self._fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self._fd)
+
+
+class Watcher(object):
+    """
+    Encodes the files of `directory` matching `pattern` once they stop changing.
+
+    The directory is scanned when inotify reports a change and at least
+    every `interval` seconds, so events lost on an overflowed queue are
+    caught up. A file is only handed to the wrapper once its size and
+    modification time have not changed for `settle` seconds, which skips
+    files still being written. A file rewritten later is encoded again.
+
+    The files already in the directory at start are only encoded when the
+    wrapper keeps an index, which skips those published before a restart.
+
+    Args:
+        wrapper (Wrapper): Checks and encodes each batch of settled files.
+        directory (str): The directory where the QC files are written.
+        pattern (str, optional): Shell pattern of the files to encode.
+            Defaults to "*_qc.nc".
+        settle (float, optional): Seconds a file must stay unchanged.
+            Defaults to 5.
+        interval (float, optional): Maximum seconds between two scans.
+            Defaults to 10.
+        inotify (bool, optional): Whether to wake up on inotify events, the
+            directory is only polled if False or unavailable. Defaults to True.
+        logger (logging.Logger, optional): The logger object for logging messages.
+    """
+
+    def __init__(
+        self,
+        wrapper,
+        directory,
+        pattern="*_qc.nc",
+        settle=5.0,
+        interval=10.0,
+        inotify=True,
+        logger=logging,
+    ):
+        self.wrapper = wrapper
+        self.directory = directory
+        self.pattern = pattern
+        self.settle = settle
+        self.interval = interval
+        self.inotify = inotify
+        self.logger = logger
+        self.stop = threading.Event()
+        # path -> (mtime_ns, size) of the files encoded or waiting to settle
+        self._seen = {}
+        self._pending = {}
+
+    def _waiter(self):
+        if self.inotify:
+            try:
+                return InotifyWaiter(self.directory)
+            except OSError as exc:
+                self.logger.warning(
+                    "inotify unavailable, polling {} every {}s: {}".format(
+                        self.directory, self.interval, exc
+                    )
+                )
+        return PollingWaiter(self.stop)
+
+    def _scan(self, now):
+        """Queues the files that are new or changed since they were last seen"""
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not fnmatch.fnmatch(entry.name, self.pattern):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    key = (stat.st_mtime_ns, stat.st_size)
+                    if self._seen.get(entry.path) == key:
+                        continue
+                    pending = self._pending.get(entry.path)
+                    if pending is None or pending[0] != key:
+                        self._pending[entry.path] = (key, now)
+        except OSError as exc:
+            # e.g. a network mount briefly gone, the next poll scans again
+            self.logger.error("Could not scan {}: {}".format(self.directory, exc))
+
+    def _settled(self, now):
+        """Returns the queued files unchanged for `settle` seconds, oldest first"""
+        ready = [
+            path
+            for path, (key, since) in self._pending.items()
+            if now - since >= self.settle
+        ]
+        ready.sort(key=lambda path: self._pending[path][1])
+        for path in ready:
+            self._seen[path] = self._pending.pop(path)[0]
+        return ready
+
+    def _timeout(self, now):
+        if not self._pending:
+            return self.interval
+        first = min(since for _, since in self._pending.values())
+        return max(0.0, min(self.interval, first + self.settle - now))
+
+    def _encode(self, filelist):
+        self.logger.info("Encoding {} new files".format(len(filelist)))
+        try:
+            saved_files = self.wrapper.encode_batch(filelist)
+        except Exception as exc:
+            self.logger.error("Could not encode {}: {}".format(filelist, exc))
+            return
+        for GTS_filename in saved_files["filelist"]:
+            self.logger.info("Encoded {}".format(GTS_filename))
+
+    def run(self):
+        """
+        Watches the directory until `stop` is set, e.g. from another thread or
+        a signal handler.
+        """
+        self._scan(time.monotonic())
+        if self.wrapper._index is None:
+            # Without an index the files of previous runs cannot be told apart
+            self._seen.update((path, key) for path, (key, _) in self._pending.items())
+            self._pending.clear()
+        waiter = self._waiter()
+        try:
+            while not self.stop.is_set():
+                now = time.monotonic()
+                ready = self._settled(now)
+                if ready:
+                    self._encode(ready)
+                    continue
+                waiter.wait(self._timeout(now))
+                if not self.stop.is_set():
+                    self._scan(time.monotonic())
+        finally:
+            waiter.close()
@@ -0,0 +1,67 @@
+"""Times importing the wrapper and running a cycle with nothing to publish
+
+Each repeat runs in a fresh interpreter, so nothing is cached between
+them. The heavy dependencies, ecCodes, numpy, pandas, xarray and seawater,
+must not be loaded by such a cycle, and the best time must stay within
+the budget, otherwise the exit status is 1.
+
+Usage: python benchmarks/bench_import.py [-r REPEAT] [--budget MS]
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+
+HEAVY_MODULES = ["eccodes", "gribapi", "numpy", "pandas", "xarray", "seawater", "netCDF4"]
+
+# Runs in the child interpreter, prints the import and cycle times and the heavy modules loaded
+EMPTY_CYCLE = """
+import sys, json, time, logging
+logging.disable(logging.CRITICAL)
+start = time.perf_counter()
+from GTS_encode.GTS_encode_wrapper import Wrapper
+imported = time.perf_counter()
+Wrapper(filelist=[], out_dir="GTS").run()
+done = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "cycle": done - start,
+    "loaded": sorted(name for name in %r if name in sys.modules),
+}))
+"""
+
+
+def run_once():
+    completed = subprocess.run(
+        [sys.executable, "-c", EMPTY_CYCLE % (HEAVY_MODULES,)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=100.0, help="Milliseconds")
+    args = parser.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.repeat)]
+    best_import = min(run["import"] for run in runs) * 1000
+    best_cycle = min(run["cycle"] for run in runs) * 1000
+    loaded = sorted(set(name for run in runs for name in run["loaded"]))
+    print(f"import={best_import:.1f}ms empty cycle={best_cycle:.1f}ms budget={args.budget:.0f}ms")
+    failed = False
+    if loaded:
+        print(f"Heavy modules loaded: {', '.join(loaded)}")
+        failed = True
+    if best_cycle > args.budget:
+        print("Empty cycle over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
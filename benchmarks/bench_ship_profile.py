@@ -0,0 +1,42 @@
+"""Compares the level loop and the bulk array encoding of the ship template
+
+Usage: python benchmarks/bench_ship_profile.py [n_samples ...]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+from GTS_encode.GTS_encode import GTS_encode_ship
+from synthetic import write_dataset
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+
+
+def time_encode(filename, outdir, bulk, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        GTS = GTS_encode_ship(filename, 69, outdir, upcast=False, bulk=bulk)
+        GTS.create_variables_from_netcdf()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            output = GTS.create_bufr_file()
+        best = min(best, time.perf_counter() - start)
+        os.remove(output)
+    return best
+
+
+def main(sizes):
+    print(f"{'samples':>8} {'loop [s]':>10} {'bulk [s]':>10} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_samples in sizes:
+            filename = write_dataset(n_samples, tmpdir)
+            loop = time_encode(filename, tmpdir, bulk=False)
+            bulk = time_encode(filename, tmpdir, bulk=True)
+            print(f"{n_samples:>8} {loop:>10.4f} {bulk:>10.4f} {loop / bulk:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or DEFAULT_SIZES)
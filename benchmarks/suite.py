@@ -0,0 +1,289 @@
+"""Times each stage of the encoding pipeline for every template and profile size
+
+Each template and size runs in a fresh process on a synthetic file, and
+the results are written as JSON so two commits can be compared. Sizes up
+to 100000 samples are supported, but the ecCodes descriptor expansion of
+the largest profiles takes over 15 minutes per template, so they are only
+run when asked for with -s.
+
+Usage:
+    python benchmarks/suite.py [-s N ...] [-t TEMPLATE ...] [-r REPEAT] [-o OUTPUT]
+    python benchmarks/suite.py --compare BASE.json NEW.json [--threshold 1.2]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import xarray as xr
+
+from GTS_encode import GTS_encode
+from GTS_encode.handles import HeaderCache
+from GTS_encode.plans import PlanCache
+from GTS_encode.reader import qc_mask
+from GTS_encode.utils import pres, upcast_start
+from synthetic import write_dataset
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+TEMPLATES = ["GTS_encode_ship", "GTS_encode_glider", "GTS_encode_subfloat"]
+STAGES = [
+    "open",
+    "qc_filter",
+    "extract_upcast",
+    "pres",
+    "read",
+    "header",
+    "plan",
+    "message",
+    "write",
+]
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Metadata the subfloat template takes instead of the file attributes
+SUBFLOAT_METADATA = {
+    "centre code": 69,
+    "internal ship id": 58,
+    "sensor model": "Moana TD",
+    "sensor serial": "58",
+}
+
+
+class StageTimer(object):
+    """Keeps the best time of each stage over the repeats"""
+
+    def __init__(self):
+        self.best = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.best[stage] = min(elapsed, self.best.get(stage, float("inf")))
+
+    def wrap(self, stage, func):
+        """Times every call of `func` as `stage`"""
+
+        def timed(*args, **kwargs):
+            with self(stage):
+                return func(*args, **kwargs)
+
+        return timed
+
+
+def make_encoder(template, filename, outdir, ds):
+    GTS_encoding = getattr(GTS_encode, template)
+    if template == "GTS_encode_ship":
+        return GTS_encoding(filename, 69, outdir, ds=ds)
+    if template == "GTS_encode_glider":
+        return GTS_encoding(filename, 69, ds=ds)
+    return GTS_encoding(filename, SUBFLOAT_METADATA, ds=ds)
+
+
+def run_stages(template, filename, outdir, timer):
+    with timer("open"):
+        ds = xr.open_dataset(filename)
+    try:
+        with timer("qc_filter"):
+            index = np.flatnonzero(qc_mask(ds["QC_FLAG"].values, 1))
+            depths = ds["DEPTH"].values[index]
+        with timer("extract_upcast"):
+            start = upcast_start(depths)
+        latitudes = ds["LATITUDE"].values[index[start:]]
+        with timer("pres"):
+            pres(depths[start:], latitudes)
+
+        GTS = make_encoder(template, filename, outdir, ds)
+        with timer("read"):
+            GTS.create_variables_from_netcdf()
+        # Cold caches, so the header and plan are built as for the first
+        # profile of a cycle
+        cache = HeaderCache()
+        cache.new_message = timer.wrap("header", cache.new_message)
+        GTS.header_cache = cache
+        plans = PlanCache()
+        plans.compile = timer.wrap("plan", plans.compile)
+        GTS.plan_cache = plans
+        with timer("message"):
+            ibufr = GTS.create_bufr_message()
+        # Only the packing and writing of the message built above is timed,
+        # create_bufr_file releases it even when the write fails
+        GTS.create_bufr_message = lambda: ibufr
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            with timer("write"):
+                GTS.create_bufr_file()
+        plans.clear()
+        cache.clear()
+    finally:
+        ds.close()
+
+
+def run_case(template, n_samples, repeat=1):
+    """
+    Runs all the stages of a template on a synthetic file of `n_samples`.
+
+    Returns:
+        dict: The best time of each stage in seconds, the peak memory traced
+            by Python, the maximum resident set size of the process and the
+            error of the first stage that failed, if any.
+    """
+    timer = StageTimer()
+    result = {"template": template, "n_samples": n_samples, "error": None}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = write_dataset(n_samples, tmpdir)
+        # Anything written relative to the working directory stays in tmpdir
+        os.chdir(tmpdir)
+        tracemalloc.start()
+        try:
+            for _ in range(repeat):
+                run_stages(template, filename, tmpdir, timer)
+        except Exception as exc:
+            result["error"] = f"{type(exc).__name__}: {exc}"
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    result["stages"] = {stage: timer.best[stage] for stage in STAGES if stage in timer.best}
+    result["peak_traced_bytes"] = peak
+    # ru_maxrss is in kilobytes on Linux
+    result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run_suite(templates, sizes, repeat=1):
+    """Runs every template and size in its own process and returns the report"""
+    results = []
+    for template in templates:
+        for n_samples in sizes:
+            # One process per case, so the resident set size is not carried over
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(run_case, template, n_samples, repeat)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as exc:
+                    # The large sizes can exhaust the memory of small machines
+                    result = {
+                        "template": template,
+                        "n_samples": n_samples,
+                        "error": f"Worker process died: {exc}",
+                        "stages": {},
+                        "peak_traced_bytes": None,
+                        "max_rss_kb": None,
+                    }
+            results.append(result)
+            print_result(result)
+    return {
+        "commit": git_commit(),
+        "date": dt.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def print_result(result):
+    stages = " ".join(
+        f"{stage}={seconds * 1000:.2f}ms" for stage, seconds in result["stages"].items()
+    )
+    memory = ""
+    if result["max_rss_kb"] is not None:
+        memory = (
+            f"peak={result['peak_traced_bytes'] / 2**20:.1f}MiB "
+            f"rss={result['max_rss_kb'] / 1024:.0f}MiB "
+        )
+    print(f"{result['template']:<20} {result['n_samples']:>7} {memory}{stages}", flush=True)
+    if result["error"]:
+        print(f"{'':<28} failed: {result['error']}")
+
+
+def compare(base, new, threshold=1.2):
+    """
+    Prints the ratio of each stage time and of the resident set size between two reports.
+
+    Returns:
+        list: The (template, n_samples, stage, ratio) above `threshold`.
+    """
+    base_results = {(r["template"], r["n_samples"]): r for r in base["results"]}
+    regressions = []
+    print(f"{base['commit']} -> {new['commit']}")
+    for result in new["results"]:
+        key = (result["template"], result["n_samples"])
+        if key not in base_results:
+            continue
+        for stage, seconds in result["stages"].items():
+            before = base_results[key]["stages"].get(stage)
+            if not before:
+                continue
+            ratio = seconds / before
+            flag = " <-- slower" if ratio > threshold else ""
+            print(
+                f"{key[0]:<20} {key[1]:>7} {stage:<15} "
+                f"{before * 1000:>10.2f}ms {seconds * 1000:>10.2f}ms {ratio:>6.2f}x{flag}"
+            )
+            if ratio > threshold:
+                regressions.append((key[0], key[1], stage, ratio))
+        before = base_results[key]["max_rss_kb"]
+        if before and result["max_rss_kb"]:
+            ratio = result["max_rss_kb"] / before
+            flag = " <-- larger" if ratio > threshold else ""
+            print(
+                f"{key[0]:<20} {key[1]:>7} {'max_rss':<15} "
+                f"{before / 1024:>9.0f}MiB {result['max_rss_kb'] / 1024:>9.0f}MiB {ratio:>6.2f}x{flag}"
+            )
+            if ratio > threshold:
+                regressions.append((key[0], key[1], "max_rss", ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("-t", "--templates", nargs="+", default=TEMPLATES, choices=TEMPLATES)
+    parser.add_argument("-r", "--repeat", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"))
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path) as f:
+                reports.append(json.load(f))
+        return 1 if compare(*reports, threshold=args.threshold) else 0
+
+    report = run_suite(args.templates, args.sizes, args.repeat)
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""Synthetic Mangopare files for the benchmarks
+- make_dataset - dataset with the variables and attributes used by the templates
+- write_dataset - write a synthetic dataset to a file named like the QC output
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def make_dataset(n_samples, max_depth=200.0, start="2023-02-28T08:11:00", freq="1s"):
+    """Builds a down/up cast with `n_samples` points in Mangopare QC format"""
+    half = n_samples // 2
+    depth = np.concatenate(
+        [
+            np.linspace(1.0, max_depth, n_samples - half),
+            np.linspace(max_depth, 1.0, half + 1)[1:],
+        ]
+    )
+    time = pd.date_range(start, periods=n_samples, freq=freq)
+    lat = np.linspace(-36.1648, -36.1646, n_samples)
+    lon = np.linspace(175.3315, 175.3317, n_samples)
+    temperature = 20.0 - depth * 0.02
+    ds = xr.Dataset(
+        {
+            "TEMPERATURE": ("DATETIME", temperature),
+            "DEPTH": ("DATETIME", depth),
+            "QC_FLAG": ("DATETIME", np.ones(n_samples, dtype="int64")),
+        },
+        coords={
+            "DATETIME": time,
+            "LATITUDE": ("DATETIME", lat),
+            "LONGITUDE": ("DATETIME", lon),
+        },
+    )
+    ds.attrs = {
+        "deck_unit_serial_number": "5107",
+        "moana_serial_number": "58",
+        "platform_code": "msn58du5107",
+        "internal_id": "SHIP123",
+        "wigos_id": "0-22000-0-MSN58",
+        "public": "True",
+        "publication_date": "01/01/2023",
+    }
+    return ds
+
+
+def write_dataset(n_samples, outdir, **kwargs):
+    """Writes a synthetic dataset and returns its path"""
+    filename = os.path.join(outdir, f"MOANA_0058_{n_samples}_230228081912_qc.nc")
+    make_dataset(n_samples, **kwargs).to_netcdf(filename)
+    return filename